@@ -17,3 +17,7 @@ from config_global import TOKENS_READ_ONLY, TOKENS_FULL_ACCESS, DIR_CANDLES, DIR
 
 FILEPATH_ENV = DIR_GLOBAL / '.tinkoff_tokens.env'
 FILEPATH_LOGGER = (DIR_PROJECT / DIR_PROJECT.name).with_suffix('.log')
+DIR_CHECKPOINTS = DIR_PROJECT / 'checkpoints'
+DIR_PLOTS = DIR_PROJECT / 'plots'
+DIR_GOLDEN = DIR_PROJECT / 'golden'
+DIR_CANDLES_ARCHIVE = DIR_PROJECT / 'candles_archive'
@@ -13,7 +13,7 @@ async def main():
 
 
 if __name__ == "__main__":
-    get_logger(FILEPATH_LOGGER)
+    get_logger(FILEPATH_LOGGER, queued=True)
 
     try:
         asyncio.run(main())
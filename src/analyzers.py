@@ -0,0 +1,233 @@
+import os
+import math
+import pickle
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+from backtrader import Analyzer, Trade, num2date
+
+from src.typed_dicts import AnalysisTrade, AnalysisEquity, AnalysisMemory, AnalysisScreening
+from src.data_feeds import UNIX_EPOCH_NUM
+from src.helpers import get_peak_rss_mb
+from src.memory import MB, get_deep_size, get_lines_size
+from src.snapshots import Snapshot, get_analyzer_state, set_analyzer_state, get_num_cut_max
+
+
+class TradeList(Analyzer):
+    def __init__(self):
+        self.trades: list[AnalysisTrade] = []
+        self._sizes: dict[int, float] = {}
+
+    def notify_trade(self, trade: Trade):
+        # trade is notified on every execution, the size can grow if orders are stacked
+        if trade.size:
+            self._sizes[trade.ref] = max(self._sizes.get(trade.ref, 0), trade.size, key=abs)
+
+        if trade.isclosed:
+            size = self._sizes.pop(trade.ref)
+            self.trades.append(AnalysisTrade(
+                ticker=trade.data._name,
+                dt_open=num2date(trade.dtopen),
+                dt_close=num2date(trade.dtclose),
+                price_open=trade.price,
+                price_close=trade.price + trade.pnl / size,
+                size=size,
+                pnl=trade.pnl,
+                pnlcomm=trade.pnlcomm,
+                bars=trade.barlen,
+            ))
+
+    def get_analysis(self) -> list[AnalysisTrade]:
+        return self.trades
+
+
+class ScreeningStats(Analyzer):
+    # the only analyzer of screening runs: pnl of closed trades, as `get_metric` of full runs, and max drawdown
+    # on every bar
+    def start(self):
+        self.count_trades = 0
+        self.pnl = 0.
+        self._value_peak = self.strategy.broker.getvalue()
+        self._max_drawdown = 0.
+
+    def notify_trade(self, trade: Trade):
+        if trade.isclosed:
+            self.count_trades += 1
+            self.pnl += trade.pnlcomm
+
+    def next(self):
+        value = self.strategy.broker.getvalue()
+        self._value_peak = max(self._value_peak, value)
+        self._max_drawdown = max(self._max_drawdown, (self._value_peak - value) / self._value_peak * 100)
+
+    def stop(self):
+        self.analysis = AnalysisScreening(
+            value=self.strategy.broker.getvalue(),
+            pnl=self.pnl,
+            count_trades=self.count_trades,
+            max_drawdown=self._max_drawdown,
+        )
+
+    def get_analysis(self) -> AnalysisScreening:
+        return self.analysis
+
+
+class ShardEnd(Analyzer):
+    # a shard runs after its end only until positions opened inside it are closed
+    def next(self):
+        strategy = self.strategy
+        if strategy.shard is None or strategy.datetime[0] < strategy.shard[1]:
+            return
+        if not any(strategy.getposition(d).size for d in strategy.feeds) and not strategy.broker.get_orders_open():
+            strategy.env.runstop()
+
+
+class AnnualReturnRolling(Analyzer):
+    # Returns by years of the strategy's clock, values are taken on every bar instead of walking the lines
+    # history in `stop`, which `exactbars` doesn't keep. Backtrader's AnnualReturn pairs dates of data0 with
+    # the last len(data0) broker values, so with several feeds and gaps in data0 its years are shifted and
+    # the first bars are dropped. With one feed or data0 without gaps both give the same
+    def start(self):
+        self.rets: list[float] = []
+        self.ret: OrderedDict[int, float] = OrderedDict()
+        self._year = -1
+        self._value_start = 0.
+        self._value_end = 0.
+
+    def next(self):
+        year = self.strategy.datetime.date(0).year
+        value = self.strategy.broker.getvalue()
+        if year > self._year:
+            if self._year >= 0:
+                self._add_year()
+                self._value_start = self._value_end
+            else:
+                self._value_start = value
+            self._year = year
+        self._value_end = value
+
+    def stop(self):
+        if self._year >= 0 and self._year not in self.ret:
+            self._add_year()
+
+    def _add_year(self) -> None:
+        annual_return = self._value_end / self._value_start - 1
+        self.rets.append(annual_return)
+        self.ret[self._year] = annual_return
+
+    def get_analysis(self) -> OrderedDict[int, float]:
+        return self.ret
+
+
+class SignalList(Analyzer):
+    # entries recorded by strategies with SIGNAL_PARAMS, OptReturn keeps analyzers only
+    def __init__(self):
+        self.signals: dict[str, list[float]] = {}
+
+    def stop(self):
+        self.signals = self.strategy.signals
+
+    def get_analysis(self) -> dict[str, list[float]]:
+        return self.signals
+
+
+class EquityCurve(Analyzer):
+    # broker value on every bar, kept in flat arrays so a minute history stays small
+    def __init__(self):
+        self._nums = array('d')
+        self._values = array('d')
+        self.equity = AnalysisEquity(times=np.array([], dtype=np.int64), values=np.array([]))
+
+    def next(self):
+        self._nums.append(self.strategy.datetime[0])
+        self._values.append(self.strategy.broker.getvalue())
+
+    def stop(self):
+        nums = np.frombuffer(self._nums, dtype=np.float64)
+        self.equity = AnalysisEquity(
+            times=np.round((nums - UNIX_EPOCH_NUM) * 86400).astype(np.int64),
+            values=np.frombuffer(self._values, dtype=np.float64).copy(),
+        )
+
+    def get_analysis(self) -> AnalysisEquity:
+        return self.equity
+
+
+class MemoryUsage(Analyzer):
+    # must be added after other analyzers, they are measured after their `stop`
+    def __init__(self):
+        self.memory: AnalysisMemory | None = None
+
+    def stop(self):
+        strategy = self.strategy
+        line_buffers = {data._name: get_lines_size(data) / MB for data in strategy.datas}
+        line_buffers['strategy'] = (get_lines_size(strategy) + sum(
+            get_lines_size(x) for x in [*strategy.getindicators(), *strategy.getobservers()]
+        )) / MB
+        self.memory = AnalysisMemory(
+            pid=os.getpid(),
+            peak_rss_mb=get_peak_rss_mb(),
+            line_buffers=line_buffers,
+            strategy_state=get_deep_size(vars(strategy)) / MB,
+            analyzers={name: get_deep_size(vars(a)) / MB for name, a in zip(strategy.analyzers.getnames(),
+                                                                           strategy.analyzers) if a is not self},
+        )
+
+    def get_analysis(self) -> AnalysisMemory:
+        return self.memory
+
+
+class StateSnapshot(Analyzer):
+    # Restores `snapshot` on start, so it must be added after the analyzers it restores. A new snapshot is taken
+    # on the first bar of a day before the cut (see `get_num_cut_max`) if the previous bar left no positions
+    # and orders, the latest one is kept pickled. Positions would need backtrader orders and trades rebuilt.
+    # Only the last `days` before the cut are snapshotted, so the state isn't pickled on every day of the history,
+    # without a flat day start there the previous snapshot is kept
+    params = (
+        ('snapshot', None),
+        ('days', 10),
+    )
+
+    def __init__(self):
+        self.snapshot: bytes | None = None
+        self._num_cut_max = -math.inf
+        self._day_last: int | None = None
+        self._is_flat = False
+
+    def start(self):
+        strategy = self.strategy
+        self._num_cut_max = min(get_num_cut_max(data.candles) for data in strategy.feeds)
+        self._analyzers = {name: a for name, a in zip(strategy.analyzers.getnames(), strategy.analyzers)
+                           if not isinstance(a, (StateSnapshot, MemoryUsage))}
+
+        snapshot: Snapshot | None = self.p.snapshot
+        if snapshot is not None:
+            strategy.broker.set_cash(snapshot.cash)
+            strategy.set_state(snapshot.strategy)
+            for name, analyzer in self._analyzers.items():
+                set_analyzer_state(analyzer, snapshot.analyzers[name])
+
+    def notify_fund(self, cash, value, fundvalue, shares):
+        # called before `next` of the strategy, when its previous bar was processed by all analyzers.
+        # Without positions and orders the broker didn't change anything on this bar
+        strategy = self.strategy
+        day = int(strategy.datetime[0])
+        if (self._is_flat and self._day_last is not None and self._day_last < day <= self._num_cut_max
+                and day > self._num_cut_max - self.p.days):
+            self.snapshot = pickle.dumps(Snapshot(
+                num_resume=strategy.datetime[0],
+                cash=cash,
+                strategy=strategy.get_state(),
+                analyzers={name: get_analyzer_state(a) for name, a in self._analyzers.items()},
+            ))
+        self._day_last = day
+
+    def next(self):
+        # orders submitted on this bar are moved to pending by the broker on the next one
+        strategy, broker = self.strategy, self.strategy.broker
+        self._is_flat = (not broker.pending and not broker.submitted and
+                         not any(strategy.getposition(d).size for d in strategy.feeds))
+
+    def get_analysis(self) -> bytes | None:
+        return self.snapshot
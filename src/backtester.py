@@ -1,17 +1,69 @@
+import time
+import heapq
+import pickle
+import asyncio
 import logging
+import contextvars
+from threading import Event
+from datetime import datetime, time as dt_time
+from functools import partial
+from contextlib import suppress
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from collections import defaultdict
+from typing import Type, Any, Callable
 
-from backtrader import Cerebro, OptReturn, TimeFrame
-from backtrader.analyzers import SharpeRatio, AnnualReturn, TimeDrawDown, PeriodStats, TradeAnalyzer
-from btplotting import BacktraderPlotting
+from backtrader import Cerebro, OptReturn, TimeFrame, date2num
+from backtrader.analyzers import SharpeRatio, TimeDrawDown, PeriodStats, TradeAnalyzer
+from tinkoff.invest import CandleInterval
+from my_tinkoff.schemas import Candles
 
+from config import DIR_PLOTS
 from src.schemas import InstrumentData
+from src.cerebro import IsolatedBrokersCerebro, CANCEL_EVENT
+from src.exceptions import BacktestCancelled
+from src.analyzers import (
+    TradeList,
+    SignalList,
+    EquityCurve,
+    AnnualReturnRolling,
+    MemoryUsage,
+    ScreeningStats,
+    ShardEnd,
+    StateSnapshot,
+)
+from src.candle_arrays import CandleArrays
+from src.panel import CandlePanel
+from src.data_feeds import DataFeedCandles, DataFeedPanel, DataFeedReplay, ReplayClock
+from src.brokers import PanelBroker, LightBroker, LightPanelBroker
+from src.plotting import plot_backtest
+from src.helpers import get_peak_rss_mb
+from src.memory import MB, get_candles_size
+from src.top_k import TopK, Metric, MetricSummary, get_metric
+from src.screening import ScreeningMetric, ScreeningReport, get_screening_metric
+from src.latency import LatencyReport, make_timed_strategy, get_latency_report
+from src.sharding import (
+    Shard,
+    ShardedResult,
+    get_shards,
+    split_warmup,
+    get_compound_factors,
+    scale_trade,
+    stitch_equity,
+    compare_with_serial,
+)
 from src.strategies.base import BaseStrategy
 from src.schemas import StrategyData, StrategyResult
-from src.params import ParamsSharpe, ParamsPeriodStats
+from src.params import ParamsSharpe, ParamsPeriodStats, expand_params, get_param_repr
+from src.checkpoints import OptimizationCheckpoint, get_combo_key
+from src.snapshots import SnapshotStore, slice_candles_from
+from src.work_queue import WorkQueue, WorkTask
 from src.typed_dicts import (
     AnalysisSharpe,
     AnalysisDrawDown,
     AnalysisPeriodStats,
+    AnalysisEquity,
+    MemoryReport,
 )
 
 
@@ -20,7 +72,24 @@ class Backtester:
     COMMISSION: float = .0004
     LOGGING: bool = True
     PLOTTING: bool = False
+    PLOTS_DIR: Path = DIR_PLOTS
     CPU_CORES_COUNT: int = 1
+    BOUNDED_MEMORY: bool = False
+    CHECKPOINT_DIR: Path | None = None
+    SIGNAL_CACHE: bool = False
+    # feeds are aligned on one clock of all timestamps, see CandlePanel
+    PANEL: bool = False
+    # a broker of only long market and bracket orders with a flat commission, see LightBroker
+    LIGHT_BROKER: bool = False
+    # sizes of candles, line buffers, strategy state, analyzers and results are attached to every result
+    MEMORY_REPORT: bool = False
+    # optimization keeps only the best combos by the metric and summary stats of all of them
+    TOP_K: int | None = None
+    TOP_K_METRIC: Metric = 'sharpe'
+    # `run` saves the state there and a later run on extended candles processes only bars after it.
+    # The state is taken on the latest flat day start of the last SNAPSHOT_DAYS calendar days before the cut
+    SNAPSHOT_DIR: Path | None = None
+    SNAPSHOT_DAYS: int = 10
 
     params_sharpe = ParamsSharpe(
         timeframe=TimeFrame.Days,
@@ -40,81 +109,622 @@ class Backtester:
     def __init__(self, strategies_data: list[StrategyData], instruments_data: list[InstrumentData]):
         self._instruments_data = instruments_data
         self._strategies_data = strategies_data
+        self.top_k_summary: MetricSummary | None = None
+        self.screening_report: ScreeningReport | None = None
+        # strategies of the last `run`
+        self.strategies: list[BaseStrategy] = []
 
         for sd in strategies_data:
             sd.strategy.LOGGING = self.LOGGING
 
     def run(self) -> list[StrategyResult]:
+        peak_rss_start = get_peak_rss_mb()
+        results = self._run()
+        if self.MEMORY_REPORT:
+            self._attach_memory_report(results=results, peak_rss_start=peak_rss_start)
+        return results
+
+    def optimize(self) -> list[StrategyResult]:
+        peak_rss_start = get_peak_rss_mb()
+        results = self._optimize()
+        if self.MEMORY_REPORT:
+            self._attach_memory_report(results=results, peak_rss_start=peak_rss_start)
+        return results
+
+    async def run_async(self, executor: Executor | None = None) -> list[StrategyResult]:
+        return await self._run_in_executor(self.run, executor)
+
+    async def optimize_async(self, executor: Executor | None = None) -> list[StrategyResult]:
+        return await self._run_in_executor(self.optimize, executor)
+
+    @staticmethod
+    async def _run_in_executor(
+            func: Callable[[], list[StrategyResult]],
+            executor: Executor | None,
+    ) -> list[StrategyResult]:
+        # The event loop keeps serving downloads while cerebro runs in a thread (the loop's default executor).
+        # A cancelled run stops on its next bar, see IsolatedBrokersCerebro, an optimization with CPU_CORES_COUNT
+        # > 1 stops on the next finished combo. A process pool executor gets a pickled copy of the backtester and
+        # class attributes of the worker, its started jobs can't be stopped from here
+        loop = asyncio.get_running_loop()
+        if isinstance(executor, ProcessPoolExecutor):
+            return await loop.run_in_executor(executor, func)
+
+        event = Event()
+        context = contextvars.copy_context()
+        context.run(CANCEL_EVENT.set, event)
+
+        def run_job() -> list[StrategyResult]:
+            if event.is_set():
+                raise BacktestCancelled
+            return func()
+
+        future = loop.run_in_executor(executor, context.run, run_job)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # the thread is waited for, so no CPU work is left behind the cancelled task
+            event.set()
+            with suppress(BacktestCancelled):
+                await future
+            raise
+
+    def run_sharded(self, count_shards: int, verify: bool = False) -> ShardedResult:
+        # The date range is split into shards which run on separate processes. A shard builds the strategy's state
+        # on a warm-up of its declared lookback and the state of the history before it, opens entries only inside
+        # the shard and runs after its end until they are closed. Each shard has its own broker with the start cash,
+        # trades and equity are compounded over the shards before it.
+        if len(self._strategies_data) != 1:
+            raise Exception('Sharding is supported for one strategy')
+        sd = self._strategies_data[0]
+        self._unpack_params(sd)
+        lookback_days = sd.strategy.get_lookback_days(sd.params)
+        if lookback_days is None:
+            raise Exception(f'{sd.strategy.__name__} declares no lookback, it can not be sharded')
+
+        # feeds never load their last candle
+        days = sorted({c.time.date() for i in self._instruments_data for c in i.data_feed.candles[:-1]})
+        shards = get_shards(days=days, count_shards=count_shards)
+        logging.info(f'{len(shards)} shards of {len(days)} days | Warm-up: {lookback_days} days')
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.CPU_CORES_COUNT) as executor:
+            futures = []
+            for shard in shards:
+                splits = [split_warmup(i.data_feed.candles, day_from=shard.day_from, lookback_days=lookback_days)
+                          for i in self._instruments_data]
+                futures.append(executor.submit(
+                    self._run_shard, sd, shard, self._ticker,
+                    [(i.ticker, candles, i.data_feed.p.timeframe)
+                     for i, (_, candles) in zip(self._instruments_data, splits)],
+                    sd.strategy.get_shard_state(sd.params, [candles_before for candles_before, _ in splits]),
+                ))
+            outputs = [f.result() for f in futures]
+        logging.info(f'Shards done in {round(time.perf_counter() - start, 2)}s')
+
+        results = [res for res, _ in outputs]
+        equities = [equity for _, equity in outputs]
+        factors = get_compound_factors(equities=equities, start_cash=self.START_CASH)
+        sharded = ShardedResult(
+            shards=results,
+            trades=sorted([scale_trade(t, factor) for res, factor in zip(results, factors) for t in res.trades],
+                          key=lambda t: (t['dt_close'], t['dt_open'])),
+            equity=stitch_equity(equities=equities, start_cash=self.START_CASH, factors=factors),
+            start_cash=self.START_CASH,
+        )
+        logging.info(sharded)
+
+        if verify:
+            start = time.perf_counter()
+            serial = self.run()[0]
+            logging.info(f'Serial run done in {round(time.perf_counter() - start, 2)}s')
+            if diffs := compare_with_serial(sharded=sharded, serial=serial):
+                raise Exception(f'{len(diffs)} trades differ from the serial run:\n' + '\n'.join(diffs))
+            logging.info(f'All {len(serial.trades)} trades match the serial run')
+        return sharded
+
+    def replay(self, seconds_per_bar: float | None = None, bucket_minutes: int = 1) -> LatencyReport:
+        # Bars are pushed one by one as in live trading, and the latency of the strategy's decisions
+        # is measured on every bar and for every ticker
+        if len(self._strategies_data) != 1:
+            raise Exception('Replay is supported for one strategy')
+        sd = self._strategies_data[0]
+        self._unpack_params(sd)
+
+        cerebro = self._setup_cerebro()
+        cerebro.addstrategy(make_timed_strategy(sd.strategy), **sd.params.__dict__, **sd.kwargs)
+        clock = ReplayClock(seconds_per_bar=seconds_per_bar)
+        for i in self._instruments_data:
+            data_feed = DataFeedReplay.from_candles_on_clock(candles=i.data_feed.candles,
+                                                            timeframe=i.data_feed.p.timeframe, clock=clock)
+            cerebro.adddata(data=data_feed, name=i.ticker)
+
+        strategy = cerebro.run(preload=False, runonce=False)[0]
+        report = get_latency_report(strategy=strategy, bucket_minutes=bucket_minutes)
+        logging.info(f'\n{report}')
+        return report
+
+    @classmethod
+    def _run_shard(
+            cls,
+            sd: StrategyData,
+            shard: Shard,
+            ticker: str,
+            instruments: list[tuple[str, Candles, TimeFrame]],
+            shard_state: dict[str, Any],
+    ) -> tuple[StrategyResult, AnalysisEquity]:
+        nums = (
+            date2num(datetime.combine(shard.day_from, dt_time())),
+            date2num(datetime.combine(shard.day_to, dt_time())) if shard.day_to else float('inf'),
+        )
+        cerebro = cls._setup_cerebro()
+        if not cls.PLOTTING:
+            cerebro.addanalyzer(EquityCurve, _name='equity')
+        cerebro.addanalyzer(ShardEnd, _name='shard_end')
+        cerebro.addstrategy(sd.strategy, **sd.params.__dict__, **sd.kwargs, shard=nums, shard_state=shard_state)
+        for t, candles, timeframe in instruments:
+            cerebro.adddata(data=DataFeedCandles.from_candles(candles=candles, timeframe=timeframe), name=t)
+
+        strategy = cerebro.run()[0]
+        res = cls._get_strategy_result(strategy=sd.strategy, ticker=ticker, strategy_run=strategy)
+        return res, strategy.analyzers.equity.get_analysis()
+
+    @staticmethod
+    def _unpack_params(sd: StrategyData) -> None:
+        for k, v in sd.params:
+            if isinstance(v, list):
+                if len(v) == 1:
+                    setattr(sd.params, k, v[0])
+                else:
+                    raise Exception(f'Parameter {k} has list value: {v}')
+
+    def _run(self) -> list[StrategyResult]:
         cerebro = self._setup_cerebro()
 
         for sd in self._strategies_data:
-            for k, v in sd.params:
-                if isinstance(v, list):
-                    if len(v) == 1:
-                        setattr(sd.params, k, v[0])
-                    else:
-                        raise Exception(f'Parameter {k} has list value: {v}')
+            self._unpack_params(sd)
+            cerebro.addstrategy(sd.strategy, **sd.params.__dict__, **sd.kwargs)
 
-            cerebro.addstrategy(sd.strategy, **sd.params.__dict__)
-        for instrument_data in self._instruments_data:
-            cerebro.adddata(data=instrument_data.data_feed, name=instrument_data.ticker)
+        snapshots, num_from = None, None
+        if self.SNAPSHOT_DIR is not None:
+            snapshots = self._get_snapshot_store()
+            snapshot = snapshots.load()
+            if snapshot is not None:
+                num_from = snapshot.num_resume
+                logging.info(f'Resuming from snapshot {snapshots.filepath} on {snapshot.dt_resume}')
+            cerebro.addanalyzer(StateSnapshot, _name='snapshot', snapshot=snapshot, days=self.SNAPSHOT_DAYS)
+        self._add_datas(cerebro, num_from=num_from)
 
         strategies = cerebro.run(maxcpus=self.CPU_CORES_COUNT)
+        self.strategies = strategies
+        if snapshots is not None:
+            if (snapshot_new := strategies[0].analyzers.snapshot.get_analysis()) is not None:
+                snapshots.save(snapshot_new)
+            else:
+                logging.warning(f'No new snapshot: positions or orders were open on every day start '
+                                f'of the last {self.SNAPSHOT_DAYS} days before the cut')
         results = []
         for strategy in strategies:
-            ticker = '+'.join([instr.ticker for instr in self._instruments_data])
-            res = self._get_strategy_result(strategy=strategy, ticker=ticker)
+            res = self._get_strategy_result(strategy=strategy.__class__, ticker=self._ticker, strategy_run=strategy)
             logging.info(f'\nparams={strategy.params.__dict__}\n{res}')
             results.append(res)
 
-            if self.PLOTTING:
-                # plotter = BacktraderPlotting(style='bar')
-                # cerebro.plot(plotter)
-                cerebro.plot(style='candlestick')
+        if self.PLOTTING:
+            self._plot(strategies=strategies, results=results)
+
+        logging.info(f'Peak RSS: {get_peak_rss_mb()} MB')
         return results
 
-    def optimize(self) -> list[StrategyResult]:
+    def _get_snapshot_store(self) -> SnapshotStore:
+        if len(self._strategies_data) != 1:
+            raise Exception('Snapshots are supported for a run of one strategy')
+        sd = self._strategies_data[0]
+        if not sd.strategy.STATE_ATTRS:
+            raise Exception(f'{sd.strategy.__name__} has no STATE_ATTRS to snapshot')
+
+        # candles are only appended, so history is identified by its start
+        spec = {
+            'strategy': sd.strategy.__name__,
+            'params': get_combo_key(sd.params.__dict__),
+            'kwargs': sorted(sd.kwargs),
+            'instruments': [(i.ticker, str(i.data_feed.candles[0].time)) for i in self._instruments_data],
+            'start_cash': self.START_CASH,
+            'commission': self.COMMISSION,
+        }
+        return SnapshotStore(dirpath=self.SNAPSHOT_DIR, spec=spec)
+
+    def _optimize(self) -> list[StrategyResult]:
         cerebro = self._setup_cerebro()
 
-        for sd in self._strategies_data:
-            for instrument_data in self._instruments_data:
-                cerebro.adddata(data=instrument_data.data_feed, name=instrument_data.ticker)
-            cerebro.optstrategy(sd.strategy, **sd.params.__dict__)
+        if self.CHECKPOINT_DIR is not None and self.SIGNAL_CACHE:
+            raise Exception('CHECKPOINT_DIR and SIGNAL_CACHE can not be used together')
+        elif self.TOP_K is not None and (self.CHECKPOINT_DIR is not None or self.SIGNAL_CACHE):
+            raise Exception('TOP_K can not be used with CHECKPOINT_DIR or SIGNAL_CACHE')
+        elif self.CHECKPOINT_DIR is not None:
+            return self._optimize_with_checkpoint(cerebro)
+        elif self.SIGNAL_CACHE:
+            return self._optimize_with_signal_cache()
+
+        self._add_datas(cerebro)
+        if len(self._strategies_data) > 1:
+            return self._optimize_in_one_pass(cerebro)
+
+        sd = self._strategies_data[0]
+        cerebro.optstrategy(sd.strategy, **sd.params.__dict__)
+        if self.TOP_K is not None:
+            top_k = TopK(k=self.TOP_K, metric=self.TOP_K_METRIC)
+            cerebro.optcallback(partial(self._push_top_k, top_k, sd.strategy, self._ticker))
+            cerebro.run(maxcpus=self.CPU_CORES_COUNT)
+            return self._get_top_k_results(top_k)
 
         strategies = cerebro.run(maxcpus=self.CPU_CORES_COUNT)
 
         results = []
         for strategy in strategies:
-            for opt_return in strategy:
-                ticker = '+'.join([instr.ticker for instr in self._instruments_data])
-                res = self._get_strategy_result(strategy=strategy.__class__, opt_return=opt_return, ticker=ticker)
-                logging.info(f'\nparams={opt_return.params.__dict__}\n{res}')
-                results.append(res)
+            opt_return = strategy[0]
+            res = self._get_strategy_result(strategy=sd.strategy, opt_return=opt_return, ticker=self._ticker)
+            logging.info(f'\nparams={opt_return.params.__dict__}\n{res}')
+            results.append(res)
+
+        logging.info(f'Peak RSS: {get_peak_rss_mb()} MB')
         return results
 
+    def _optimize_in_one_pass(self, cerebro: Cerebro) -> list[StrategyResult]:
+        # every combo of every strategy is a separate strategy instance with its own broker,
+        # so datas are iterated once instead of once per combo of the product of grids
+        for sd in self._strategies_data:
+            for kwargs in expand_params(sd.params):
+                cerebro.addstrategy(sd.strategy, **kwargs, **sd.kwargs)
+        strategies = cerebro.run()
+
+        if self.TOP_K is not None:
+            top_k = TopK(k=self.TOP_K, metric=self.TOP_K_METRIC)
+            for strategy in strategies:
+                top_k.push(
+                    value=get_metric(analyzers=strategy.analyzers, metric=top_k.metric, start_cash=self.START_CASH),
+                    get_result=partial(self._get_strategy_result, strategy=strategy.__class__, ticker=self._ticker,
+                                       strategy_run=strategy),
+                )
+            return self._get_top_k_results(top_k)
+
+        results = []
+        for strategy in strategies:
+            res = self._get_strategy_result(strategy=strategy.__class__, ticker=self._ticker, strategy_run=strategy)
+            logging.info(f'\nparams={strategy.params.__dict__}\n{res}')
+            results.append(res)
+
+        logging.info(f'Peak RSS: {get_peak_rss_mb()} MB')
+        return results
+
+    def _optimize_with_checkpoint(self, cerebro: Cerebro) -> list[StrategyResult]:
+        if len(self._strategies_data) != 1:
+            raise Exception('Checkpoints are supported for optimization of one strategy')
+        sd = self._strategies_data[0]
+
+        combos = {get_combo_key(kwargs): kwargs for kwargs in expand_params(sd.params)}
+        grid_keys = list(sd.params.__dict__)
+        spec = {
+            'strategy': sd.strategy.__name__,
+            'combos': list(combos),
+            'instruments': [
+                (i.ticker, str(i.data_feed.candles[0].time), str(i.data_feed.candles[-1].time))
+                for i in self._instruments_data
+            ],
+            'start_cash': self.START_CASH,
+            'commission': self.COMMISSION,
+            'bounded_memory': self.BOUNDED_MEMORY,
+        }
+        checkpoint = OptimizationCheckpoint(dirpath=self.CHECKPOINT_DIR, spec=spec)
+        results = checkpoint.load_results()
+        remaining = [k for k in combos if k not in results]
+        checkpoint.save_remaining(remaining)
+        logging.info(f'Checkpoint {checkpoint.dirpath} | Completed {len(results)}/{len(combos)} combos')
+
+        if remaining:
+            self._add_datas(cerebro)
+            # the same as `optstrategy`, but only with combos that are not completed yet
+            cerebro._dooptimize = True
+            cerebro.strats.append([(sd.strategy, (), combos[k]) for k in remaining])
+            # the callback is pickled to workers with cerebro, so it mustn't reference the backtester instance
+            cerebro.optcallback(partial(self._save_combo_result, checkpoint, sd.strategy, self._ticker, grid_keys))
+            cerebro.run(maxcpus=self.CPU_CORES_COUNT)
+            results = checkpoint.load_results()
+            checkpoint.save_remaining([k for k in combos if k not in results])
+
+        logging.info(f'Peak RSS: {get_peak_rss_mb()} MB')
+        return [results[k] for k in combos if k in results]
+
+    def _optimize_with_signal_cache(self) -> list[StrategyResult]:
+        if len(self._strategies_data) != 1:
+            raise Exception('Signal cache is supported for optimization of one strategy')
+        sd = self._strategies_data[0]
+        if not sd.strategy.SIGNAL_PARAMS:
+            raise Exception(f'{sd.strategy.__name__} has no SIGNAL_PARAMS')
+
+        combos = expand_params(sd.params)
+        groups: dict[str, list[int]] = defaultdict(list)
+        for i, kwargs in enumerate(combos):
+            groups[get_combo_key({k: kwargs[k] for k in sd.strategy.SIGNAL_PARAMS})].append(i)
+        logging.info(f'{len(combos)} combos in {len(groups)} signal groups')
+
+        # the first combo of a group computes entries ...
+        idxs_first = [g[0] for g in groups.values()]
+        opt_returns = self._run_combos(sd=sd, combos=[combos[i] for i in idxs_first], signals=True)
+        signals = {key: opt_return.analyzers.signals.get_analysis() for key, opt_return in zip(groups, opt_returns)}
+
+        # ... and the rest of combos only execute them
+        idxs_rest = [(key, i) for key, g in groups.items() for i in g[1:]]
+        opt_returns += self._run_combos(sd=sd, combos=[{**combos[i], 'signals': signals[key]} for key, i in idxs_rest],
+                                       signals=True)
+
+        results = []
+        idxs = idxs_first + [i for _, i in idxs_rest]
+        for _, opt_return in sorted(zip(idxs, opt_returns), key=lambda x: x[0]):
+            res = self._get_strategy_result(strategy=sd.strategy, opt_return=opt_return, ticker=self._ticker)
+            logging.info(f'\nparams={opt_return.params.__dict__}\n{res}')
+            results.append(res)
+
+        logging.info(f'Peak RSS: {get_peak_rss_mb()} MB')
+        return results
+
+    def screen(
+            self,
+            count_finalists: int,
+            metric: ScreeningMetric = 'pnl',
+            measure_full: bool = False,
+    ) -> list[StrategyResult]:
+        # Combos run only with ScreeningStats, the best of them are run again with all analyzers.
+        # With `measure_full` all combos are run with all analyzers too, for the time saved and the finalists
+        # which are in the real top
+        if len(self._strategies_data) != 1:
+            raise Exception('Screening is supported for one strategy')
+        elif count_finalists < 1:
+            raise Exception(f'count_finalists must be positive: {count_finalists}')
+        sd = self._strategies_data[0]
+        combos = expand_params(sd.params)
+
+        start = time.perf_counter()
+        opt_returns = self._run_combos(sd=sd, combos=combos, screening=True)
+        values = [
+            get_screening_metric(analysis=o.analyzers.screening.get_analysis(), metric=metric,
+                                 start_cash=self.START_CASH) for o in opt_returns
+        ]
+        idxs = heapq.nlargest(count_finalists, range(len(combos)), key=lambda i: values[i])
+        seconds_screening = time.perf_counter() - start
+
+        start = time.perf_counter()
+        opt_returns = self._run_combos(sd=sd, combos=[combos[i] for i in idxs])
+        seconds_finalists = time.perf_counter() - start
+
+        results = []
+        for opt_return in opt_returns:
+            res = self._get_strategy_result(strategy=sd.strategy, opt_return=opt_return, ticker=self._ticker)
+            logging.info(f'\nparams={opt_return.params.__dict__}\n{res}')
+            results.append(res)
+
+        self.screening_report = ScreeningReport(
+            count_combos=len(combos),
+            count_finalists=len(idxs),
+            seconds_screening=seconds_screening,
+            seconds_finalists=seconds_finalists,
+        )
+        if measure_full:
+            start = time.perf_counter()
+            opt_returns = self._run_combos(sd=sd, combos=combos)
+            self.screening_report.seconds_full = time.perf_counter() - start
+            values_full = [get_metric(analyzers=o.analyzers, metric=metric, start_cash=self.START_CASH)
+                           for o in opt_returns]
+            idxs_top = heapq.nlargest(count_finalists, range(len(combos)), key=lambda i: values_full[i])
+            self.screening_report.count_finalists_in_top = len(set(idxs) & set(idxs_top))
+        logging.info(self.screening_report)
+        logging.info(f'Peak RSS: {get_peak_rss_mb()} MB')
+        return results
+
+    def _run_combos(
+            self,
+            sd: StrategyData,
+            combos: list[dict[str, Any]],
+            screening: bool = False,
+            signals: bool = False,
+    ) -> list[OptReturn]:
+        if not combos:
+            return []
+
+        cerebro = self._setup_cerebro(screening=screening)
+        if signals:
+            cerebro.addanalyzer(SignalList, _name='signals')
+        self._add_datas(cerebro)
+        # the same as `optstrategy`, but with a list of combos instead of a product of params
+        cerebro._dooptimize = True
+        cerebro.strats.append([(sd.strategy, (), {**kwargs, **sd.kwargs}) for kwargs in combos])
+        return [run[0] for run in cerebro.run(maxcpus=self.CPU_CORES_COUNT)]
+
+    def optimize_distributed(
+            self,
+            queue: WorkQueue,
+            from_: datetime,
+            to: datetime,
+            interval: CandleInterval,
+    ) -> list[StrategyResult]:
+        if len(self._strategies_data) != 1:
+            raise Exception('Distributed optimization is supported for one strategy')
+        sd = self._strategies_data[0]
+
+        # workers build feeds from their own candles, so only the range is sent with a task
+        tasks = [
+            WorkTask(
+                strategy=sd.strategy,
+                params=sd.params.__class__(**kwargs),
+                tickers=[i.ticker for i in self._instruments_data],
+                from_=from_,
+                to=to,
+                interval=interval,
+            ) for kwargs in expand_params(sd.params)
+        ]
+        names = queue.publish(tasks)
+        # equal combos of the grid are one task
+        names_distinct = list(dict.fromkeys(names))
+        logging.info(f'Published {len(names_distinct)} tasks to {queue.dirpath}')
+
+        results = {}
+        while len(results) < len(names_distinct):
+            queue.requeue_expired()
+            if failures := queue.get_failures(names_distinct):
+                name, failure = next(iter(failures.items()))
+                raise Exception(f'{len(failures)}/{len(names_distinct)} tasks failed. {name} failed '
+                                f'{failure.attempts} times, last on {failure.worker_id or "an expired lease"}:\n'
+                                f'{failure.error}')
+            new_results = queue.get_results([n for n in names_distinct if n not in results])
+            for res in new_results.values():
+                logging.info(f'\nparams={res.params}\n{res}')
+            results.update(new_results)
+
+            if len(results) < len(names_distinct):
+                logging.info(f'Completed {len(results)}/{len(names_distinct)} tasks')
+                time.sleep(queue.POLL_INTERVAL)
+        return [results[n] for n in names]
+
+    def _get_top_k_results(self, top_k: TopK) -> list[StrategyResult]:
+        results = top_k.get_results()
+        for res in results:
+            logging.info(f'\nparams={res.params}\n{res}')
+        self.top_k_summary = top_k.summary
+        logging.info(f'Top {len(results)} by {top_k.summary}')
+        logging.info(f'Peak RSS: {get_peak_rss_mb()} MB')
+        return results
+
+    @classmethod
+    def _push_top_k(
+            cls,
+            top_k: TopK,
+            strategy: Type[BaseStrategy],
+            ticker: str,
+            opt_returns: list[OptReturn],
+    ) -> None:
+        opt_return = opt_returns[0]
+        top_k.push(
+            value=get_metric(analyzers=opt_return.analyzers, metric=top_k.metric, start_cash=cls.START_CASH),
+            get_result=partial(cls._get_strategy_result, strategy=strategy, ticker=ticker, opt_return=opt_return),
+        )
+        # cerebro keeps the list of every run, so only the top stays in memory
+        opt_returns.clear()
+
     @classmethod
-    def _setup_cerebro(cls) -> Cerebro:
-        cerebro = Cerebro()
+    def _save_combo_result(
+            cls,
+            checkpoint: OptimizationCheckpoint,
+            strategy: Type[BaseStrategy],
+            ticker: str,
+            grid_keys: list[str],
+            opt_returns: list[OptReturn],
+    ) -> None:
+        opt_return = opt_returns[0]
+        key = get_combo_key({k: getattr(opt_return.params, k) for k in grid_keys})
+        res = cls._get_strategy_result(strategy=strategy, opt_return=opt_return, ticker=ticker)
+        checkpoint.save_result(key=key, result=res)
+        logging.info(f'\nparams={opt_return.params.__dict__}\n{res}')
+
+    def _attach_memory_report(self, results: list[StrategyResult], peak_rss_start: float) -> None:
+        # the run part is measured by the process of the strategy, e.g. an optimization worker
+        candles = {i.ticker: get_candles_size(i.data_feed.candles) / MB for i in self._instruments_data}
+        results_size = len(pickle.dumps(results)) / MB
+        phases_peak_rss_mb = {'start': peak_rss_start, 'end': get_peak_rss_mb()}
+        for res in results:
+            res.memory = MemoryReport(
+                run=res.memory['run'] if res.memory else None,
+                candles=candles,
+                results=results_size,
+                phases_peak_rss_mb=phases_peak_rss_mb,
+            )
+        if self.LOGGING and results:
+            logging.info(f'Memory: {results[0].memory_repr}')
+
+    def _plot(self, strategies: list[BaseStrategy], results: list[StrategyResult]) -> None:
+        # price series are decimated from the candles, so plotting doesn't need line buffers of the run
+        arrays_by_ticker = {i.ticker: CandleArrays.from_candles(i.data_feed.candles) for i in self._instruments_data}
+        for strategy, res in zip(strategies, results):
+            filename = f'{strategy.__class__.__name__}_{self._ticker}_{datetime.now():%Y%m%d_%H%M%S}.png'
+            filepath = plot_backtest(
+                filepath=self.PLOTS_DIR / filename,
+                title=f'{strategy.__class__.__name__} {self._ticker}',
+                arrays_by_ticker=arrays_by_ticker,
+                equity=strategy.analyzers.equity.get_analysis(),
+                trades=res.trades,
+            )
+            logging.info(f'Plot saved to {filepath}')
+
+    def _add_datas(self, cerebro: Cerebro, num_from: float | None = None) -> None:
+        # with `num_from` feeds start on the bar a snapshot resumes on
+        candles_by_ticker = {
+            i.ticker: i.data_feed.candles if num_from is None else slice_candles_from(i.data_feed.candles, num_from)
+            for i in self._instruments_data
+        }
+        if not self.PANEL:
+            for instrument_data in self._instruments_data:
+                data_feed = instrument_data.data_feed
+                if num_from is not None:
+                    data_feed = type(data_feed).from_candles(candles=candles_by_ticker[instrument_data.ticker],
+                                                             timeframe=data_feed.p.timeframe)
+                cerebro.adddata(data=data_feed, name=instrument_data.ticker)
+            return
+
+        # feeds never load their last candle
+        panel = CandlePanel.from_arrays({
+            ticker: CandleArrays.from_candles(candles[:-1]) for ticker, candles in candles_by_ticker.items()
+        })
+        data_feed = DataFeedPanel.from_panel(
+            panel=panel,
+            candles_by_ticker=candles_by_ticker,
+            timeframe=self._instruments_data[0].data_feed.p.timeframe,
+        )
+        cerebro.adddata(data=data_feed, name=self._ticker)
+
+    @property
+    def _ticker(self) -> str:
+        return '+'.join([instr.ticker for instr in self._instruments_data])
+
+    @classmethod
+    def _setup_cerebro(cls, screening: bool = False) -> Cerebro:
+        # with `exactbars` line buffers keep only the last bars instead of the whole history,
+        # observers of screening runs would only be plotted
+        cerebro = IsolatedBrokersCerebro(exactbars=int(cls.BOUNDED_MEMORY), stdstats=not screening)
+        if cls.LIGHT_BROKER:
+            cerebro.broker = LightPanelBroker() if cls.PANEL else LightBroker()
+        elif cls.PANEL:
+            cerebro.broker = PanelBroker()
         cerebro.broker.set_cash(cls.START_CASH)
         cerebro.broker.setcommission(commission=cls.COMMISSION, leverage=1)
+        if screening:
+            cerebro.addanalyzer(ScreeningStats, _name='screening')
+            return cerebro
+
         cerebro.addanalyzer(SharpeRatio, _name='sharpe', **cls.params_sharpe.__dict__)
-        cerebro.addanalyzer(AnnualReturn, _name='annual_return')
+        # the same analyzer in every mode, so results don't depend on BOUNDED_MEMORY, PANEL or SNAPSHOT_DIR
+        cerebro.addanalyzer(AnnualReturnRolling, _name='annual_return')
         cerebro.addanalyzer(TimeDrawDown, _name='drawdown')
         cerebro.addanalyzer(PeriodStats, _name='period_stats', **cls.params_period_stats.__dict__)
         cerebro.addanalyzer(TradeAnalyzer, _name='trade_analyzer')
+        cerebro.addanalyzer(TradeList, _name='trade_list')
+        if cls.PLOTTING:
+            cerebro.addanalyzer(EquityCurve, _name='equity')
+        if cls.MEMORY_REPORT:
+            # the last one, other analyzers are measured after they stopped
+            cerebro.addanalyzer(MemoryUsage, _name='memory')
         return cerebro
 
     @classmethod
     def _get_strategy_result(
             cls,
-            strategy: BaseStrategy,
+            strategy: Type[BaseStrategy],
             ticker: str,
-            opt_return: OptReturn | None = None
+            opt_return: OptReturn | None = None,
+            strategy_run: BaseStrategy | None = None,
     ) -> StrategyResult:
-        a = opt_return.analyzers if opt_return else strategy.analyzers
+        run = opt_return or strategy_run
+        a = run.analyzers
         dd = a.drawdown.get_analysis()
         return StrategyResult(
-            strategy=strategy.__class__,
+            strategy=strategy,
             ticker=ticker,
             start_cash=cls.START_CASH,
             sharpe=AnalysisSharpe(ratio=a.sharpe.ratio, risk_free_rate=a.sharpe.p.riskfreerate),
@@ -124,5 +734,8 @@ class Backtester:
                 timeframe=cls.params_period_stats.timeframe,
                 **a.period_stats.get_analysis()
             ),
-            trade_analyzer=a.trade_analyzer.get_analysis()
+            trade_analyzer=a.trade_analyzer.get_analysis(),
+            trades=a.trade_list.get_analysis(),
+            params={k: get_param_repr(v) for k, v in run.params.__dict__.items()},
+            memory=MemoryReport(run=a.memory.get_analysis()) if 'memory' in a.getnames() else None,
         )
@@ -0,0 +1,149 @@
+from datetime import datetime, timezone
+from dataclasses import dataclass
+from typing import Self
+
+import numpy as np
+
+from src.candle_arrays import CandleArrays
+from src.typed_dicts import AnalysisTrade
+
+
+@dataclass
+class BracketScore:
+    take: float
+    stop: float
+    count_trades: int
+    count_won: int
+    count_lost: int
+    pnl_percent: float  # sum of net returns of trades
+
+    @property
+    def average_percent(self) -> float:
+        return self.pnl_percent / self.count_trades if self.count_trades else 0
+
+
+@dataclass
+class BracketIndex:
+    # Outcomes of `buy_bracket(exectype=Market, limitprice=close*(1+take), stopprice=close*(1-stop))` sent on
+    # signal bars. The market order is filled on the next bar's open, take and stop are checked from the bar after.
+    # `first_takes[e, t]` is the index of the first bar where high reaches take level `t` for entry `e`,
+    # `first_stops[e, s]` the same for low and stop level `s`. `len(arrays)` means the level is never reached.
+    arrays: CandleArrays
+    signal_idxs: np.ndarray
+    takes: np.ndarray
+    stops: np.ndarray
+    first_takes: np.ndarray
+    first_stops: np.ndarray
+
+    @classmethod
+    def build(
+            cls,
+            arrays: CandleArrays,
+            signal_idxs: list[int] | np.ndarray,
+            takes: list[float],
+            stops: list[float],
+            max_bars: int | None = None,
+    ) -> Self:
+        signal_idxs = np.asarray(signal_idxs, dtype=np.int64)
+        signal_idxs = signal_idxs[signal_idxs + 2 < len(arrays)]
+        takes = np.asarray(sorted(set(takes)), dtype=np.float64)
+        stops = np.asarray(sorted(set(stops)), dtype=np.float64)
+        first_takes = np.full((len(signal_idxs), len(takes)), len(arrays), dtype=np.int64)
+        first_stops = np.full((len(signal_idxs), len(stops)), len(arrays), dtype=np.int64)
+
+        for e, i in enumerate(signal_idxs):
+            start = i + 2
+            end = len(arrays) if max_bars is None else min(len(arrays), start + max_bars)
+            close = arrays.close[i]
+            # running extremes are monotonic, so the first crossing of every level is a binary search
+            running_high = np.maximum.accumulate(arrays.high[start:end])
+            running_low_neg = np.maximum.accumulate(-arrays.low[start:end])
+
+            idxs_take = np.searchsorted(running_high, close * (1 + takes), side='left')
+            idxs_stop = np.searchsorted(running_low_neg, -close * (1 - stops), side='left')
+            first_takes[e] = np.where(idxs_take < end - start, idxs_take + start, len(arrays))
+            first_stops[e] = np.where(idxs_stop < end - start, idxs_stop + start, len(arrays))
+
+        return cls(
+            arrays=arrays,
+            signal_idxs=signal_idxs,
+            takes=takes,
+            stops=stops,
+            first_takes=first_takes,
+            first_stops=first_stops,
+        )
+
+    def get_exits(self, take: float, stop: float) -> tuple[np.ndarray, np.ndarray]:
+        exit_idxs, is_stop = self._get_exit_idxs(take=take, stop=stop)
+        closes = self.arrays.close[self.signal_idxs]
+        price_take = closes * (1 + take)
+        price_stop = closes * (1 - stop)
+        never = exit_idxs >= len(self.arrays)
+        exit_idxs_safe = np.minimum(exit_idxs, len(self.arrays) - 1)
+
+        # a gap through the level is filled on the open
+        opens = self.arrays.open[exit_idxs_safe]
+        exit_prices = np.where(is_stop, np.minimum(opens, price_stop), np.maximum(opens, price_take))
+        exit_prices = np.where(never, self.arrays.close[-1], exit_prices)
+        return exit_idxs_safe, exit_prices
+
+    def score(self, take: float, stop: float, commission: float = 0) -> BracketScore:
+        _, exit_prices = self.get_exits(take=take, stop=stop)
+        entry_prices = self.arrays.open[self.signal_idxs + 1]
+        returns = exit_prices / entry_prices - 1 - commission * (1 + exit_prices / entry_prices)
+        return BracketScore(
+            take=take,
+            stop=stop,
+            count_trades=len(returns),
+            count_won=int((returns > 0).sum()),
+            count_lost=int((returns <= 0).sum()),
+            pnl_percent=float(returns.sum()),
+        )
+
+    def score_grid(self, take_stops: list[tuple[float, float]], commission: float = 0) -> list[BracketScore]:
+        return [self.score(take=take, stop=stop, commission=commission) for take, stop in take_stops]
+
+    def validate(self, trades: list[AnalysisTrade], take: float, stop: float, rtol: float = 1e-6) -> list[str]:
+        # Compares the index with trades of a broker run with the same signals and `take_stop`. Every entry of
+        # the index is a trade of its own: an entry which the broker skipped for sizing or merged into an open
+        # position, and a broker trade without a signal are mismatches. Entries which never exit stay open
+        exit_idxs, exit_prices = self.get_exits(take=take, stop=stop)
+        is_open = self._get_exit_idxs(take=take, stop=stop)[0] >= len(self.arrays)
+        by_entry = {int(i) + 1: e for e, i in enumerate(self.signal_idxs)}
+
+        mismatches = []
+        entries_traded = set()
+        for trade in trades:
+            idx_open = self.arrays.index_of(trade['dt_open'])
+            e = by_entry.get(idx_open)
+            if e is None:
+                mismatches.append(f'{trade["dt_open"]}: no signal before the entry bar')
+                continue
+
+            entries_traded.add(e)
+            idx_close = self.arrays.index_of(trade['dt_close'])
+            if idx_close != exit_idxs[e] or not np.isclose(trade['price_close'], exit_prices[e], rtol=rtol):
+                mismatches.append(
+                    f'{trade["dt_open"]}: broker exit bar={idx_close} price={trade["price_close"]} | '
+                    f'index exit bar={exit_idxs[e]} price={exit_prices[e]}'
+                )
+
+        for e in np.flatnonzero(~is_open):
+            if e not in entries_traded:
+                dt_open = datetime.fromtimestamp(self.arrays.times[self.signal_idxs[e] + 1], tz=timezone.utc)
+                mismatches.append(f'{dt_open:%Y-%m-%d %H:%M:%S}: no broker trade, skipped for sizing or merged into '
+                                  f'an open position')
+        return mismatches
+
+    def _get_exit_idxs(self, take: float, stop: float) -> tuple[np.ndarray, np.ndarray]:
+        # on a bar which reaches both levels the stop order is checked first, as it's submitted first
+        first_take = self.first_takes[:, self._get_level_idx(self.takes, take)]
+        first_stop = self.first_stops[:, self._get_level_idx(self.stops, stop)]
+        return np.minimum(first_take, first_stop), first_stop <= first_take
+
+    @staticmethod
+    def _get_level_idx(levels: np.ndarray, level: float) -> int:
+        idx = int(np.abs(levels - level).argmin())
+        if not np.isclose(levels[idx], level):
+            raise ValueError(f'Level {level} is not in index levels {levels.tolist()}')
+        return idx
@@ -0,0 +1,195 @@
+from array import array
+
+import numpy as np
+from backtrader import Order
+from backtrader.brokers import BackBroker
+
+from src.data_feeds import PanelView
+
+
+class PanelBroker(BackBroker):
+    # a panel has bars where its ticker has no candle, orders wait for the next real candle
+    def _try_exec(self, order: Order) -> None:
+        if isinstance(order.data, PanelView) and not order.data.valid[0]:
+            return
+        super(PanelBroker, self)._try_exec(order)
+
+
+class LightBroker(BackBroker):
+    # Long only market orders and brackets of them with a flat stock commission. Orders are matched and
+    # notified by BackBroker, so strategies get the same orders and trades. The work of every bar is cut
+    # to orders and positions which are open: interest, futures cash adjustment, fund and user history
+    # are dropped. Positions and resting orders of brackets are kept in arrays by the index of their data,
+    # the value is summed over open positions and only orders whose price is reached on the bar are matched.
+    def init(self) -> None:
+        super(LightBroker, self).init()
+        self._datas: list = []
+        self._data_idxs: dict[object, int] = {}
+        # size, price and the commission multiplier of the position of every data, indexes of open ones
+        self._sizes = array('d')
+        self._prices = array('d')
+        self._mults = array('d')
+        self._idxs_open: list[int] = []
+        # Active limit and stop orders without expiration in the order of refs, as they are in `pending`.
+        # A row is matched when the high (side 1) or the low (side -1) of its data's bar reaches its price
+        self._book: list[Order] = []
+        self._book_arrays: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None
+
+    def start(self) -> None:
+        super(LightBroker, self).start()
+        if self.p.filler is not None or self.p.slip_perc or self.p.slip_fixed or self.p.coc or self.p.coo:
+            raise Exception(f'{self.__class__.__name__} supports no fillers, slippage or cheating')
+        if self.p.fundmode or not self.p.shortcash:
+            raise Exception(f'{self.__class__.__name__} supports no fund mode and only default short cash')
+        for comminfo in self.comminfo.values():
+            if not comminfo.stocklike or comminfo.p.interest or comminfo.get_leverage() != 1:
+                raise Exception(f'{self.__class__.__name__} supports only a stock commission without '
+                                f'interest and leverage')
+
+    def submit(self, order: Order, check: bool = True) -> Order:
+        if order.exectype not in (Order.Market, Order.Limit, Order.Stop):
+            raise Exception(f'{self.__class__.__name__} doesn\'t support {order.getordername()} orders')
+        if order.exectype != Order.Market and order.parent is None:
+            raise Exception(f'{self.__class__.__name__} supports limit and stop orders only in brackets')
+        if order.issell() and order.parent is None and order.size + self.positions[order.data].size < 0:
+            raise Exception(f'{self.__class__.__name__} supports only long positions')
+        if order.data._compensate is not None:
+            raise Exception(f'{self.__class__.__name__} doesn\'t support compensation datas')
+        return super(LightBroker, self).submit(order, check=check)
+
+    def _ocoize(self, order: Order, oco: Order | None) -> None:
+        if oco is not None:
+            raise Exception(f'{self.__class__.__name__} supports no OCO orders, only brackets')
+        super(LightBroker, self)._ocoize(order, oco)
+
+    def cancel(self, order: Order, bracket: bool = False) -> bool:
+        # BackBroker cancels only orders of `pending`
+        if order in self._book:
+            self._book_remove(order)
+            self.pending.appendleft(order)
+        return super(LightBroker, self).cancel(order, bracket=bracket)
+
+    def get_orders_open(self, safe: bool = False) -> list[Order]:
+        orders = self._book + super(LightBroker, self).get_orders_open()
+        return [o.clone() for o in orders] if safe else orders
+
+    def _execute(self, order: Order, ago=None, *args, **kwargs) -> float | None:
+        # a pseudo execution of a submitted order (`ago` is None) returns the cash left and doesn't touch positions
+        cash = super(LightBroker, self)._execute(order, ago, *args, **kwargs)
+        if ago is not None:
+            idx = self._get_data_idx(order.data)
+            position = self.positions[order.data]
+            self._sizes[idx] = position.size
+            self._prices[idx] = position.price
+            if position.size and idx not in self._idxs_open:
+                self._idxs_open.append(idx)
+            elif not position.size and idx in self._idxs_open:
+                self._idxs_open.remove(idx)
+        return cash
+
+    def next(self) -> None:
+        while self._toactivate:
+            self._toactivate.popleft().activate()
+
+        if self.submitted:
+            self.check_submitted()
+
+        # orders of the book are older than the orders of `pending`, BackBroker would match them first
+        if self._book:
+            for order in self._get_book_reached():
+                if not order.alive():
+                    # cancelled by its bracket on this bar
+                    continue
+                self._try_exec(order)
+                if not order.alive():
+                    self._book_remove(order)
+                    if order.status == Order.Completed:
+                        self._bracketize(order)
+
+        if self.pending:
+            self.pending.append(None)
+            while (order := self.pending.popleft()) is not None:
+                if order.expire():
+                    self.notify(order)
+                    self._ococheck(order)
+                    self._bracketize(order, cancel=True)
+                elif not order.active():
+                    self.pending.append(order)
+                else:
+                    self._try_exec(order)
+                    if not order.alive():
+                        if order.status == Order.Completed:
+                            self._bracketize(order)
+                    elif order.exectype != Order.Market and not order.valid:
+                        self._book_add(order)
+                    else:
+                        self.pending.append(order)
+
+        self._get_value()
+
+    def _get_data_idx(self, data) -> int:
+        if (idx := self._data_idxs.get(data)) is None:
+            idx = self._data_idxs[data] = len(self._datas)
+            self._datas.append(data)
+            self._sizes.append(0.)
+            self._prices.append(0.)
+            self._mults.append(self.getcommissioninfo(data).p.mult)
+        return idx
+
+    def _book_add(self, order: Order) -> None:
+        self._book.append(order)
+        self._book_arrays = None
+
+    def _book_remove(self, order: Order) -> None:
+        self._book.remove(order)
+        self._book_arrays = None
+
+    def _get_book_reached(self) -> list[Order]:
+        # the prices of the bar are taken as in `_try_exec`, where a gap over the price executes at the open
+        if self._book_arrays is None:
+            self._book_arrays = (
+                np.array([self._get_data_idx(o.data) for o in self._book]),
+                np.array([o.created.price for o in self._book]),
+                np.array([1 if (o.exectype == Order.Limit) != o.isbuy() else -1 for o in self._book]),
+            )
+        idxs, prices, sides = self._book_arrays
+        highs, lows = np.zeros(len(self._datas)), np.zeros(len(self._datas))
+        for idx in set(idxs.tolist()):
+            data = self._datas[idx]
+            popen = data.tick_open if data.tick_open is not None else data.open[0]
+            phigh = data.tick_high if data.tick_high is not None else data.high[0]
+            plow = data.tick_low if data.tick_low is not None else data.low[0]
+            highs[idx], lows[idx] = max(phigh, popen), min(plow, popen)
+        reached = np.where(sides > 0, highs[idxs] >= prices, lows[idxs] <= prices)
+        return [self._book[k] for k in np.flatnonzero(reached)]
+
+    def _get_value(self, datas=None, lever: bool = False) -> float:
+        if datas is not None:
+            return super(LightBroker, self)._get_value(datas=datas, lever=lever)
+
+        # the same arithmetic as BackBroker, flat positions add zeros there
+        pos_value = pos_value_unlever = unrealized = 0.0
+        for idx in self._idxs_open:
+            size, close = self._sizes[idx], self._datas[idx].close[0]
+            dvalue = size * close
+            dunrealized = size * (close - self._prices[idx]) * self._mults[idx]
+            pos_value += dvalue
+            unrealized += dunrealized
+            if dvalue > 0:
+                pos_value_unlever += dvalue - dunrealized
+                pos_value_unlever += dunrealized
+            else:
+                pos_value_unlever += dvalue
+
+        self._value = self.cash + pos_value_unlever
+        self._fundval = self._value / self._fundshares
+        self._valuemkt = pos_value_unlever
+        self._valuelever = self.cash + pos_value
+        self._valuemktlever = pos_value
+        self._leverage = pos_value / (pos_value_unlever or 1.0)
+        self._unrealized = unrealized
+        return self._value if not lever else self._valuelever
+
+
+class LightPanelBroker(LightBroker, PanelBroker):
+    pass
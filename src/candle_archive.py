@@ -0,0 +1,273 @@
+import os
+import io
+import time
+import logging
+import argparse
+import tempfile
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from pathlib import Path
+from decimal import Decimal
+from typing import Iterator
+
+import numpy as np
+from tinkoff.invest import CandleInterval, Instrument
+from my_tinkoff.csv_candles import DELIMITER
+from my_tinkoff.date_utils import TZ_UTC
+from my_tinkoff.helpers import quotation2decimal
+from my_tinkoff.schemas import Candles, Candle
+
+from config import FILEPATH_LOGGER
+from src.my_logging import get_logger
+from src.candle_arrays import CompactCandles, UNIX_EPOCH
+from src.synthetic import make_minute_candles
+
+
+FORMAT_DT_CSV = '%Y-%m-%d %H:%M:%S%z'
+
+
+def get_month_start(dt: datetime) -> datetime:
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_next_month_start(dt: datetime) -> datetime:
+    return (get_month_start(dt) + timedelta(days=32)).replace(day=1)
+
+
+def iter_months(from_: datetime, to: datetime) -> Iterator[datetime]:
+    # starts of months which overlap [from_, to)
+    month = get_month_start(from_)
+    while month < to:
+        yield month
+        month = get_next_month_start(month)
+
+
+def get_minutes(dt: datetime) -> float:
+    return (dt - UNIX_EPOCH) / timedelta(minutes=1)
+
+
+class CandleArchive:
+    # Prepared candles of an instrument by months in `<dirpath>/<interval>/<uid>/<YYYY-MM>.npz`. A month is
+    # a block of columns compressed on its own: minutes since the previous candle and prices in units of
+    # the tick size decimals, so a range decompresses only its months. Only complete months which widen back
+    # to the same candles are written, the rest is read from csv files as before.
+    FORMAT_MONTH = '%Y-%m'
+
+    def __init__(self, dirpath: Path):
+        self.dirpath = dirpath
+
+    def read(
+            self,
+            instrument: Instrument,
+            from_: datetime,
+            to: datetime,
+            interval: CandleInterval,
+    ) -> CompactCandles | None:
+        return self.read_dir(self._get_dirpath(instrument, interval), from_=from_, to=to)
+
+    def write(
+            self,
+            instrument: Instrument,
+            interval: CandleInterval,
+            candles: Candles,
+            from_: datetime,
+            to: datetime,
+    ) -> int:
+        tick_size = quotation2decimal(instrument.min_price_increment)
+        count = self.write_dir(self._get_dirpath(instrument, interval), candles=candles, tick_size=tick_size,
+                               from_=from_, to=to)
+        if count:
+            logging.debug(f'{instrument.ticker} | Candle archive: wrote {count} months')
+        return count
+
+    def read_dir(self, dirpath: Path, from_: datetime, to: datetime) -> CompactCandles | None:
+        # candles in [from_, to), None if a month of the range isn't archived
+        parts = []
+        for month in iter_months(from_, to):
+            filepath = dirpath / f'{month.strftime(self.FORMAT_MONTH)}.npz'
+            if not filepath.exists():
+                return None
+            parts.append(self.decode(filepath))
+
+        if not parts:
+            return None
+        candles = self._concat(parts)
+        idx_from = int(np.searchsorted(candles.minutes, get_minutes(from_)))
+        idx_to = int(np.searchsorted(candles.minutes, get_minutes(to)))
+        return candles[idx_from:idx_to]
+
+    def write_dir(
+            self,
+            dirpath: Path,
+            candles: Candles,
+            tick_size: float | Decimal,
+            from_: datetime,
+            to: datetime,
+    ) -> int:
+        # months which are in [from_, to) as a whole and are over, `candles` are all candles of the range
+        end = min(to, datetime.now(tz=TZ_UTC))
+        count = 0
+        for month in iter_months(from_, to):
+            month_next = get_next_month_start(month)
+            filepath = dirpath / f'{month.strftime(self.FORMAT_MONTH)}.npz'
+            if month < from_ or month_next > end or filepath.exists():
+                continue
+
+            idx_from = bisect_left(candles, month, key=lambda c: c.time)
+            idx_to = bisect_left(candles, month_next, key=lambda c: c.time)
+            candles_month = Candles(candles[idx_from:idx_to])
+            compact = CompactCandles.from_candles(candles_month, tick_size=tick_size)
+            if mismatches := compact.verify(candles_month):
+                logging.warning(f'{dirpath.name} | {month.strftime(self.FORMAT_MONTH)} isn\'t archived, '
+                                f'{len(mismatches)} values change in compact candles. First: {mismatches[0]}')
+                continue
+
+            dirpath.mkdir(parents=True, exist_ok=True)
+            self._write_atomic(filepath, self.encode(compact))
+            count += 1
+        return count
+
+    @staticmethod
+    def encode(candles: CompactCandles) -> bytes:
+        minutes = candles.minutes.astype(np.int64)
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            minute_first=minutes[:1],
+            minutes_delta=np.diff(minutes).astype(np.int32),
+            open=candles.open,
+            high=candles.high,
+            low=candles.low,
+            close=candles.close,
+            volume=candles.volume,
+            decimals=np.array(candles.decimals),
+        )
+        return buffer.getvalue()
+
+    @staticmethod
+    def decode(file: Path | io.BytesIO) -> CompactCandles:
+        with np.load(file) as block:
+            minutes = np.concatenate([block['minute_first'], block['minutes_delta']]).cumsum()
+            return CompactCandles(
+                minutes=minutes,
+                open=block['open'],
+                high=block['high'],
+                low=block['low'],
+                close=block['close'],
+                volume=block['volume'],
+                decimals=int(block['decimals']),
+            ).astype_int32()
+
+    @staticmethod
+    def _concat(parts: list[CompactCandles]) -> CompactCandles:
+        # the tick size of an instrument may have changed between months, prices are scaled to the finest one
+        decimals = max(p.decimals for p in parts)
+        return CompactCandles.concat([
+            p if p.decimals == decimals else CompactCandles(
+                minutes=p.minutes,
+                open=p.open.astype(np.int64) * 10 ** (decimals - p.decimals),
+                high=p.high.astype(np.int64) * 10 ** (decimals - p.decimals),
+                low=p.low.astype(np.int64) * 10 ** (decimals - p.decimals),
+                close=p.close.astype(np.int64) * 10 ** (decimals - p.decimals),
+                volume=p.volume,
+                decimals=decimals,
+            ) for p in parts
+        ]).astype_int32()
+
+    def _get_dirpath(self, instrument: Instrument, interval: CandleInterval) -> Path:
+        return self.dirpath / interval.name / instrument.uid
+
+    @staticmethod
+    def _write_atomic(filepath: Path, data: bytes) -> None:
+        filepath_tmp = filepath.with_suffix(filepath.suffix + '.tmp')
+        with open(filepath_tmp, 'wb') as f:
+            f.write(data)
+        os.replace(filepath_tmp, filepath)
+
+
+def write_csv(filepath: Path, candles: Candles) -> None:
+    # columns of csv candle files, see `MyCSVData`
+    with open(filepath, 'w') as f:
+        for c in candles:
+            f.write(DELIMITER.join(map(str, (c.open, c.high, c.low, c.close, c.volume,
+                                             c.time.strftime(FORMAT_DT_CSV)))) + '\n')
+
+
+def read_csv(filepath: Path) -> Candles:
+    candles = Candles()
+    with open(filepath) as f:
+        for line in f:
+            open_, high, low, close, volume, dt = line.rstrip('\n').split(DELIMITER)
+            candles.append(Candle(
+                open=float(open_),
+                high=float(high),
+                low=float(low),
+                close=float(close),
+                volume=int(volume),
+                time=datetime.strptime(dt, FORMAT_DT_CSV),
+                is_complete=True,
+            ))
+    return candles
+
+
+def benchmark(count_instruments: int, count_days: int) -> None:
+    # size and read time of synthetic instruments in csv files and in the archive. Synthetic prices drift
+    # out of int32 in long histories, so the history is split into instruments
+    candles_by_ticker = {
+        f'SYN{seed}': make_minute_candles(seed=seed, count_days=count_days, tick_size=.01)
+        for seed in range(count_instruments)
+    }
+    times = [c.time for candles in candles_by_ticker.values() for c in candles]
+    from_, to = get_month_start(min(times)), get_next_month_start(max(times))
+    # a month in the middle, as a date range read of a sharded or resumed backtest
+    from_month = get_month_start(sorted(times)[len(times) // 2])
+    to_month = get_next_month_start(from_month)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        dirpath = Path(dirname)
+        archive = CandleArchive(dirpath / 'archive')
+        for ticker, candles in candles_by_ticker.items():
+            write_csv(dirpath / f'{ticker}.csv', candles)
+            archive.write_dir(archive.dirpath / ticker, candles=candles, tick_size=.01, from_=from_, to=to)
+
+        size_csv = sum(p.stat().st_size for p in dirpath.glob('*.csv'))
+        size_archive = sum(p.stat().st_size for p in archive.dirpath.rglob('*.npz'))
+
+        start = time.perf_counter()
+        candles_csv = {ticker: read_csv(dirpath / f'{ticker}.csv') for ticker in candles_by_ticker}
+        seconds_csv = time.perf_counter() - start
+
+        start = time.perf_counter()
+        candles_archive = {ticker: archive.read_dir(archive.dirpath / ticker, from_=from_, to=to)
+                           for ticker in candles_by_ticker}
+        seconds_archive = time.perf_counter() - start
+
+        start = time.perf_counter()
+        count_month = sum(len(archive.read_dir(archive.dirpath / ticker, from_=from_month, to=to_month))
+                          for ticker in candles_by_ticker)
+        seconds_month = time.perf_counter() - start
+
+    for ticker, candles in candles_csv.items():
+        if candles_archive[ticker] is None:
+            raise Exception(f'{ticker} candles aren\'t archived')
+        if mismatches := candles_archive[ticker].verify(candles):
+            raise Exception(f'{ticker} archived candles differ: {mismatches[0]}')
+
+    logging.info(f'{len(times)} candles of {count_instruments} instruments | csv: {round(size_csv / 1024 ** 2, 2)} '
+                 f'MB, read in {round(seconds_csv, 3)}s | archive: {round(size_archive / 1024 ** 2, 2)} MB '
+                 f'(x{round(size_csv / size_archive, 1)} smaller), read in {round(seconds_archive, 3)}s '
+                 f'(x{round(seconds_csv / seconds_archive, 1)} faster) | one month of archive: '
+                 f'{count_month} candles in {round(seconds_month, 4)}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare size and read speed of csv candles and the archive')
+    parser.add_argument('--count-instruments', type=int, default=10)
+    parser.add_argument('--count-days', type=int, default=250)
+    args = parser.parse_args()
+    benchmark(count_instruments=args.count_instruments, count_days=args.count_days)
+
+
+if __name__ == '__main__':
+    get_logger(FILEPATH_LOGGER)
+    main()
@@ -0,0 +1,198 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from decimal import Decimal
+from typing import Iterator, Self
+
+import numpy as np
+from my_tinkoff.date_utils import TZ_UTC
+from my_tinkoff.schemas import Candles, Candle
+
+
+UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=TZ_UTC)
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def get_decimals(tick_size: float | Decimal) -> int:
+    return max(-Decimal(str(tick_size)).normalize().as_tuple().exponent, 0)
+
+
+@dataclass
+class CandleArrays:
+    times: np.ndarray  # unix timestamps in seconds
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+
+    @classmethod
+    def from_candles(cls, candles: Candles) -> Self:
+        if isinstance(candles, CompactCandles):
+            return candles.to_arrays()
+        return cls(
+            times=np.array([c.time.timestamp() for c in candles], dtype=np.int64),
+            open=np.array([c.open for c in candles], dtype=np.float64),
+            high=np.array([c.high for c in candles], dtype=np.float64),
+            low=np.array([c.low for c in candles], dtype=np.float64),
+            close=np.array([c.close for c in candles], dtype=np.float64),
+            volume=np.array([c.volume for c in candles], dtype=np.float64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def index_of(self, dt: datetime) -> int:
+        # backtrader returns naive datetimes in UTC
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return int(np.searchsorted(self.times, dt.timestamp()))
+
+
+
+@dataclass
+class DayBars:
+    # Bars of every UTC day split into the last one and the ones before it, so a strategy can skip a day and
+    # update its state on the last bar. Days of one bar have a zero volume, -inf high and nan close before the last
+    days: np.ndarray  # days since the epoch
+    volume_before_last: np.ndarray
+    high_before_last: np.ndarray  # the highest one
+    close_before_last: np.ndarray  # of the bar right before the last one
+
+    @classmethod
+    def from_arrays(cls, arrays: CandleArrays) -> Self:
+        days = arrays.times // 86400
+        if not len(days):
+            return cls(*[np.array([], dtype=dtype) for dtype in (np.int64, np.float64, np.float64, np.float64)])
+
+        is_last = np.ones(len(days), dtype=bool)
+        is_last[:-1] = days[1:] != days[:-1]
+        idxs_last = np.flatnonzero(is_last)
+        idxs_first = np.concatenate([[0], idxs_last[:-1] + 1])
+        volume, high = arrays.volume.copy(), arrays.high.copy()
+        volume[idxs_last] = 0
+        high[idxs_last] = -np.inf
+        return cls(
+            days=days[idxs_last],
+            volume_before_last=np.add.reduceat(volume, idxs_first),
+            high_before_last=np.maximum.reduceat(high, idxs_first),
+            close_before_last=np.where(idxs_last > idxs_first, arrays.close[np.maximum(idxs_last - 1, 0)], np.nan),
+        )
+
+    def index_of(self, day: int) -> int | None:
+        k = int(np.searchsorted(self.days, day))
+        return k if k < len(self.days) and self.days[k] == day else None
+
+@dataclass
+class CompactCandles:
+    # Candles in int32 arrays: minutes since the epoch, prices in units of 10 ** -decimals and volumes.
+    # A price on the decimal grid of the tick size is widened by one division of exact numbers,
+    # so it's exactly the float parsed from its text. Read-only: slices are views of the same arrays
+    minutes: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+    decimals: int
+
+    @classmethod
+    def from_candles(cls, candles: Candles, tick_size: float | Decimal) -> Self:
+        decimals = get_decimals(tick_size)
+        scale = 10 ** decimals
+
+        def to_ints(values: list[float]) -> np.ndarray:
+            return np.round(np.array(values, dtype=np.float64) * scale).astype(np.int64)
+
+        return cls(
+            minutes=np.array([int(c.time.timestamp()) // 60 for c in candles], dtype=np.int64),
+            open=to_ints([c.open for c in candles]),
+            high=to_ints([c.high for c in candles]),
+            low=to_ints([c.low for c in candles]),
+            close=to_ints([c.close for c in candles]),
+            volume=np.array([c.volume for c in candles], dtype=np.int64),
+            decimals=decimals,
+        ).astype_int32()
+
+    @classmethod
+    def concat(cls, parts: list[Self]) -> Self:
+        if len({p.decimals for p in parts}) != 1:
+            raise Exception(f'Parts have different decimals: {[p.decimals for p in parts]}')
+        return cls(
+            minutes=np.concatenate([p.minutes for p in parts]),
+            open=np.concatenate([p.open for p in parts]),
+            high=np.concatenate([p.high for p in parts]),
+            low=np.concatenate([p.low for p in parts]),
+            close=np.concatenate([p.close for p in parts]),
+            volume=np.concatenate([p.volume for p in parts]),
+            decimals=parts[0].decimals,
+        )
+
+    def astype_int32(self) -> Self:
+        # values out of int32 are kept as they are, `verify` tells about them
+        arrays = [self.minutes, self.open, self.high, self.low, self.close, self.volume]
+        if any(len(a) and (a.max() > INT32_MAX or a.min() < -INT32_MAX) for a in arrays):
+            return self
+        return CompactCandles(*[a.astype(np.int32) for a in arrays], decimals=self.decimals)
+
+    def verify(self, candles: Candles) -> list[str]:
+        # every widened value must be equal to the original one, then strategies get the same inputs
+        if len(self) != len(candles):
+            return [f'length {len(self)} != {len(candles)}']
+        if self.minutes.dtype != np.int32:
+            return ['values out of int32']
+
+        mismatches = []
+        for i, c in enumerate(candles):
+            widened = self[i]
+            for field in ('time', 'open', 'high', 'low', 'close', 'volume', 'is_complete'):
+                if getattr(widened, field) != getattr(c, field):
+                    mismatches.append(f'{c.time} {field}: {getattr(c, field)!r} != {getattr(widened, field)!r}')
+        return mismatches
+
+    @property
+    def scale(self) -> float:
+        return float(10 ** self.decimals)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.minutes, self.open, self.high, self.low, self.close, self.volume))
+
+    def __len__(self) -> int:
+        return len(self.minutes)
+
+    def __getitem__(self, item: int | slice) -> Candle | Self:
+        if isinstance(item, slice):
+            return CompactCandles(
+                minutes=self.minutes[item],
+                open=self.open[item],
+                high=self.high[item],
+                low=self.low[item],
+                close=self.close[item],
+                volume=self.volume[item],
+                decimals=self.decimals,
+            )
+
+        scale = self.scale
+        return Candle(
+            open=int(self.open[item]) / scale,
+            high=int(self.high[item]) / scale,
+            low=int(self.low[item]) / scale,
+            close=int(self.close[item]) / scale,
+            volume=int(self.volume[item]),
+            time=UNIX_EPOCH + timedelta(minutes=int(self.minutes[item])),
+            is_complete=True,
+        )
+
+    def __iter__(self) -> Iterator[Candle]:
+        return (self[i] for i in range(len(self)))
+
+    def to_arrays(self) -> CandleArrays:
+        scale = self.scale
+        return CandleArrays(
+            times=self.minutes.astype(np.int64) * 60,
+            open=self.open / scale,
+            high=self.high / scale,
+            low=self.low / scale,
+            close=self.close / scale,
+            volume=self.volume.astype(np.float64),
+        )
@@ -0,0 +1,103 @@
+import logging
+from bisect import bisect_left
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from tinkoff.invest import CandleInterval, Instrument
+from my_tinkoff.schemas import Candles
+from my_tinkoff.helpers import quotation2decimal
+
+from src.candle_arrays import CompactCandles
+
+
+LoadCandles = Callable[[Instrument, datetime, datetime, CandleInterval], Awaitable[Candles | CompactCandles]]
+
+
+@dataclass
+class CachedCandles:
+    from_: datetime
+    to: datetime
+    candles: Candles | CompactCandles
+
+    @property
+    def size_bytes(self) -> int:
+        if isinstance(self.candles, CompactCandles):
+            return self.candles.nbytes
+        return len(self.candles) * CandlesCache.CANDLE_SIZE_BYTES
+
+
+class CandlesCache:
+    # approximate size of a Candle object with its fields and a list slot
+    CANDLE_SIZE_BYTES = 400
+
+    def __init__(self, max_size_mb: int = 2048):
+        self.max_size_bytes = max_size_mb * 1024 ** 2
+        self._entries: OrderedDict[tuple[str, CandleInterval, bool], CachedCandles] = OrderedDict()
+
+    async def get(
+            self,
+            instrument: Instrument,
+            from_: datetime,
+            to: datetime,
+            interval: CandleInterval,
+            load: LoadCandles,
+            compact: bool = False,
+    ) -> Candles | CompactCandles:
+        # Candles in [from_, to), whatever else the loader returned, so they don't depend on requests before.
+        # A narrower range is sliced from a wider cached one, a range that goes past the cached end loads only
+        # the missing tail. With `compact` loaded candles are kept as CompactCandles if they widen back to
+        # the same values, compact and plain candles are cached apart
+        key = (instrument.uid, interval, compact)
+        entry = self._entries.get(key)
+
+        if entry is not None and entry.from_ <= from_ <= entry.to < to:
+            tail = await load(instrument, entry.to, to, interval)
+            last_time = entry.candles[-1].time if len(entry.candles) else entry.from_
+            tail = self._compact(instrument, Candles(c for c in tail if c.time > last_time), compact=compact)
+            if isinstance(entry.candles, CompactCandles) and isinstance(tail, CompactCandles):
+                entry.candles = CompactCandles.concat([entry.candles, tail])
+            else:
+                entry.candles = Candles([*entry.candles, *tail])
+            entry.to = to
+            logging.debug(f'{instrument.ticker} | Candles cache: loaded {len(tail)} tail candles')
+        elif entry is None or not entry.from_ <= from_ <= to <= entry.to:
+            candles = self._compact(instrument, await load(instrument, from_, to, interval), compact=compact)
+            entry = CachedCandles(from_=from_, to=to, candles=candles)
+
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._evict()
+        return self._slice(entry, from_=from_, to=to)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    @staticmethod
+    def _compact(instrument: Instrument, candles: Candles | CompactCandles, compact: bool) -> Candles | CompactCandles:
+        if not compact or isinstance(candles, CompactCandles):
+            return candles
+
+        compact = CompactCandles.from_candles(candles, tick_size=quotation2decimal(instrument.min_price_increment))
+        mismatches = compact.verify(candles)
+        if mismatches:
+            logging.warning(f'{instrument.ticker} | {len(mismatches)} values change in compact candles, '
+                            f'kept as they are. First: {mismatches[0]}')
+            return candles
+        return compact
+
+    def _evict(self) -> None:
+        # the most recent entry is kept even if it alone is bigger than the limit
+        size = sum(e.size_bytes for e in self._entries.values())
+        while size > self.max_size_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            size -= entry.size_bytes
+
+    @staticmethod
+    def _slice(entry: CachedCandles, from_: datetime, to: datetime) -> Candles | CompactCandles:
+        # a new list every time, so callers can't change the cached one. Compact candles are read-only views
+        idx_from = bisect_left(entry.candles, from_, key=lambda c: c.time)
+        idx_to = bisect_left(entry.candles, to, key=lambda c: c.time)
+        candles = entry.candles[idx_from:idx_to]
+        return candles if isinstance(candles, CompactCandles) else Candles(candles)
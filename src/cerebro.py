@@ -0,0 +1,121 @@
+from contextvars import ContextVar
+from multiprocessing import Pool
+from threading import Event
+
+from backtrader import Cerebro, BrokerBase, Analyzer
+
+from src.exceptions import BacktestCancelled
+
+
+# set by `Backtester.run_async` for the thread of a run, a context var isn't pickled with cerebro to workers
+CANCEL_EVENT: ContextVar[Event | None] = ContextVar('cancel_event', default=None)
+
+
+class IsolatedBrokersCerebro(Cerebro):
+    # Every strategy of a run trades on its own copy of the configured broker. Several strategies
+    # (or param combos) share one pass over the datas with separate cash, positions, trades and analyzers.
+    def __init__(self, **kwargs):
+        super(IsolatedBrokersCerebro, self).__init__(**kwargs)
+        self._brokers: list[BrokerBase] = []
+        self._broker_pending: BrokerBase | None = None
+        self._iterstrats: list[tuple] | None = None
+
+    def getbroker(self) -> BrokerBase:
+        # a strategy takes `cerebro.broker` right after it got its id, see `_next_stid`
+        if self._broker_pending is not None:
+            broker, self._broker_pending = self._broker_pending, None
+            return broker
+        return self._broker
+
+    broker = property(getbroker, Cerebro.setbroker)
+
+    def _next_stid(self) -> int:
+        broker = self._broker.__class__(**self._broker.params._getkwargs())
+        broker.comminfo = dict(self._broker.comminfo)
+        broker.cerebro = self
+        broker.start()
+        self._brokers.append(broker)
+        self._broker_pending = broker
+        return super(IsolatedBrokersCerebro, self)._next_stid()
+
+    def run(self, **kwargs):
+        # With `maxcpus` > 1 combos run in a process pool, whose workers don't see the cancel event. The results
+        # come back to this thread, so a cancelled optimization stops after callbacks of the next finished combo
+        if self._raise_if_cancelled not in self.optcbs:
+            self.optcallback(self._raise_if_cancelled)
+        maxcpus = kwargs.pop('maxcpus', self.p.maxcpus)
+        if not self._dooptimize or maxcpus == 1:
+            return super(IsolatedBrokersCerebro, self).run(maxcpus=maxcpus, **kwargs)
+
+        # The pool of `Cerebro.run` is its local and isn't terminated when a callback raises. Cerebro.run prepares
+        # the run on one core with `runstrategies` only collecting the combos, they are run in an own pool
+        optcbs, self.optcbs, self._iterstrats = self.optcbs, [], []
+        try:
+            super(IsolatedBrokersCerebro, self).run(maxcpus=1, **kwargs)
+        finally:
+            self.optcbs, iterstrats, self._iterstrats = optcbs, self._iterstrats, None
+        self.p.maxcpus = maxcpus
+
+        predata = self.p.optdatas and self._dopreload and self._dorunonce
+        if predata:
+            # datas are loaded once and shared with the workers by fork
+            for data in self.datas:
+                data.reset()
+                if self._exactbars < 1:
+                    data.extend(size=self.p.lookahead)
+                data._start()
+                data.preload()
+
+        self.runstrats = []
+        with Pool(maxcpus or None) as pool:
+            for runstrat in pool.imap(self, iterstrats):
+                self.runstrats.append(runstrat)
+                for cb in self.optcbs:
+                    cb(runstrat)
+
+        if predata:
+            for data in self.datas:
+                data.stop()
+        return self.runstrats
+
+    def runstrategies(self, iterstrat, predata=False):
+        if self._iterstrats is not None:
+            self._iterstrats.append(iterstrat)
+            return []
+
+        self._brokers = []
+        results = super(IsolatedBrokersCerebro, self).runstrategies(iterstrat, predata=predata)
+        for broker in self._brokers:
+            broker.stop()
+        self._brokers = []
+
+        if self._dooptimize and self.p.optreturn:
+            # Cerebro drops references to the strategy and datas only from top level analyzers, the children
+            # (TimeReturn of SharpeRatio) would pickle the strategy with observers of dynamic classes to the pool
+            for result in results:
+                for analyzer in result.analyzers:
+                    self._clear_children(analyzer)
+        return results
+
+    @classmethod
+    def _clear_children(cls, analyzer: Analyzer) -> None:
+        for child in analyzer._children:
+            child.strategy = None
+            child._parent = None
+            for name in dir(child):
+                if name.startswith('data'):
+                    setattr(child, name, None)
+            cls._clear_children(child)
+
+    @staticmethod
+    def _raise_if_cancelled(*_) -> None:
+        if (event := CANCEL_EVENT.get()) is not None and event.is_set():
+            raise BacktestCancelled
+
+    def _brokernotify(self):
+        # called on every bar before strategies
+        self._raise_if_cancelled()
+        for broker in self._brokers:
+            broker.next()
+            while (order := broker.get_notification()) is not None:
+                order.owner._addnotification(order, quicknotify=self.p.quicknotify)
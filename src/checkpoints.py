@@ -0,0 +1,67 @@
+import os
+import json
+import pickle
+import struct
+import logging
+from pathlib import Path
+from typing import Any
+
+from src.schemas import StrategyResult
+from src.params import get_param_repr
+from src.helpers import get_spec_hash, write_atomic
+
+
+def get_combo_key(kwargs: dict[str, Any]) -> str:
+    return ', '.join([f'{k}={get_param_repr(v)!r}' for k, v in sorted(kwargs.items())])
+
+
+class OptimizationCheckpoint:
+    FILENAME_SPEC = 'spec.json'
+    # length-prefixed pickles, a record cut by a crash is told apart from a whole one
+    FILENAME_RESULTS = 'results.records'
+    RECORD_HEADER = struct.Struct('<Q')
+    FILENAME_REMAINING = 'remaining.json'
+
+    def __init__(self, dirpath: Path, spec: dict[str, Any]):
+        self.dirpath = dirpath / get_spec_hash(spec)
+        self.dirpath.mkdir(parents=True, exist_ok=True)
+        self.filepath_results = self.dirpath / self.FILENAME_RESULTS
+        self.filepath_remaining = self.dirpath / self.FILENAME_REMAINING
+        write_atomic(self.dirpath / self.FILENAME_SPEC, json.dumps(spec, indent=2, default=repr).encode())
+
+    def load_results(self) -> dict[str, StrategyResult]:
+        results = {}
+        if not self.filepath_results.exists():
+            return results
+
+        size_file = self.filepath_results.stat().st_size
+        with open(self.filepath_results, 'rb') as f:
+            offset = 0
+            while offset < size_file:
+                header = f.read(self.RECORD_HEADER.size)
+                size = self.RECORD_HEADER.unpack(header)[0] if len(header) == self.RECORD_HEADER.size else size_file
+                if offset + self.RECORD_HEADER.size + size > size_file:
+                    # the last record was cut by a crash in the middle of writing,
+                    # drop it so the next records are appended after the valid ones
+                    logging.warning(f'Truncated a cut checkpoint record in {self.filepath_results}')
+                    os.truncate(self.filepath_results, offset)
+                    break
+                offset += self.RECORD_HEADER.size + size
+                try:
+                    key, result = pickle.loads(f.read(size))
+                except (pickle.UnpicklingError, EOFError, ValueError, AttributeError) as ex:
+                    # a whole record which doesn't load, its combo runs again
+                    logging.warning(f'Skipped a broken checkpoint record in {self.filepath_results}: {ex}')
+                    continue
+                results[key] = result
+        return results
+
+    def save_result(self, key: str, result: StrategyResult) -> None:
+        data = pickle.dumps((key, result))
+        with open(self.filepath_results, 'ab') as f:
+            f.write(self.RECORD_HEADER.pack(len(data)) + data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save_remaining(self, keys: list[str]) -> None:
+        write_atomic(self.filepath_remaining, json.dumps(keys, indent=2).encode())
@@ -1,5 +1,8 @@
+import time
+from datetime import datetime
 from typing import Self
 
+import numpy as np
 from my_tinkoff.csv_candles import DELIMITER
 from my_tinkoff.schemas import Candles, Candle
 from backtrader import (
@@ -7,13 +10,50 @@ from backtrader import (
     date2num
 )
 from backtrader.feeds import DataBase, GenericCSVData
+from backtrader.linebuffer import LineBuffer
+
+from src.panel import CandlePanel
+from src.candle_arrays import CompactCandles, CandleArrays, DayBars
+
+UNIX_EPOCH_NUM = date2num(datetime(1970, 1, 1))
+
+
+def index_days(candles: Candles) -> tuple[list[int], list[int], list[float]]:
+    # bars to the day's end, days to the end and the start of the next day of every candle. The last candle
+    # is never loaded (see `DataFeedCandles._load`), so it doesn't take part in day boundaries
+    count = max(len(candles) - 1, 0)
+    bars_to_day_end = [0] * count
+    days_to_end = [0] * count
+    next_day_dts = [float('nan')] * count
+
+    days, bars, next_day_dt = 0, 0, float('nan')
+    for i in reversed(range(count)):
+        if i + 1 < count and candles[i + 1].time.date() > candles[i].time.date():
+            days += 1
+            bars = 0
+            next_day_dt = date2num(candles[i + 1].time)
+        elif i + 1 < count:
+            bars += 1
+
+        bars_to_day_end[i] = bars
+        days_to_end[i] = days
+        next_day_dts[i] = next_day_dt
+    return bars_to_day_end, days_to_end, next_day_dts
 
 
 class DataFeedCandles(DataBase):
+    # Lookahead derived from the candles list, so strategies can detect the end of a trading day
+    # without absolute indexes into the line buffers (which `exactbars` truncates)
+    lines = ('bars_to_day_end', 'days_to_end', 'next_day_dt')
+
     def __init__(self):
         super(DataFeedCandles, self).__init__()
         self.candle_cursor = None
         self.candles: Candles
+        self._bars_to_day_end: list[int] = []
+        self._days_to_end: list[int] = []
+        self._next_day_dts: list[float] = []
+        self._day_bars: DayBars | None = None
 
         # Use the informative "timeframe" parameter to understand if the
         # code passed as "dataname" refers to an intraday or daily feed
@@ -27,11 +67,38 @@ class DataFeedCandles(DataBase):
             self.barfmt = 'IIffffII'
 
     @classmethod
-    def from_candles(cls, candles: Candles, timeframe: TimeFrame) -> Self:
+    def from_candles(cls, candles: Candles | CompactCandles, timeframe: TimeFrame) -> Self:
+        if cls is DataFeedCandles and isinstance(candles, CompactCandles):
+            cls = DataFeedCompact
         self = cls(timeframe=timeframe)
         self.candles = candles
+        self._index_days()
         return self
 
+    def _index_days(self) -> None:
+        self._bars_to_day_end, self._days_to_end, self._next_day_dts = index_days(self.candles)
+
+    def get_day_bars(self) -> DayBars:
+        # made once for all strategies and param combos which run on the feed, of loaded candles only
+        if self._day_bars is None:
+            self._day_bars = DayBars.from_arrays(CandleArrays.from_candles(self.candles[:-1]))
+        return self._day_bars
+
+    def qbuffer(self, savemem: int = 0, replaying: bool = False) -> None:
+        # bounded buffers need one extra slot: feeds with missing minutes are rewound on bars they don't advance
+        super(DataFeedCandles, self).qbuffer(savemem=savemem, replaying=True)
+
+    def rewind(self, size: int = 1) -> None:
+        # a bar pulled too early is taken back, its tick prices mustn't be used by the broker
+        if self.lines.datetime.mode == LineBuffer.QBuffer:
+            # the index of a bounded buffer stays on its last slot on `rewind`, the bar would be seen before
+            # its time and the next one loaded over it. The bar is dropped and its candle is loaded again
+            self.backwards(size=size, force=True)
+            self.candle_cursor -= size
+        else:
+            super(DataFeedCandles, self).rewind(size=size)
+        self._tick_nullify()
+
     def start(self) -> None:
         super(DataFeedCandles, self).start()
         self.candle_cursor = 0
@@ -41,6 +108,9 @@ class DataFeedCandles(DataBase):
             return False
 
         candle = self.candles[self.candle_cursor]
+        self.lines.bars_to_day_end[0] = self._bars_to_day_end[self.candle_cursor]
+        self.lines.days_to_end[0] = self._days_to_end[self.candle_cursor]
+        self.lines.next_day_dt[0] = self._next_day_dts[self.candle_cursor]
         self.candle_cursor += 1
         return self._loadline(candle)
 
@@ -54,6 +124,173 @@ class DataFeedCandles(DataBase):
         return True
 
 
+class DataFeedCompact(DataFeedCandles):
+    # CompactCandles are widened bar by bar when loaded, without a Candle object per bar
+    def __init__(self):
+        super(DataFeedCompact, self).__init__()
+        self.candles: CompactCandles
+
+    def _index_days(self) -> None:
+        # the same as DataFeedCandles._index_days on arrays of UTC days
+        count = max(len(self.candles) - 1, 0)
+        minutes = self.candles.minutes[:count].astype(np.int64)
+        days = minutes // 1440
+        idxs = np.arange(count)
+        is_day_end = np.ones(count, dtype=bool)
+        is_day_end[:-1] = days[1:] > days[:-1]
+        is_next_day = is_day_end.copy()
+        is_next_day[-1:] = False
+
+        idxs_day_end = np.minimum.accumulate(np.where(is_day_end, idxs, count)[::-1])[::-1]
+        self._bars_to_day_end = (idxs_day_end - idxs).astype(np.int32)
+        self._days_to_end = np.cumsum(is_next_day[::-1])[::-1].astype(np.int32)
+        nums = minutes / 1440 + UNIX_EPOCH_NUM
+        self._next_day_dts = np.where(is_next_day[idxs_day_end], nums[np.minimum(idxs_day_end + 1, count - 1)],
+                                      float('nan'))
+
+    def _load(self):
+        if self.candle_cursor >= len(self.candles)-1:
+            return False
+
+        i, c = self.candle_cursor, self.candles
+        scale = c.scale
+        self.lines.bars_to_day_end[0] = self._bars_to_day_end[i]
+        self.lines.days_to_end[0] = self._days_to_end[i]
+        self.lines.next_day_dt[0] = self._next_day_dts[i]
+        self.lines.datetime[0] = int(c.minutes[i]) / 1440 + UNIX_EPOCH_NUM
+        self.lines.open[0] = int(c.open[i]) / scale
+        self.lines.high[0] = int(c.high[i]) / scale
+        self.lines.low[0] = int(c.low[i]) / scale
+        self.lines.close[0] = int(c.close[i]) / scale
+        self.lines.volume[0] = int(c.volume[i])
+        self.candle_cursor += 1
+        return True
+
+
+class ReplayClock:
+    # Paces bars of replay feeds: a new timestamp is given out `seconds_per_bar` after the previous one,
+    # feeds with bars on the same timestamp don't wait again. Without `seconds_per_bar` bars go as fast as possible
+    def __init__(self, seconds_per_bar: float | None = None):
+        self.seconds_per_bar = seconds_per_bar
+        self._last_num = float('-inf')
+        self._last_wall = 0.
+
+    def wait(self, num: float) -> None:
+        if num <= self._last_num:
+            return
+        if self.seconds_per_bar is not None:
+            time.sleep(max(self._last_wall + self.seconds_per_bar - time.perf_counter(), 0))
+        self._last_num = num
+        self._last_wall = time.perf_counter()
+
+
+class DataFeedReplay(DataFeedCandles):
+    # Candles are pushed one by one on the clock's pace, so cerebro must run with `preload=False` and
+    # `runonce=False` for bars to be loaded between calls of `next`. The lookahead lines come from the whole list
+    def __init__(self):
+        super(DataFeedReplay, self).__init__()
+        self.clock: ReplayClock
+
+    @classmethod
+    def from_candles_on_clock(cls, candles: Candles, timeframe: TimeFrame, clock: ReplayClock) -> Self:
+        self = cls.from_candles(candles=candles, timeframe=timeframe)
+        self.clock = clock
+        return self
+
+    def _load(self):
+        if not super(DataFeedReplay, self)._load():
+            return False
+        self.clock.wait(self.lines.datetime[0])
+        return True
+
+
+class DataFeedPanel(DataBase):
+    # The clock of a CandlePanel with a bar on every timestamp of the panel. Tickers are PanelView columns which
+    # move on it, so cerebro loads and synchronizes one feed instead of a feed per ticker and never rewinds.
+    def __init__(self):
+        super(DataFeedPanel, self).__init__()
+        self.panel: CandlePanel
+        self.views: list[PanelView]
+        self._nums: np.ndarray
+        self._cursor = 0
+
+    @classmethod
+    def from_panel(cls, panel: CandlePanel, candles_by_ticker: dict[str, Candles], timeframe: TimeFrame) -> Self:
+        self = cls(timeframe=timeframe)
+        self.panel = panel
+        self._nums = panel.times / 86400 + UNIX_EPOCH_NUM
+        self.views = [PanelView(clock=self, ticker=ticker, candles=candles)
+                      for ticker, candles in candles_by_ticker.items()]
+        return self
+
+    def start(self) -> None:
+        super(DataFeedPanel, self).start()
+        self._cursor = 0
+
+    def _load(self):
+        if self._cursor >= len(self.panel):
+            return False
+        self.lines.datetime[0] = self._nums[self._cursor]
+        self._cursor += 1
+        return True
+
+
+class PanelColumn:
+    # values of a view on the clock's bar, `ago` as in backtrader lines
+    def __init__(self, clock: DataFeedPanel, values: np.ndarray):
+        self.clock = clock
+        self.values = values
+
+    def __getitem__(self, ago: int) -> float:
+        return float(self.values[len(self.clock) - 1 + ago])
+
+
+class PanelView:
+    # A ticker of a CandlePanel as strategies and brokers use a data feed: its lines are columns of the panel
+    # on the clock's bar, time and params are the clock's. Where the ticker has no candle `valid` is 0 and
+    # the lookahead lines are the ones of its last candle
+    tick_open = tick_high = tick_low = tick_close = tick_volume = None
+    _compensate = None
+
+    def __init__(self, clock: DataFeedPanel, ticker: str, candles: Candles):
+        panel = clock.panel
+        self.clock = clock
+        self.column = panel.tickers.index(ticker)
+        self.candles = candles
+        self._name = ticker
+        self._day_bars: DayBars | None = None
+
+        k = self.column
+        self.valid = PanelColumn(clock, panel.valid[:, k])
+        self.open = PanelColumn(clock, panel.open[:, k])
+        self.high = PanelColumn(clock, panel.high[:, k])
+        self.low = PanelColumn(clock, panel.low[:, k])
+        self.close = PanelColumn(clock, panel.close[:, k])
+        self.volume = PanelColumn(clock, panel.volume[:, k])
+
+        # index of the ticker's last candle on every row
+        idxs = np.cumsum(panel.valid[:, k]) - 1
+        bars_to_day_end, days_to_end, next_day_dts = (np.array(a + [float('nan')], dtype=np.float64)
+                                                      for a in index_days(candles))
+        self.bars_to_day_end = PanelColumn(clock, bars_to_day_end[idxs])
+        self.days_to_end = PanelColumn(clock, days_to_end[idxs])
+        self.next_day_dt = PanelColumn(clock, next_day_dts[idxs])
+
+    def __getattr__(self, name: str):
+        # datetime, params, time zone and date conversions
+        if name.startswith('__') or 'clock' not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.clock, name)
+
+    def __len__(self) -> int:
+        return len(self.clock)
+
+    def get_day_bars(self) -> DayBars:
+        if self._day_bars is None:
+            self._day_bars = DayBars.from_arrays(self.clock.panel.get_arrays(self._name))
+        return self._day_bars
+
+
 class MyCSVData(GenericCSVData):
     params = (
         ('separator', DELIMITER),
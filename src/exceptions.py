@@ -1,2 +1,6 @@
 class SkipIteration(Exception):
     pass
+
+
+class BacktestCancelled(Exception):
+    pass
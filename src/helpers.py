@@ -1,4 +1,10 @@
+import os
+import json
+import hashlib
+import resource
 from datetime import datetime
+from pathlib import Path
+from typing import Any
 
 from tinkoff.invest import CandleInterval, Instrument
 from backtrader import TimeFrame
@@ -8,9 +14,20 @@ from my_tinkoff.schemas import Candles
 from my_tinkoff.csv_candles import CSVCandles
 
 from src.data_feeds import DataFeedCandles
+from src.candle_arrays import CompactCandles
+from src.candles_cache import CandlesCache
+from src.candle_archive import CandleArchive
 from src.schemas import InstrumentData
 
 
+candles_cache = CandlesCache()
+# candles are cached as int32 arrays where they widen back to the same prices, less than a tenth of the memory of
+# Candle objects. Set before feeds are made, like attributes of Backtester
+compact_candles: bool = False
+# e.g. `CandleArchive(DIR_CANDLES_ARCHIVE)`: archived months are read from it, others from csv files and archived
+candles_archive: CandleArchive | None = None
+
+
 def get_timeframe_by_candle_interval(interval: CandleInterval) -> TimeFrame:
     match interval:
         case CandleInterval.CANDLE_INTERVAL_DAY:
@@ -37,12 +54,58 @@ async def get_and_prepare_candles(
         from_: datetime,
         to: datetime,
         interval: CandleInterval
-) -> Candles:
+) -> Candles | CompactCandles:
+    return await candles_cache.get(
+        instrument=instrument,
+        from_=from_,
+        to=to,
+        interval=interval,
+        load=download_and_prepare_candles,
+        compact=compact_candles,
+    )
+
+
+async def download_and_prepare_candles(
+        instrument: Instrument,
+        from_: datetime,
+        to: datetime,
+        interval: CandleInterval
+) -> Candles | CompactCandles:
+    if candles_archive is not None:
+        candles = candles_archive.read(instrument=instrument, from_=from_, to=to, interval=interval)
+        if candles is not None:
+            return candles
+
     candles = await CSVCandles.download_or_read(instrument=instrument, from_=from_, to=to, interval=interval)
     candles.check_datetime_consistency()
-    return candles.remove_weekend_and_holidays_candles()
+    candles = candles.remove_weekend_and_holidays_candles()
+    if candles_archive is not None:
+        candles_archive.write(instrument=instrument, interval=interval, candles=candles, from_=from_, to=to)
+    return candles
 
 
 def pack_instruments_datas(instruments: list[Instrument], data_feeds: list[DataFeedCandles]) -> list[InstrumentData]:
     return [InstrumentData(ticker=instr.ticker, data_feed=data_feed)
             for instr, data_feed in zip(instruments, data_feeds)]
+
+
+def get_peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux, children are the finished worker processes
+    usage_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(usage_self, usage_children) / 1024, 2)
+
+
+def get_spec_hash(spec: Any) -> str:
+    # spec of a checkpoint, snapshot or task, values json can't encode are taken by repr
+    return hashlib.sha1(json.dumps(spec, sort_keys=True, default=repr).encode()).hexdigest()[:16]
+
+
+def write_atomic(filepath: Path, data: bytes) -> None:
+    # readers see the old or the new file, the temp name is unique per process for directories shared by hosts
+    filepath_tmp = filepath.with_name(f'.{filepath.name}.{os.getpid()}.tmp')
+    with open(filepath_tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(filepath_tmp, filepath)
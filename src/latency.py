@@ -0,0 +1,119 @@
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Type, Self
+
+import numpy as np
+
+from src.strategies.base import BaseStrategy
+
+
+# upper bounds of latency bins in microseconds, the last bin is the rest. Bins are fixed, so histograms
+# of time-of-day buckets and of different runs are comparable
+LATENCY_BINS_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class TimedStrategy:
+    # Mixin recording wall time of `next` on every bar and of `_process_data` of every ticker,
+    # see `make_timed_strategy`
+    def __init__(self, *args, **kwargs):
+        self.latencies_next = array('q')
+        self.nums_next = array('d')
+        self.latencies_data = array('q')
+        self.nums_data = array('d')
+        self.idxs_data = array('i')
+        super().__init__(*args, **kwargs)
+        self._idxs_by_name = {data._name: k for k, data in enumerate(self.datas)}
+
+    def next(self):
+        start = time.perf_counter_ns()
+        super().next()
+        self.latencies_next.append(time.perf_counter_ns() - start)
+        self.nums_next.append(self.datetime[0])
+
+    def _process_data(self, data):
+        start = time.perf_counter_ns()
+        try:
+            return super()._process_data(data)
+        finally:
+            self.latencies_data.append(time.perf_counter_ns() - start)
+            self.nums_data.append(data.datetime[0])
+            self.idxs_data.append(self._idxs_by_name[data._name])
+
+
+def make_timed_strategy(strategy: Type[BaseStrategy]) -> Type[BaseStrategy]:
+    return type(strategy.__name__, (TimedStrategy, strategy), {})
+
+
+@dataclass
+class LatencyStats:
+    # microseconds
+    count: int
+    p50: float
+    p99: float
+    max: float
+    histogram: list[int]  # counts by `LATENCY_BINS_US`
+
+    @classmethod
+    def from_latencies(cls, latencies_ns: np.ndarray) -> Self:
+        if not len(latencies_ns):
+            return cls(count=0, p50=0, p99=0, max=0, histogram=[0] * (len(LATENCY_BINS_US) + 1))
+        p50, p99 = np.percentile(latencies_ns, [50, 99]) / 1000
+        idxs_bins = np.searchsorted(np.array(LATENCY_BINS_US) * 1000, latencies_ns, side='right')
+        return cls(count=len(latencies_ns), p50=float(p50), p99=float(p99), max=float(latencies_ns.max() / 1000),
+                   histogram=np.bincount(idxs_bins, minlength=len(LATENCY_BINS_US) + 1).tolist())
+
+    def __repr__(self) -> str:
+        return f'{self.count} | p50={round(self.p50, 1)}us | p99={round(self.p99, 1)}us | max={round(self.max, 1)}us'
+
+
+@dataclass
+class LatencyReport:
+    next: LatencyStats
+    process_data: LatencyStats
+    by_ticker: dict[str, LatencyStats]  # of `_process_data`
+    by_time_of_day: dict[str, LatencyStats]  # of `next`, UTC buckets 'HH:MM'
+    count_worst: int = 10
+
+    def get_histograms(self, buckets: list[str] | None = None) -> str:
+        # a row of counts by latency bins of `next` per time-of-day bucket, all buckets by default
+        names = ['<' + str(b) for b in LATENCY_BINS_US] + ['>=' + str(LATENCY_BINS_US[-1])]
+        rows = [('bucket', *names), ('all', *self.next.histogram)]
+        rows += [(b, *self.by_time_of_day[b].histogram) for b in (buckets or sorted(self.by_time_of_day))]
+        widths = [max(len(str(row[k])) for row in rows) for k in range(len(names) + 1)]
+        return '\n'.join(' '.join(str(v).rjust(w) for v, w in zip(row, widths)) for row in rows)
+
+    def __repr__(self) -> str:
+        worst = sorted(self.by_time_of_day.items(), key=lambda x: x[1].p99, reverse=True)[:self.count_worst]
+        return '\n'.join((
+            f'next: {self.next}',
+            f'_process_data: {self.process_data}',
+            *[f'  {ticker}: {stats}' for ticker, stats in self.by_ticker.items()],
+            f'Worst times of day by p99 of next:',
+            *[f'  {bucket}: {stats}' for bucket, stats in sorted(worst)],
+            f'Histograms of next by latency bins (us):',
+            self.get_histograms(sorted(bucket for bucket, _ in worst)),
+        ))
+
+
+def get_latency_report(strategy: TimedStrategy, bucket_minutes: int = 1) -> LatencyReport:
+    latencies_next = np.frombuffer(strategy.latencies_next, dtype=np.int64)
+    latencies_data = np.frombuffer(strategy.latencies_data, dtype=np.int64)
+    idxs_data = np.frombuffer(strategy.idxs_data, dtype=np.int32)
+
+    # backtrader date nums are days, their fraction is the time of day
+    minutes = np.round(np.frombuffer(strategy.nums_next, dtype=np.float64) % 1 * 1440).astype(np.int64) % 1440
+    buckets = minutes // bucket_minutes * bucket_minutes
+    by_time_of_day = {
+        f'{b // 60:02d}:{b % 60:02d}': LatencyStats.from_latencies(latencies_next[buckets == b])
+        for b in np.unique(buckets)
+    }
+    return LatencyReport(
+        next=LatencyStats.from_latencies(latencies_next),
+        process_data=LatencyStats.from_latencies(latencies_data),
+        by_ticker={
+            data._name: LatencyStats.from_latencies(latencies_data[idxs_data == k])
+            for k, data in enumerate(strategy.datas)
+        },
+        by_time_of_day=by_time_of_day,
+    )
@@ -0,0 +1,55 @@
+import sys
+from array import array
+from collections import deque
+from types import ModuleType, FunctionType, MethodType
+
+from backtrader import LineSeries, LineBuffer, Analyzer, BrokerBase, Cerebro
+from my_tinkoff.schemas import Candles
+
+from src.candle_arrays import CompactCandles
+
+
+MB = 1024 ** 2
+SIZE_FLOAT = sys.getsizeof(0.)
+SKIPPED_TYPES = (
+    type, ModuleType, FunctionType, MethodType,
+    LineSeries, LineBuffer, Analyzer, BrokerBase, Cerebro,
+)
+
+
+def get_deep_size(obj: object, seen: set[int] | None = None) -> int:
+    # Follows containers and instance attributes of plain objects. Line series, analyzers, brokers and cerebro
+    # are measured separately or reference everything, classes, functions and modules are shared.
+    seen = set() if seen is None else seen
+    if id(obj) in seen or isinstance(obj, SKIPPED_TYPES):
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(get_deep_size(k, seen) + get_deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(get_deep_size(x, seen) for x in obj)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, array):
+        size += get_deep_size(vars(obj), seen)
+    return size
+
+
+def get_candles_size(candles: Candles | CompactCandles) -> int:
+    if isinstance(candles, CompactCandles):
+        return candles.nbytes
+    # candles are alike, so one of them stands for all
+    if not candles:
+        return sys.getsizeof(candles)
+    return sys.getsizeof(candles) + len(candles) * get_deep_size(candles[0])
+
+
+def get_lines_size(line_series: LineSeries) -> int:
+    size = 0
+    for line in line_series.lines:
+        if isinstance(line.array, deque):
+            # a bounded buffer keeps float objects
+            size += sys.getsizeof(line.array) + len(line.array) * SIZE_FLOAT
+        else:
+            size += sys.getsizeof(line.array)
+    return size
@@ -0,0 +1,77 @@
+import time
+import logging
+import argparse
+from dataclasses import replace
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any
+
+from backtrader import TimeFrame
+
+from config import FILEPATH_LOGGER
+from src.my_logging import get_logger
+from src.backtester import Backtester
+from src.data_feeds import DataFeedCandles
+from src.helpers import get_peak_rss_mb
+from src.schemas import StrategyData, InstrumentData
+from src.strategies.closing_on_highs import StrategyClosingOnHighs
+from src.synthetic import make_long_minute_candles
+from src.regression import params_closing_on_highs
+
+
+def run_bounded(bounded_memory: bool, count_tickers: int, count_days: int, bars_per_day: int) -> dict[str, Any]:
+    # runs in a fresh process, so peak RSS belongs to the mode
+    Backtester.LOGGING = False
+    Backtester.PLOTTING = False
+    Backtester.BOUNDED_MEMORY = bounded_memory
+    instruments_data = [
+        InstrumentData(
+            ticker=f'SYN{seed}',
+            data_feed=DataFeedCandles.from_candles(
+                candles=make_long_minute_candles(seed=seed, count_days=count_days, bars_per_day=bars_per_day,
+                                                 percent_missing=.1),
+                timeframe=TimeFrame.Minutes,
+            ),
+        ) for seed in range(count_tickers)
+    ]
+    rss_candles = get_peak_rss_mb()
+    params = replace(params_closing_on_highs, c_price_change=2, take_stop=(.01, .005))
+    backtester = Backtester(
+        strategies_data=[StrategyData(strategy=StrategyClosingOnHighs, params=params)],
+        instruments_data=instruments_data,
+    )
+    start = time.perf_counter()
+    result = backtester.run()[0]
+    return {
+        'seconds': time.perf_counter() - start,
+        'rss_candles_mb': rss_candles,
+        'peak_rss_mb': get_peak_rss_mb(),
+        'trades': result.trades,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Peak RSS of a run with full and bounded line buffers')
+    parser.add_argument('--tickers', type=int, default=40)
+    parser.add_argument('--years', type=int, default=6)
+    parser.add_argument('--bars-per-day', type=int, default=60)
+    args = parser.parse_args()
+
+    trades = {}
+    for bounded_memory in (False, True):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            output = executor.submit(run_bounded, bounded_memory=bounded_memory, count_tickers=args.tickers,
+                                     count_days=args.years * 250, bars_per_day=args.bars_per_day).result()
+        trades[bounded_memory] = output['trades']
+        logging.info(f'BOUNDED_MEMORY={bounded_memory} | {args.tickers} tickers x {args.years} years | '
+                     f'{len(output["trades"])} trades in {round(output["seconds"], 1)}s | RSS after loading '
+                     f'candles: {output["rss_candles_mb"]} MB | Peak RSS: {output["peak_rss_mb"]} MB')
+
+    if trades[False] != trades[True]:
+        raise Exception('Trades of a bounded run differ')
+    logging.info('Trades of both modes are the same')
+
+
+if __name__ == '__main__':
+    get_logger(FILEPATH_LOGGER)
+    main()
@@ -1,6 +1,8 @@
 import asyncio
 from datetime import datetime
+from concurrent.futures import Executor
 from multiprocessing import Pool, cpu_count
+from typing import Awaitable, Callable, TypeVar
 
 from tinkoff.invest import Instrument, InstrumentIdType, CandleInterval
 
@@ -9,6 +11,11 @@ from my_tinkoff.schemas import ClassCode
 
 from src.data_feeds import DataFeedCandles
 from src.helpers import get_data_feed
+from src.backtester import Backtester
+from src.schemas import StrategyResult
+
+
+T = TypeVar('T')
 
 
 async def async_get_instruments_by_tickers(tickers: list[str]) -> list[Instrument]:
@@ -42,6 +49,52 @@ def sync_get_data_feed(instrument: Instrument, from_: datetime,
     return res
 
 
+async def async_get_instruments_data_feeds_bounded(
+        instruments: list[Instrument],
+        from_: datetime,
+        to: datetime,
+        interval: CandleInterval,
+        max_concurrency: int,
+) -> list[DataFeedCandles]:
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def get_data_feed_bounded(instrument: Instrument) -> DataFeedCandles:
+        async with semaphore:
+            return await get_data_feed(instrument=instrument, from_=from_, to=to, interval=interval)
+
+    return list(await asyncio.gather(*[get_data_feed_bounded(i) for i in instruments]))
+
+
+def sync_get_data_feeds(instruments: list[Instrument], from_: datetime, to: datetime,
+                        interval: CandleInterval, max_concurrency: int) -> list[DataFeedCandles]:
+    return asyncio.run(async_get_instruments_data_feeds_bounded(
+        instruments=instruments, from_=from_, to=to, interval=interval, max_concurrency=max_concurrency,
+    ))
+
+
+def pipelined_get_instruments_data_feeds(
+        instruments: list[Instrument],
+        from_: datetime,
+        to: datetime,
+        interval: CandleInterval,
+        processes: int = cpu_count(),
+        max_concurrency: int = 8,
+) -> list[DataFeedCandles]:
+    # Every process runs its own event loop with up to `max_concurrency` downloads, so network waits of
+    # one instrument overlap parsing of others. `CSVCandles.download_or_read` downloads and parses in one call,
+    # and parsed candles cost more to pickle than to prepare, so both stages stay in the same process
+    processes = max(min(processes, len(instruments)), 1)
+    chunks = [instruments[k::processes] for k in range(processes)]
+    args_for_pool = [(chunk, from_, to, interval, max_concurrency) for chunk in chunks]
+    with Pool(processes=processes) as pool:
+        data_feeds_by_chunk = pool.starmap(sync_get_data_feeds, args_for_pool)
+
+    data_feeds = [None] * len(instruments)
+    for k, chunk_data_feeds in enumerate(data_feeds_by_chunk):
+        data_feeds[k::processes] = chunk_data_feeds
+    return data_feeds
+
+
 def multiprocessing_get_instruments_data_feeds(
         instruments: list[Instrument],
         from_: datetime,
@@ -51,3 +104,38 @@ def multiprocessing_get_instruments_data_feeds(
     args_for_pool = [(i, from_, to, interval) for i in instruments]
     with Pool(processes=cpu_count()) as pool:
         return pool.starmap(sync_get_data_feed, args_for_pool)
+
+
+async def pipelined_backtests(
+        instruments: list[Instrument],
+        prepare: Callable[[Instrument], Awaitable[Backtester | None]],
+        collect: Callable[[Backtester, list[StrategyResult]], T],
+        max_concurrency: int = 1,
+        max_prefetch: int = 2,
+        executor: Executor | None = None,
+) -> list[T | None]:
+    # `prepare` downloads data of upcoming instruments on the event loop while up to `max_concurrency` backtests
+    # run in the executor. At most `max_prefetch` prepared backtests wait for a run, so their candles don't pile up.
+    # A finished backtest is passed to `collect` and dropped, only what it returns is kept. Instruments without
+    # a backtest (`prepare` returned None) get None
+    slots = asyncio.Semaphore(max_concurrency + max_prefetch)
+    runs = asyncio.Semaphore(max_concurrency)
+
+    async def process(instrument: Instrument) -> T | None:
+        async with slots:
+            backtester = await prepare(instrument)
+            if backtester is None:
+                return None
+            async with runs:
+                results = await backtester.run_async(executor=executor)
+            return collect(backtester, results)
+
+    tasks = [asyncio.create_task(process(i)) for i in instruments]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        # a failed or cancelled pipeline stops running backtests and downloads
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
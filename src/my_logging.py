@@ -1,25 +1,170 @@
-import logging
+import os
 import sys
+import time
+import atexit
+import signal
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from multiprocessing.util import Finalize
 from pathlib import Path
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 
 from my_tinkoff.date_utils import TZ_MOSCOW
 
 
-def get_logger(filepath: Path) -> None:
-    logging.basicConfig(
-        level=logging.DEBUG,
-        encoding='utf-8',
-        format="[{asctime},{msecs:03.0f}]:[{levelname}]:{message}",
-        datefmt='%d.%m.%Y %H:%M:%S',
-        style='{',
-        handlers=[
+class BatchFileHandler(logging.FileHandler):
+    # `emit` flushes after every record, the listener flushes batches instead
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+
+class BatchStreamHandler(logging.StreamHandler):
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+
+class PipeQueueHandler(QueueHandler):
+    # A logging call only appends the record to a buffer of the process. A sender thread pickles buffered records
+    # and writes them to the pipe in batches, so a slow listener or a full pipe doesn't block the backtest loop.
+    # The rest of the buffer is sent when a process exits or is terminated, as `with Pool(...)` does with workers.
+    # Records not sent yet are lost only by a bare `os._exit`
+    def __init__(self, queue_, batch_size: int = 1000):
+        super().__init__(queue_)
+        self.batch_size = batch_size
+        self._pid_sender: int | None = None
+        self._reset()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def enqueue(self, record):
+        if self._pid_sender != os.getpid():
+            self._start_sender()
+        self._buffer.append(record)
+        self._has_records.set()
+
+    def flush(self, timeout: float = -1):
+        if not self._lock_send.acquire(timeout=timeout):
+            return
+        try:
+            while self._buffer:
+                self.queue.put([self._buffer.popleft() for _ in range(min(len(self._buffer), self.batch_size))])
+        finally:
+            self._lock_send.release()
+
+    def _reset(self):
+        self._buffer: deque[logging.LogRecord] = deque()
+        self._has_records = threading.Event()
+        self._lock_send = threading.Lock()
+
+    def _start_sender(self):
+        # threads don't survive a fork, every process starts its own sender. Finalizers run at the exit of
+        # the main process and of pool workers
+        self._pid_sender = os.getpid()
+        threading.Thread(target=self._send, daemon=True).start()
+        Finalize(self, self.flush, exitpriority=10)
+
+    def _send(self):
+        while True:
+            self._has_records.wait()
+            self._has_records.clear()
+            self.flush()
+
+    def _after_fork(self):
+        # records of the parent are sent by the parent. The wait on SIGTERM is bounded, the signal can come
+        # while the main thread itself sends a batch
+        self._reset()
+        signal.signal(signal.SIGTERM, self._on_terminate)
+
+    def _on_terminate(self, signum, _):
+        self.flush(timeout=5)
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+
+class BatchQueueListener(QueueListener):
+    def __init__(self, queue_, *handlers, batch_size: int = 1000):
+        super().__init__(queue_, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+
+    def _monitor(self):
+        # records come in batches of processes, files are flushed every `batch_size` records and whenever
+        # the pipe is drained, so an idle log is up to date
+        count_pending = 0
+        while True:
+            records = self.queue.get()
+            if records is self._sentinel:
+                self._flush_batch()
+                break
+            for record in records:
+                self.handle(record)
+            count_pending += len(records)
+
+            if count_pending >= self.batch_size or self.queue.empty():
+                self._flush_batch()
+                count_pending = 0
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+    def _flush_batch(self):
+        for handler in self.handlers:
+            handler.flush_batch()
+
+
+def get_logger(filepath: Path, queued: bool = False) -> None:
+    # With `queued` records are sent to a multiprocessing queue and written by a background thread in batches,
+    # so logging doesn't block the backtest loop on pickling, the pipe or I/O. Forked worker processes inherit
+    # the queue handler.
+    if queued:
+        if (start_method := multiprocessing.get_start_method()) != 'fork':
+            raise Exception(f'Queued logging needs `fork` start method of processes, not `{start_method}`: '
+                            f'spawned processes don\'t inherit the queue handler')
+        handlers = [
+            BatchFileHandler(filepath, mode='a', encoding='utf-8'),
+            BatchStreamHandler(sys.stdout),
+        ]
+    else:
+        handlers = [
             logging.FileHandler(filepath, mode='a'),
             logging.StreamHandler(sys.stdout),
         ]
+
+    formatter = logging.Formatter(
+        fmt="[{asctime},{msecs:03.0f}]:[{levelname}]:{message}",
+        datefmt='%d.%m.%Y %H:%M:%S',
+        style='{',
+    )
+    # Moscow has no DST, so the offset is taken once instead of building a datetime for every record
+    offset_moscow = datetime.now(tz=TZ_MOSCOW).utcoffset().total_seconds()
+    logging.Formatter.converter = lambda _, seconds: time.gmtime(seconds + offset_moscow)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    if queued:
+        queue_ = multiprocessing.SimpleQueue()
+        listener = BatchQueueListener(queue_, *handlers)
+        listener.start()
+        queue_handler = PipeQueueHandler(queue_)
+        # records of the main process are sent before the sentinel
+        atexit.register(lambda: (queue_handler.flush(), listener.stop()))
+        # message is formatted once more by the listener handlers
+        queue_handler.setFormatter(logging.Formatter('{message}', style='{'))
+        handlers = [queue_handler]
+
+    logging.basicConfig(
+        level=logging.DEBUG,
+        encoding='utf-8',
+        handlers=handlers,
     )
 
-    logging.Formatter.converter = lambda *args: datetime.now(tz=TZ_MOSCOW).timetuple()
     logging.getLogger('asyncio').setLevel(logging.WARNING)
     logging.getLogger('tinkoff').setLevel(logging.WARNING)
     logging.getLogger('grpc').setLevel(logging.WARNING)
@@ -0,0 +1,152 @@
+from dataclasses import dataclass
+from itertools import combinations
+from multiprocessing import Pool
+from typing import Self
+
+import numpy as np
+
+from src.candle_arrays import CandleArrays
+from src.params import ParamsPairSpread, S
+
+
+# memory for temporary (bars x pairs) arrays of one chunk
+MAX_CHUNK_BYTES = 256 * 1024 ** 2
+COUNT_CHUNK_ARRAYS = 12
+
+_log_closes: np.ndarray | None = None
+
+
+@dataclass
+class AlignedCloses:
+    # log closes on the union of timestamps, the last known close is carried forward,
+    # nan before the first candle of a ticker
+    tickers: list[str]
+    times: np.ndarray
+    log_closes: np.ndarray  # (times, tickers)
+
+    @classmethod
+    def from_arrays(cls, arrays_by_ticker: dict[str, CandleArrays]) -> Self:
+        times = np.unique(np.concatenate([a.times for a in arrays_by_ticker.values()]))
+        log_closes = np.full((len(times), len(arrays_by_ticker)), np.nan)
+        for k, arrays in enumerate(arrays_by_ticker.values()):
+            log_closes[np.searchsorted(times, arrays.times), k] = np.log(arrays.close)
+
+        idxs_last = np.where(~np.isnan(log_closes), np.arange(len(times))[:, None], 0)
+        np.maximum.accumulate(idxs_last, axis=0, out=idxs_last)
+        return cls(
+            tickers=list(arrays_by_ticker),
+            times=times,
+            log_closes=log_closes[idxs_last, np.arange(log_closes.shape[1])],
+        )
+
+
+@dataclass
+class PairCandidate:
+    # spread = log(close_y) - hedge_ratio * log(close_x) - intercept
+    ticker_y: str
+    ticker_x: str
+    hedge_ratio: float
+    intercept: float
+    zscore: float  # of the last spread value
+    half_life: float  # in bars, inf if the spread doesn't revert
+    coint_stat: float  # Dickey-Fuller t-statistic of the spread, Engle-Granger 5% critical value is about -3.34
+    count_obs: int
+
+    def get_params(
+            self,
+            z_entry: float | list[float],
+            z_exit: float | list[float],
+            sizer: S | None = None,
+    ) -> ParamsPairSpread:
+        return ParamsPairSpread(
+            ticker_y=self.ticker_y,
+            ticker_x=self.ticker_x,
+            hedge_ratio=self.hedge_ratio,
+            intercept=self.intercept,
+            z_entry=z_entry,
+            z_exit=z_exit,
+            sizer=sizer,
+        )
+
+
+def screen_pairs(
+        aligned: AlignedCloses,
+        processes: int = 1,
+        min_count_obs: int = 100,
+        max_half_life: float | None = None,
+) -> list[PairCandidate]:
+    # every unordered pair of tickers, ranked from the most cointegrated
+    pairs = np.array(list(combinations(range(len(aligned.tickers)), 2)), dtype=np.int64).reshape(-1, 2)
+    size_chunk = max(1, MAX_CHUNK_BYTES // (max(len(aligned.times), 1) * 8 * COUNT_CHUNK_ARRAYS))
+    chunks = [pairs[i:i + size_chunk] for i in range(0, len(pairs), size_chunk)]
+
+    if processes > 1 and len(chunks) > 1:
+        with Pool(processes=processes, initializer=_set_log_closes, initargs=(aligned.log_closes,)) as pool:
+            stats = pool.map(_screen_chunk, chunks)
+    else:
+        _set_log_closes(aligned.log_closes)
+        stats = [_screen_chunk(chunk) for chunk in chunks]
+    stats = np.concatenate(stats) if stats else np.empty((0, 6))
+
+    candidates = []
+    for (i, j), (hedge_ratio, intercept, zscore, half_life, coint_stat, count_obs) in zip(pairs, stats):
+        if count_obs < min_count_obs or np.isnan(coint_stat):
+            continue
+        if max_half_life is not None and half_life > max_half_life:
+            continue
+        candidates.append(PairCandidate(
+            ticker_y=aligned.tickers[i],
+            ticker_x=aligned.tickers[j],
+            hedge_ratio=float(hedge_ratio),
+            intercept=float(intercept),
+            zscore=float(zscore),
+            half_life=float(half_life),
+            coint_stat=float(coint_stat),
+            count_obs=int(count_obs),
+        ))
+    return sorted(candidates, key=lambda c: c.coint_stat)
+
+
+def _set_log_closes(log_closes: np.ndarray) -> None:
+    # workers get the matrix once instead of with every chunk
+    global _log_closes
+    _log_closes = log_closes
+
+
+def _screen_chunk(pairs: np.ndarray) -> np.ndarray:
+    # columns: hedge_ratio, intercept, zscore, half_life, coint_stat, count_obs
+    y = _log_closes[:, pairs[:, 0]]
+    x = _log_closes[:, pairs[:, 1]]
+    valid = ~np.isnan(y) & ~np.isnan(x)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # OLS of y on x over bars where both tickers have prices
+        count = valid.sum(axis=0)
+        mean_x = np.where(valid, x, 0).sum(axis=0) / count
+        mean_y = np.where(valid, y, 0).sum(axis=0) / count
+        dx = np.where(valid, x - mean_x, 0)
+        dy = np.where(valid, y - mean_y, 0)
+        hedge_ratio = (dx * dy).sum(axis=0) / (dx * dx).sum(axis=0)
+        intercept = mean_y - hedge_ratio * mean_x
+        spread = np.where(valid, dy - hedge_ratio * dx, 0)
+
+        std = np.sqrt((spread ** 2).sum(axis=0) / count)
+        idxs_last = len(valid) - 1 - np.argmax(valid[::-1], axis=0)
+        zscore = spread[idxs_last, np.arange(len(pairs))] / std
+
+        # Dickey-Fuller regression of spread changes on the lagged spread
+        valid_lag = valid[1:] & valid[:-1]
+        count_lag = valid_lag.sum(axis=0)
+        lag = spread[:-1]
+        diff = spread[1:] - lag
+        d_lag = np.where(valid_lag, lag - np.where(valid_lag, lag, 0).sum(axis=0) / count_lag, 0)
+        d_diff = np.where(valid_lag, diff - np.where(valid_lag, diff, 0).sum(axis=0) / count_lag, 0)
+        ss_lag = (d_lag * d_lag).sum(axis=0)
+        slope = (d_lag * d_diff).sum(axis=0) / ss_lag
+        residuals = d_diff - slope * d_lag
+        se = np.sqrt((residuals ** 2).sum(axis=0) / (count_lag - 2) / ss_lag)
+        coint_stat = slope / se
+        # a slope of -1 or below reverts the whole spread within a bar, half-life 0
+        half_life = np.where(slope < 0, -np.log(2) / np.log1p(np.maximum(slope, -1)), np.inf)
+
+    return np.column_stack([hedge_ratio, intercept, zscore, half_life, coint_stat, count])
@@ -0,0 +1,71 @@
+from dataclasses import dataclass
+from typing import Self
+
+import numpy as np
+
+from src.candle_arrays import CandleArrays
+
+
+@dataclass
+class CandlePanel:
+    # Candles of all tickers on the union of their timestamps, arrays are (times, tickers).
+    # Where a ticker has no candle `valid` is False and the bar is flat at its last close with zero volume,
+    # before the first candle it is flat at the first open.
+    tickers: list[str]
+    times: np.ndarray  # unix timestamps in seconds
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+    valid: np.ndarray
+
+    @classmethod
+    def from_arrays(cls, arrays_by_ticker: dict[str, CandleArrays]) -> Self:
+        times = np.unique(np.concatenate([a.times for a in arrays_by_ticker.values()]))
+        shape = (len(times), len(arrays_by_ticker))
+        valid = np.zeros(shape, dtype=bool)
+        open_, high, low, close, volume = (np.zeros(shape) for _ in range(5))
+
+        for k, arrays in enumerate(arrays_by_ticker.values()):
+            rows = np.searchsorted(times, arrays.times)
+            valid[rows, k] = True
+            open_[rows, k] = arrays.open
+            high[rows, k] = arrays.high
+            low[rows, k] = arrays.low
+            close[rows, k] = arrays.close
+            volume[rows, k] = arrays.volume
+
+            # flat bars at the last close, or at the first open before the first candle
+            if len(rows):
+                idxs_last = np.maximum.accumulate(np.where(valid[:, k], np.arange(len(times)), -1))
+                price_fill = np.where(idxs_last >= 0, close[idxs_last, k], arrays.open[0])
+                for a in (open_, high, low, close):
+                    a[~valid[:, k], k] = price_fill[~valid[:, k]]
+
+        return cls(
+            tickers=list(arrays_by_ticker),
+            times=times,
+            open=open_,
+            high=high,
+            low=low,
+            close=close,
+            volume=volume,
+            valid=valid,
+        )
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def get_arrays(self, ticker: str) -> CandleArrays:
+        # the ticker's own candles
+        k = self.tickers.index(ticker)
+        rows = self.valid[:, k]
+        return CandleArrays(
+            times=self.times[rows],
+            open=self.open[rows, k],
+            high=self.high[rows, k],
+            low=self.low[rows, k],
+            close=self.close[rows, k],
+            volume=self.volume[rows, k],
+        )
@@ -1,5 +1,6 @@
 from dataclasses import dataclass, asdict
-from typing import TypeVar, Union
+from itertools import product
+from typing import TypeVar, Union, Any
 
 from backtrader import Sizer, TimeFrame
 
@@ -55,7 +56,33 @@ class ParamsDivGap(_Iterable):
     sizer: S = None
 
 
+@dataclass
+class ParamsPairSpread(_Iterable):
+    ticker_y: str
+    ticker_x: str
+    hedge_ratio: float
+    intercept: float
+    z_entry: float | list[float]
+    z_exit: float | list[float]
+    sizer: S = None
+
+
 AnyParamsStrategy = Union[
     ParamsClosingOnHighs,
-    ParamsDivGap
+    ParamsDivGap,
+    ParamsPairSpread,
 ]
+
+
+def expand_params(params: AnyParamsStrategy) -> list[dict[str, Any]]:
+    # list values are optimization grids, anything else is a single value
+    keys = list(params.__dict__)
+    values = [v if isinstance(v, list) else [v] for v in params.__dict__.values()]
+    return [dict(zip(keys, combo)) for combo in product(*values)]
+
+
+def get_param_repr(value: Any) -> Any:
+    # sizer instances have no stable repr and keep a reference to the strategy after the run
+    if isinstance(value, Sizer):
+        return f'{value.__class__.__name__}({value.params.__dict__})'
+    return value
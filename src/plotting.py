@@ -0,0 +1,109 @@
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from matplotlib.figure import Figure
+
+from src.candle_arrays import CandleArrays
+from src.typed_dicts import AnalysisEquity, AnalysisTrade
+
+
+COLOR_UP = '#26a69a'
+COLOR_DOWN = '#ef5350'
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    # Largest-Triangle-Three-Buckets: keeps points with the biggest visual effect, returns their indexes
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = x.astype(np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    idxs = np.empty(threshold, dtype=np.int64)
+    idxs[0], idxs[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        x_avg, y_avg = x[end:next_end].mean(), y[end:next_end].mean()
+
+        areas = np.abs((x[a] - x_avg) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (y_avg - y[a]))
+        a = start + int(areas.argmax())
+        idxs[i + 1] = a
+    return idxs
+
+
+def rebucket_ohlc(arrays: CandleArrays, buckets: int) -> CandleArrays:
+    # merges consecutive candles into `buckets` candles, highs and lows of the range stay visible
+    if buckets >= len(arrays):
+        return arrays
+
+    starts = np.linspace(0, len(arrays), buckets, endpoint=False).astype(np.int64)
+    ends = np.append(starts[1:], len(arrays)) - 1
+    return CandleArrays(
+        times=arrays.times[starts],
+        open=arrays.open[starts],
+        high=np.maximum.reduceat(arrays.high, starts),
+        low=np.minimum.reduceat(arrays.low, starts),
+        close=arrays.close[ends],
+        volume=np.add.reduceat(arrays.volume, starts),
+    )
+
+
+def plot_backtest(
+        filepath: Path,
+        title: str,
+        arrays_by_ticker: dict[str, CandleArrays],
+        equity: AnalysisEquity,
+        trades: list[AnalysisTrade],
+        max_points: int = 2000,
+) -> Path:
+    # Renders with the Agg canvas of a standalone Figure (no pyplot, no GUI), the number of drawn
+    # candles and equity points doesn't depend on the length of the history
+    fig = Figure(figsize=(16, 4 * len(arrays_by_ticker) + 3), layout='constrained')
+    axes = fig.subplots(
+        nrows=len(arrays_by_ticker) + 1,
+        sharex=True,
+        squeeze=False,
+        height_ratios=[3] * len(arrays_by_ticker) + [2],
+    )[:, 0]
+    fig.suptitle(title)
+
+    for ax, (ticker, arrays) in zip(axes, arrays_by_ticker.items()):
+        bars = rebucket_ohlc(arrays, buckets=max_points)
+        times = bars.times.astype('datetime64[s]')
+        colors = np.where(bars.close >= bars.open, COLOR_UP, COLOR_DOWN)
+        ax.vlines(times, bars.low, bars.high, colors=colors, linewidth=.5)
+        ax.vlines(times, bars.open, bars.close, colors=colors, linewidth=2)
+
+        ticker_trades = [t for t in trades if t['ticker'] == ticker]
+        for key_dt, key_price, marker in (('dt_open', 'price_open', '^'), ('dt_close', 'price_close', 'v')):
+            ax.scatter(
+                [_to_datetime64(t[key_dt]) for t in ticker_trades],
+                [t[key_price] for t in ticker_trades],
+                c=['blue' if t['size'] > 0 else 'black' for t in ticker_trades],
+                marker=marker,
+                s=20,
+                zorder=3,
+            )
+        ax.set_ylabel(ticker)
+        ax.grid(alpha=.3)
+
+    ax_equity = axes[-1]
+    idxs = lttb(equity['times'], equity['values'], threshold=max_points)
+    ax_equity.plot(equity['times'][idxs].astype('datetime64[s]'), equity['values'][idxs], linewidth=1)
+    ax_equity.set_ylabel('Equity')
+    ax_equity.grid(alpha=.3)
+
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(filepath, dpi=100)
+    return filepath
+
+
+def _to_datetime64(dt: datetime) -> np.datetime64:
+    # trades have naive datetimes in UTC, aware ones are converted to UTC
+    if dt.tzinfo is not None:
+        return np.datetime64(int(dt.timestamp()), 's')
+    return np.datetime64(dt, 's')
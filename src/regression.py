@@ -0,0 +1,263 @@
+import json
+import math
+import sys
+import time
+import logging
+import argparse
+from dataclasses import dataclass, field, asdict, replace
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Callable, Type
+
+from backtrader import TimeFrame
+
+from config import FILEPATH_LOGGER, DIR_GOLDEN
+from src.my_logging import get_logger
+from src.backtester import Backtester
+from src.data_feeds import DataFeedCandles
+from src.helpers import get_peak_rss_mb
+from src.schemas import StrategyData, InstrumentData, StrategyResult
+from src.params import ParamsClosingOnHighs, ParamsDivGap, AnyParamsStrategy
+from src.sizers import SizerPercentOfCash
+from src.strategies.base import BaseStrategy
+from src.strategies.closing_on_highs import StrategyClosingOnHighs
+from src.strategies.div_gap import StrategyDivGap
+from src.synthetic import make_minute_candles, make_day_candles, make_dividends
+from src.candle_arrays import CompactCandles
+
+
+@dataclass
+class RegressionCase:
+    strategy: Type[BaseStrategy]
+    params: AnyParamsStrategy
+    get_instruments_data: Callable[[], list[InstrumentData]]
+    get_kwargs: Callable[[list[InstrumentData]], dict[str, Any]] = lambda _: {}
+    optimize: bool = False
+    # Backtester attributes of the case
+    backtester: dict[str, Any] = field(default_factory=lambda: {})
+    # what a strategy of a run collects besides trades, it's checked with the results
+    get_strategy_results: Callable[[BaseStrategy], Any] | None = None
+
+
+def _get_minute_instruments_data() -> list[InstrumentData]:
+    return [
+        InstrumentData(
+            ticker=f'SYN{seed}',
+            data_feed=DataFeedCandles.from_candles(
+                candles=make_minute_candles(seed=seed, count_days=120, percent_missing=.1),
+                timeframe=TimeFrame.Minutes,
+            ),
+        ) for seed in range(4)
+    ]
+
+
+def _get_compact_minute_instruments_data() -> list[InstrumentData]:
+    # prices on the grid of a tick, so compact candles widen back to the same values
+    instruments_data = []
+    for seed in range(4):
+        candles = make_minute_candles(seed=seed, count_days=120, percent_missing=.1, tick_size=.01)
+        compact = CompactCandles.from_candles(candles, tick_size=.01)
+        if mismatches := compact.verify(candles):
+            raise Exception(f'Compact candles differ: {mismatches[0]}')
+        instruments_data.append(InstrumentData(
+            ticker=f'SYN{seed}',
+            data_feed=DataFeedCandles.from_candles(candles=compact, timeframe=TimeFrame.Minutes),
+        ))
+    return instruments_data
+
+
+def _get_day_instruments_data() -> list[InstrumentData]:
+    candles = make_day_candles(seed=0, count_days=750)
+    return [InstrumentData(ticker='SYND', data_feed=DataFeedCandles.from_candles(candles, timeframe=TimeFrame.Days))]
+
+
+params_closing_on_highs = ParamsClosingOnHighs(
+    sizer=SizerPercentOfCash(trade_max_size=0.05),
+    c_price_change=[1, 2],
+    c_volume_change=1,
+    c_from_low=0,
+    c_from_high=0,
+    take_stop=[(.003, .002), (.01, .005)],
+    days_look_back=5,
+    trade_end_of_main_session=True,
+    trade_end_of_evening_session=True,
+    trade_before_weekends=True,
+)
+
+CASES: dict[str, RegressionCase] = {
+    'closing_on_highs': RegressionCase(
+        strategy=StrategyClosingOnHighs,
+        params=params_closing_on_highs,
+        get_instruments_data=_get_minute_instruments_data,
+        optimize=True,
+    ),
+    'closing_on_highs_bounded': RegressionCase(
+        strategy=StrategyClosingOnHighs,
+        params=params_closing_on_highs,
+        get_instruments_data=_get_minute_instruments_data,
+        optimize=True,
+        backtester={'BOUNDED_MEMORY': True},
+    ),
+    'closing_on_highs_panel': RegressionCase(
+        strategy=StrategyClosingOnHighs,
+        params=params_closing_on_highs,
+        get_instruments_data=_get_minute_instruments_data,
+        optimize=True,
+        backtester={'PANEL': True},
+    ),
+    'closing_on_highs_light_broker': RegressionCase(
+        strategy=StrategyClosingOnHighs,
+        params=params_closing_on_highs,
+        get_instruments_data=_get_minute_instruments_data,
+        optimize=True,
+        backtester={'LIGHT_BROKER': True},
+    ),
+    'closing_on_highs_compact': RegressionCase(
+        strategy=StrategyClosingOnHighs,
+        params=params_closing_on_highs,
+        get_instruments_data=_get_compact_minute_instruments_data,
+        optimize=True,
+    ),
+    'closing_on_highs_volume': RegressionCase(
+        # signals which depend on the volume condition, volumes of feeds with gaps are counted once per candle
+        strategy=StrategyClosingOnHighs,
+        params=replace(params_closing_on_highs, c_price_change=.2, c_volume_change=.5, take_stop=(.003, .002),
+                       days_look_back=3),
+        get_instruments_data=_get_minute_instruments_data,
+    ),
+    'div_gap': RegressionCase(
+        strategy=StrategyDivGap,
+        params=ParamsDivGap(sizer=SizerPercentOfCash(trade_max_size=.99), percent_min_div_yield=0),
+        get_instruments_data=_get_day_instruments_data,
+        get_kwargs=lambda instruments_data: {
+            'dividends': make_dividends(instruments_data[0].data_feed.candles, idxs=[100, 350, 600]),
+        },
+        get_strategy_results=lambda strategy: [{**asdict(dd), 'deviation': dd.deviation} for dd in strategy.results],
+    ),
+}
+
+
+def run_case(name: str) -> dict[str, Any]:
+    # runs in a fresh process, so peak RSS belongs to the case
+    case = CASES[name]
+    Backtester.LOGGING = False
+    for k, v in case.backtester.items():
+        setattr(Backtester, k, v)
+
+    instruments_data = case.get_instruments_data()
+    count_bars = sum(len(i.data_feed.candles) - 1 for i in instruments_data)
+    backtester = Backtester(
+        strategies_data=[StrategyData(strategy=case.strategy, params=case.params,
+                                      kwargs=case.get_kwargs(instruments_data))],
+        instruments_data=instruments_data,
+    )
+
+    start = time.perf_counter()
+    results = backtester.optimize() if case.optimize else backtester.run()
+    seconds = time.perf_counter() - start
+    results = [get_golden_result(r) for r in results]
+    if case.get_strategy_results is not None:
+        results = [{**r, 'strategy': json.loads(json.dumps(case.get_strategy_results(strategy), default=str))}
+                   for r, strategy in zip(results, backtester.strategies)]
+    return {
+        'results': results,
+        'perf': {
+            # bars of all feeds for every run of the grid
+            'bars_per_second': count_bars * len(results) / seconds,
+            'peak_rss_mb': get_peak_rss_mb(),
+        },
+    }
+
+
+def get_golden_result(result: StrategyResult) -> dict[str, Any]:
+    # json round trip: the same types as read from a golden file
+    return json.loads(json.dumps({
+        'params': {k: v for k, v in result.params.items() if k != 'sizer'},
+        'sharpe': result.sharpe['ratio'],
+        'drawdown': result.drawdown,
+        'annual_return': result.annual_return,
+        'pnl_net': sum(t['pnlcomm'] for t in result.trades),
+        'trades': result.trades,
+    }, default=str))
+
+
+def compare(expected: Any, actual: Any, path: str = '') -> list[str]:
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        if expected.keys() != actual.keys():
+            return [f'{path}: keys {sorted(expected)} != {sorted(actual)}']
+        return [diff for k in expected for diff in compare(expected[k], actual[k], f'{path}.{k}')]
+    if isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            return [f'{path}: length {len(expected)} != {len(actual)}']
+        return [diff for i, (e, a) in enumerate(zip(expected, actual)) for diff in compare(e, a, f'{path}[{i}]')]
+    if isinstance(expected, float) and isinstance(actual, float):
+        if math.isclose(expected, actual, rel_tol=1e-9, abs_tol=1e-9) or (math.isnan(expected) and math.isnan(actual)):
+            return []
+    elif expected == actual:
+        return []
+    return [f'{path}: {expected!r} != {actual!r}']
+
+
+def check_case(
+        name: str,
+        output: dict[str, Any],
+        tolerance_speed: float,
+        tolerance_rss: float,
+) -> list[str]:
+    filepath = DIR_GOLDEN / f'{name}.json'
+    if not filepath.exists():
+        return [f'{name}: no golden file {filepath}, run with --update']
+    golden = json.loads(filepath.read_text())
+
+    failures = [f'{name} results{diff}' for diff in compare(golden['results'], output['results'])]
+    speed, speed_base = output['perf']['bars_per_second'], golden['perf']['bars_per_second']
+    if speed < speed_base * (1 - tolerance_speed):
+        failures.append(f'{name}: {round(speed)} bars/s is slower than baseline {round(speed_base)} bars/s')
+    rss, rss_base = output['perf']['peak_rss_mb'], golden['perf']['peak_rss_mb']
+    if rss > rss_base * (1 + tolerance_rss):
+        failures.append(f'{name}: peak RSS {rss} MB is more than baseline {rss_base} MB')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check strategies on synthetic data against golden results')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--update', action='store_true', help='Write results and perf baselines as golden')
+    parser.add_argument('--update-perf', action='store_true', help='Write only perf baselines, e.g. on a new host')
+    parser.add_argument('--tolerance-speed', type=float, default=.25)
+    parser.add_argument('--tolerance-rss', type=float, default=.25)
+    args = parser.parse_args()
+
+    DIR_GOLDEN.mkdir(parents=True, exist_ok=True)
+    failures = []
+    for name in args.cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            output = executor.submit(run_case, name).result()
+        logging.info(f'{name} | {round(output["perf"]["bars_per_second"])} bars/s | '
+                     f'Peak RSS: {output["perf"]["peak_rss_mb"]} MB')
+
+        filepath = DIR_GOLDEN / f'{name}.json'
+        if args.update:
+            # `baseline` of a golden file lists where its results differ from the tree before the refactors and why,
+            # it's recorded once against that tree and isn't checked
+            baseline = json.loads(filepath.read_text()).get('baseline') if filepath.exists() else None
+            filepath.write_text(json.dumps({**output, 'baseline': baseline} if baseline else output, indent=1))
+        elif args.update_perf:
+            golden = json.loads(filepath.read_text())
+            filepath.write_text(json.dumps({**golden, 'perf': output['perf']}, indent=1))
+        else:
+            failures += check_case(name=name, output=output, tolerance_speed=args.tolerance_speed,
+                                   tolerance_rss=args.tolerance_rss)
+
+    if failures:
+        logging.error(f'{len(failures)} regressions:\n' + '\n'.join(failures))
+        sys.exit(1)
+    elif args.update or args.update_perf:
+        logging.info(f'Golden files of {len(args.cases)} cases written to {DIR_GOLDEN}')
+    else:
+        logging.info(f'{len(args.cases)} cases passed')
+
+
+if __name__ == '__main__':
+    get_logger(FILEPATH_LOGGER)
+    main()
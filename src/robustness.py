@@ -0,0 +1,125 @@
+from dataclasses import dataclass
+from multiprocessing import Pool
+from typing import Literal
+
+import numpy as np
+
+from src.schemas import StrategyResult
+
+
+Method = Literal['bootstrap', 'reshuffle']
+
+# samples are generated in chunks with their own seeds, so results don't depend on the number of processes
+SIZE_CHUNK = 1000
+SECONDS_IN_YEAR = 365.25 * 24 * 60 * 60
+
+
+@dataclass
+class MetricInterval:
+    actual: float
+    mean: float
+    low: float
+    high: float
+
+    def __repr__(self) -> str:
+        return f'{round(self.actual, 4)} | mean={round(self.mean, 4)} | [{round(self.low, 4)}, {round(self.high, 4)}]'
+
+
+@dataclass
+class RobustnessReport:
+    method: Method
+    count_samples: int
+    confidence: float
+    pnl: MetricInterval
+    max_drawdown: MetricInterval  # fraction of the equity peak
+    sharpe: MetricInterval  # of trade returns, annualized by the number of trades per year
+
+    def __repr__(self) -> str:
+        return '\n'.join((
+            f'Monte Carlo: {self.method} x {self.count_samples} | Confidence: {round(self.confidence * 100, 1)}%',
+            f'PnL: {self.pnl}',
+            f'Max drawdown: {self.max_drawdown}',
+            f'Sharpe: {self.sharpe}',
+        ))
+
+
+def get_robustness_report(
+        result: StrategyResult,
+        method: Method = 'bootstrap',
+        count_samples: int = 10_000,
+        confidence: float = .95,
+        processes: int = 1,
+        seed: int = 0,
+) -> RobustnessReport:
+    # resamples the closed trades of a run: `bootstrap` draws trades with replacement,
+    # `reshuffle` changes only their order, so its PnL is always the actual one
+    trades = sorted(result.trades, key=lambda t: t['dt_close'])
+    if len(trades) < 2:
+        raise Exception(f'Not enough trades for resampling: {len(trades)}')
+
+    pnls = np.array([t['pnlcomm'] for t in trades])
+    returns = pnls / np.array([abs(t['price_open'] * t['size']) for t in trades])
+    seconds = (trades[-1]['dt_close'] - trades[0]['dt_open']).total_seconds()
+    trades_per_year = len(trades) / max(seconds / SECONDS_IN_YEAR, 1 / 365.25)
+
+    seeds = np.random.SeedSequence(seed).spawn((count_samples + SIZE_CHUNK - 1) // SIZE_CHUNK)
+    sizes = [min(SIZE_CHUNK, count_samples - i * SIZE_CHUNK) for i in range(len(seeds))]
+    args = [(pnls, returns, result.start_cash, trades_per_year, method, size, s) for size, s in zip(sizes, seeds)]
+    if processes > 1 and len(args) > 1:
+        with Pool(processes=processes) as pool:
+            chunks = pool.starmap(_resample, args)
+    else:
+        chunks = [_resample(*a) for a in args]
+    samples = np.concatenate(chunks)
+
+    actual = _get_metrics(pnls[None, :], returns[None, :], result.start_cash, trades_per_year)[0]
+    quantiles = ((1 - confidence) / 2, 1 - (1 - confidence) / 2)
+    intervals = []
+    for k in range(samples.shape[1]):
+        low, high = np.quantile(samples[:, k], quantiles)
+        intervals.append(MetricInterval(
+            actual=float(actual[k]),
+            mean=float(samples[:, k].mean()),
+            low=float(low),
+            high=float(high),
+        ))
+
+    return RobustnessReport(
+        method=method,
+        count_samples=count_samples,
+        confidence=confidence,
+        pnl=intervals[0],
+        max_drawdown=intervals[1],
+        sharpe=intervals[2],
+    )
+
+
+def _resample(
+        pnls: np.ndarray,
+        returns: np.ndarray,
+        start_cash: float,
+        trades_per_year: float,
+        method: Method,
+        size: int,
+        seed: np.random.SeedSequence,
+) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    if method == 'bootstrap':
+        idxs = rng.integers(0, len(pnls), size=(size, len(pnls)))
+    elif method == 'reshuffle':
+        idxs = rng.random((size, len(pnls))).argsort(axis=1)
+    else:
+        raise Exception(f'Unknown method: {method}')
+    return _get_metrics(pnls[idxs], returns[idxs], start_cash, trades_per_year)
+
+
+def _get_metrics(pnls: np.ndarray, returns: np.ndarray, start_cash: float, trades_per_year: float) -> np.ndarray:
+    # columns: pnl, max_drawdown, sharpe of every row of trades
+    equity = start_cash + np.cumsum(pnls, axis=1)
+    peaks = np.maximum(np.maximum.accumulate(equity, axis=1), start_cash)
+    max_drawdown = ((peaks - equity) / peaks).max(axis=1)
+
+    std = returns.std(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(std > 0, returns.mean(axis=1) / std * np.sqrt(trades_per_year), 0)
+    return np.column_stack([equity[:, -1] - start_cash, max_drawdown, sharpe])
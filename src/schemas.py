@@ -7,7 +7,9 @@ from src.data_feeds import DataFeedCandles
 from src.typed_dicts import (
     AnalysisSharpe,
     AnalysisDrawDown,
-    AnalysisPeriodStats
+    AnalysisPeriodStats,
+    AnalysisTrade,
+    MemoryReport,
 )
 from src.strategies.base import BaseStrategy
 from src.params import AnyParamsStrategy
@@ -23,6 +25,9 @@ class StrategyResult:
     annual_return: dict[int, float]
     period_stats: AnalysisPeriodStats
     trade_analyzer: dict[str, dict]
+    trades: list[AnalysisTrade] = field(default_factory=lambda: [])
+    params: dict[str, Any] = field(default_factory=lambda: {})
+    memory: MemoryReport | None = None
 
     def __repr__(self) -> str:
         pd = self.period_stats
@@ -61,6 +66,23 @@ class StrategyResult:
         )
         return '\n'.join(rows)
 
+    @property
+    def memory_repr(self) -> str:
+        m, run = self.memory, self.memory.get('run')
+        rows = [
+            f'Candles: {' | '.join([f'{t}: {round(mb, 2)} MB' for t, mb in m.get('candles', {}).items()])}',
+            f'Results: {round(m.get('results', 0), 2)} MB | '
+            f'Peak RSS: {' | '.join([f'{p}: {mb} MB' for p, mb in m.get('phases_peak_rss_mb', {}).items()])}',
+        ]
+        if run:
+            rows += [
+                f'Run in process {run['pid']} | Peak RSS: {run['peak_rss_mb']} MB',
+                f'Line buffers: {' | '.join([f'{n}: {round(mb, 2)} MB' for n, mb in run['line_buffers'].items()])}',
+                f'Strategy state: {round(run['strategy_state'], 2)} MB',
+                f'Analyzers: {' | '.join([f'{n}: {round(mb, 3)} MB' for n, mb in run['analyzers'].items()])}',
+            ]
+        return '\n'.join(rows)
+
     @property
     def pnl_net(self) -> float:
         return self.trade_analyzer['pnl']["net"]["total"]
@@ -0,0 +1,45 @@
+from dataclasses import dataclass
+from typing import Literal
+
+from src.top_k import get_return_drawdown
+from src.typed_dicts import AnalysisScreening
+
+
+# sharpe needs returns of every period, which screening runs don't collect
+ScreeningMetric = Literal['pnl', 'return_drawdown']
+
+
+def get_screening_metric(analysis: AnalysisScreening, metric: ScreeningMetric, start_cash: float) -> float:
+    # the same as `get_metric` of full runs, open positions aren't counted
+    pnl = analysis['pnl']
+    if metric == 'pnl':
+        return pnl
+    elif metric == 'return_drawdown':
+        return get_return_drawdown(pnl=pnl, start_cash=start_cash, drawdown=analysis['max_drawdown'])
+    raise Exception(f'Unknown metric: {metric}')
+
+
+@dataclass
+class ScreeningReport:
+    count_combos: int
+    count_finalists: int
+    seconds_screening: float
+    seconds_finalists: float
+    # of a sweep of all combos with full analyzers, when it was measured
+    seconds_full: float | None = None
+    # finalists which are in the top of the full sweep by the same metric
+    count_finalists_in_top: int | None = None
+
+    @property
+    def seconds_saved(self) -> float | None:
+        if self.seconds_full is None:
+            return None
+        return self.seconds_full - self.seconds_screening - self.seconds_finalists
+
+    def __repr__(self) -> str:
+        text = (f'Screened {self.count_combos} combos in {round(self.seconds_screening, 2)}s | '
+                f'{self.count_finalists} finalists in {round(self.seconds_finalists, 2)}s')
+        if self.seconds_full is not None:
+            text += (f' | Full sweep: {round(self.seconds_full, 2)}s | Saved: {round(self.seconds_saved, 2)}s | '
+                     f'Finalists in the top of the full sweep: {self.count_finalists_in_top}/{self.count_finalists}')
+        return text
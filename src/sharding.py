@@ -0,0 +1,109 @@
+from dataclasses import dataclass
+from datetime import date
+
+import numpy as np
+from my_tinkoff.schemas import Candles
+
+from src.schemas import StrategyResult
+from src.typed_dicts import AnalysisTrade, AnalysisEquity
+
+
+@dataclass
+class Shard:
+    # entries are opened on days [day_from, day_to)
+    day_from: date
+    day_to: date | None
+
+
+@dataclass
+class ShardedResult:
+    shards: list[StrategyResult]
+    trades: list[AnalysisTrade]
+    equity: AnalysisEquity
+    start_cash: float
+
+    @property
+    def pnl_net(self) -> float:
+        return sum(t['pnlcomm'] for t in self.trades)
+
+    @property
+    def max_drawdown(self) -> float:
+        # percent of the equity peak
+        values = self.equity['values']
+        if not len(values):
+            return 0
+        peaks = np.maximum.accumulate(values)
+        return float(((peaks - values) / peaks).max() * 100)
+
+    def __repr__(self) -> str:
+        return (f'Shards: {len(self.shards)} | Trades: {len(self.trades)} | '
+                f'PnL: {round(self.pnl_net / self.start_cash * 100, 2)}% | {round(self.pnl_net, 2)} | '
+                f'Drawdown: -{round(self.max_drawdown, 2)}%')
+
+
+def get_shards(days: list[date], count_shards: int) -> list[Shard]:
+    # shards are equal by the number of trading days
+    count_shards = min(count_shards, len(days))
+    idxs = [len(days) * k // count_shards for k in range(count_shards)]
+    return [
+        Shard(
+            day_from=days[idx],
+            day_to=days[idxs[k + 1]] if k + 1 < len(idxs) else None,
+        ) for k, idx in enumerate(idxs)
+    ]
+
+
+def split_warmup(candles: Candles, day_from: date, lookback_days: int) -> tuple[Candles, Candles]:
+    # Candles before the warm-up and the tail from it, positions of a shard may stay open till the end of data.
+    # The warm-up is `lookback_days` days of the candles themselves, missing days of a ticker don't shorten it
+    day_starts = []
+    idx_from = len(candles)
+    for i, candle in enumerate(candles):
+        if candle.time.date() >= day_from:
+            idx_from = i
+            break
+        if not day_starts or candle.time.date() != candles[day_starts[-1]].time.date():
+            day_starts.append(i)
+    k = max(len(day_starts) - lookback_days, 0)
+    idx = day_starts[k] if k < len(day_starts) else idx_from
+    return Candles(candles[:idx]), Candles(candles[idx:])
+
+
+def get_compound_factors(equities: list[AnalysisEquity], start_cash: float) -> list[float]:
+    # shards run at once with the start cash each, a shard is scaled as if it started with the value
+    # the shards before it ended with. Sizers take a part of cash, so sizes scale up to the rounding of shares
+    factors = [1.]
+    for e in equities[:-1]:
+        factors.append(factors[-1] * (e['values'][-1] / start_cash if len(e['values']) else 1.))
+    return factors
+
+
+def scale_trade(trade: AnalysisTrade, factor: float) -> AnalysisTrade:
+    return AnalysisTrade(**{**trade, 'size': trade['size'] * factor, 'pnl': trade['pnl'] * factor,
+                            'pnlcomm': trade['pnlcomm'] * factor})
+
+
+def stitch_equity(equities: list[AnalysisEquity], start_cash: float, factors: list[float]) -> AnalysisEquity:
+    # shards trade with their own brokers, so the total is the start cash plus the compounded PnL of every shard:
+    # a shard is flat at the start cash before its first bar and at its last value after it stopped
+    times = np.unique(np.concatenate([e['times'] for e in equities]))
+    values = np.full(len(times), float(start_cash))
+    for e, factor in zip(equities, factors):
+        if not len(e['times']):
+            continue
+        idxs = np.searchsorted(e['times'], times, side='right') - 1
+        values += (np.where(idxs >= 0, e['values'][np.maximum(idxs, 0)], start_cash) - start_cash) * factor
+    return AnalysisEquity(times=times, values=values)
+
+
+def compare_with_serial(sharded: ShardedResult, serial: StrategyResult) -> list[str]:
+    # sizes of shards are scaled from the start cash and the serial sizes are rounded to shares of its cash,
+    # so entries, exits and prices are compared
+    def key(t: AnalysisTrade) -> tuple:
+        return t['ticker'], t['dt_open'], t['dt_close'], round(t['price_open'], 6), round(t['price_close'], 6)
+
+    keys_sharded = {key(t) for t in sharded.trades}
+    keys_serial = {key(t) for t in serial.trades}
+    diffs = [f'only sharded: {k}' for k in sorted(keys_sharded - keys_serial)]
+    diffs += [f'only serial: {k}' for k in sorted(keys_serial - keys_sharded)]
+    return diffs
@@ -0,0 +1,98 @@
+import json
+import pickle
+import logging
+from array import array
+from collections import deque
+from dataclasses import dataclass
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from backtrader import Analyzer, date2num, num2date
+from my_tinkoff.schemas import Candles
+
+from src.candle_arrays import CompactCandles
+from src.data_feeds import UNIX_EPOCH_NUM
+from src.helpers import get_spec_hash, write_atomic
+
+
+# values of analyzer attributes which are its state, other ones reference strategy, datas and lines
+STATE_TYPES = (bool, int, float, str, type(None), date, datetime, dict, list, tuple, deque, array, np.ndarray)
+NOT_STATE_ATTRS = ('datas', '_children', '_parent')
+
+
+@dataclass
+class Snapshot:
+    # state after all bars before `num_resume`, when the broker had no positions and orders
+    num_resume: float
+    cash: float
+    strategy: dict[str, Any]
+    analyzers: dict[str, dict[str, Any]]
+
+    @property
+    def dt_resume(self) -> datetime:
+        return num2date(self.num_resume)
+
+
+def get_analyzer_state(analyzer: Analyzer) -> dict[str, Any]:
+    return {
+        'attrs': {k: v for k, v in vars(analyzer).items() if k not in NOT_STATE_ATTRS and isinstance(v, STATE_TYPES)},
+        'children': [get_analyzer_state(child) for child in analyzer._children],
+    }
+
+
+def set_analyzer_state(analyzer: Analyzer, state: dict[str, Any]) -> None:
+    vars(analyzer).update(state['attrs'])
+    for child, state_child in zip(analyzer._children, state['children']):
+        set_analyzer_state(child, state_child)
+
+
+def get_num_cut_max(candles: Candles | CompactCandles) -> float:
+    # Bars of the last two loaded days are skipped by strategies (`days_to_end`) and the last day may be
+    # incomplete, so a bar is final only before the start of the second to last day. The last candle isn't loaded.
+    if isinstance(candles, CompactCandles):
+        days = np.unique(candles.minutes[:-1].astype(np.int64) // 1440)
+        return float(days[-2] + UNIX_EPOCH_NUM) if len(days) >= 2 else -np.inf
+
+    day_last, count_days = None, 0
+    for candle in reversed(candles[:-1]):
+        if candle.time.date() != day_last:
+            day_last = candle.time.date()
+            count_days += 1
+            if count_days == 2:
+                return float(int(date2num(candle.time)))
+    return -np.inf
+
+
+def slice_candles_from(candles: Candles | CompactCandles, num: float) -> Candles | CompactCandles:
+    # date nums are computed as feeds do it, so the first bar of the slice is the bar the snapshot resumes on
+    if isinstance(candles, CompactCandles):
+        return candles[int(np.searchsorted(candles.minutes / 1440 + UNIX_EPOCH_NUM, num)):]
+    for i, candle in enumerate(candles):
+        if date2num(candle.time) >= num:
+            return candles[i:]
+    return candles[len(candles):]
+
+
+class SnapshotStore:
+    FILENAME_SPEC = 'spec.json'
+    FILENAME_SNAPSHOT = 'snapshot.pickle'
+
+    def __init__(self, dirpath: Path, spec: dict[str, Any]):
+        self.dirpath = dirpath / get_spec_hash(spec)
+        self.dirpath.mkdir(parents=True, exist_ok=True)
+        self.filepath = self.dirpath / self.FILENAME_SNAPSHOT
+        write_atomic(self.dirpath / self.FILENAME_SPEC, json.dumps(spec, indent=2, default=repr).encode())
+
+    def load(self) -> Snapshot | None:
+        if not self.filepath.exists():
+            return None
+        try:
+            return pickle.loads(self.filepath.read_bytes())
+        except (pickle.UnpicklingError, EOFError, AttributeError) as ex:
+            logging.warning(f'Broken snapshot {self.filepath}, running from the start: {ex}')
+            return None
+
+    def save(self, snapshot: bytes) -> None:
+        write_atomic(self.filepath, snapshot)
@@ -1,5 +1,6 @@
-from typing import Literal
+from typing import Literal, Any
 import logging
+from copy import copy
 from collections import defaultdict
 
 from backtrader import (
@@ -8,8 +9,9 @@ from backtrader import (
     Order,
 )
 from my_tinkoff.date_utils import dt_form_sys
+from my_tinkoff.schemas import Candles
 
-from src.data_feeds import DataFeedCandles
+from src.data_feeds import DataFeedCandles, DataFeedPanel, PanelView
 
 
 BuyOrSell = Literal['buy', 'sell']
@@ -17,19 +19,85 @@ BuyOrSell = Literal['buy', 'sell']
 
 class BaseStrategy(Strategy):
     LOGGING: bool
-
-    def __init__(self):
+    # params that entries depend on. Combos which differ only in other params share entries (Backtester.SIGNAL_CACHE)
+    SIGNAL_PARAMS: tuple[str, ...] = ()
+    # attributes restored from a snapshot (Backtester.SNAPSHOT_DIR), snapshots are taken without positions
+    STATE_ATTRS: tuple[str, ...] = ()
+
+    def __init__(
+            self,
+            shard: tuple[float, float] | None = None,
+            shard_state: dict[str, Any] | None = None,
+    ):
+        # date nums [from, to) of entries of a shard and its state before the warm-up (Backtester.run_sharded)
+        self.shard = shard
+        for name, value in (shard_state or {}).items():
+            setattr(self, name, value)
         self.cheating = self.cerebro.p.cheat_on_open
         self.p = self.params
 
         if self.p.sizer is not None:
-            self.sizer = self.p.sizer
+            # the param instance is shared by strategies of one run, a sizer is bound to one strategy and broker
+            self.sizer = copy(self.p.sizer)
 
-        self._trade_values = defaultdict(lambda: 0)
+        self._trade_values = defaultdict(int)
+        self._last_seen_dts: list[float | None] = [None for _ in range(len(self.feeds))]
+        self.restored = False
 
         super().__init__()
         logging.info(f'{self.__class__.__name__}\n{self.params.__dict__}')
 
+    @classmethod
+    def get_lookback_days(cls, params) -> int | None:
+        # trading days of history the state depends on, strategies without it can't be sharded
+        return None
+
+    @classmethod
+    def get_shard_state(cls, params, candles: list[Candles]) -> dict[str, Any]:
+        # state of the history before a shard's warm-up which the lookback doesn't cover, by candles of every data
+        return {}
+
+    def is_in_shard(self, data: DataFeedCandles) -> bool:
+        return self.shard is None or self.shard[0] <= data.datetime[0] < self.shard[1]
+
+    def get_state(self) -> dict[str, Any]:
+        return {name: getattr(self, name) for name in self.STATE_ATTRS}
+
+    def set_state(self, state: dict[str, Any]) -> None:
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.restored = True
+
+    def prenext(self):
+        # feeds resumed from a snapshot start on one bar instead of the start of their histories,
+        # bars of feeds that have data before the others mustn't be skipped
+        if self.restored:
+            self.next()
+
+    @property
+    def feeds(self) -> list[DataFeedCandles | PanelView]:
+        # datas of tickers: the datas of cerebro, or views of a panel's tickers on the panel's clock
+        if isinstance(self.data0, DataFeedPanel):
+            return self.data0.views
+        return self.datas
+
+    def get_new_bars(self) -> list[tuple[int, DataFeedCandles | PanelView]]:
+        # Datas which got a new candle on this bar. Views of a panel share one clock and the validity mask
+        # tells which tickers have a candle, other feeds are also passed to `next` on bars of other feeds.
+        if isinstance(self.data0, DataFeedPanel):
+            row = len(self.data0) - 1
+            return [(i, self.data0.views[i]) for i in self.data0.panel.valid[row].nonzero()[0]]
+
+        new_bars = []
+        for i, data in enumerate(self.datas):
+            if self._last_seen_dts[i] is None and not len(data):
+                # only in `prenext` of a restored strategy
+                continue
+            if self._last_seen_dts[i] is None or data.datetime[0] > self._last_seen_dts[i]:
+                self._last_seen_dts[i] = data.datetime[0]
+                new_bars.append((i, data))
+        return new_bars
+
     def notify_order(self, order: Order):
         # logging.info(order)
         if order.status in [order.Submitted, order.Accepted]:
@@ -1,15 +1,21 @@
+import math
 import logging
+from dataclasses import replace
 from datetime import datetime, timedelta
-from collections import defaultdict
+from collections import deque
+from typing import Any
 
-from backtrader import num2date, Order
+from backtrader import Order, num2date
 from tinkoff.invest import CandleInterval, InstrumentIdType
 from my_tinkoff.api_calls.instruments import get_instrument_by
 from my_tinkoff.date_utils import TZ_UTC
 from my_tinkoff.enums import ClassCode
+from my_tinkoff.schemas import Candles
 from moex_api import MOEX
 
+from config import DIR_CHECKPOINTS
 from src.strategies.base import BaseStrategy
+from src.data_feeds import DataFeedCandles, UNIX_EPOCH_NUM
 from src.exceptions import SkipIteration
 from src.sizers import SizerPercentOfCash
 from src.helpers import (
@@ -18,11 +24,14 @@ from src.helpers import (
 )
 from src.multitasking import (
     async_get_instruments_by_tickers,
-    multiprocessing_get_instruments_data_feeds,
+    pipelined_get_instruments_data_feeds,
 )
 from src.schemas import StrategyData, InstrumentData
 from src.backtester import Backtester
 from src.params import ParamsClosingOnHighs
+from src.candle_arrays import CandleArrays
+from src.bracket_index import BracketIndex
+from src.robustness import get_robustness_report
 
 
 class StrategyClosingOnHighs(BaseStrategy):
@@ -38,91 +47,202 @@ class StrategyClosingOnHighs(BaseStrategy):
         trade_end_of_evening_session=True,
         trade_before_weekends=True
     )
+    SIGNAL_PARAMS = (
+        'c_price_change',
+        'c_volume_change',
+        'c_from_low',
+        'c_from_high',
+        'days_look_back',
+        'trade_end_of_main_session',
+        'trade_end_of_evening_session',
+        'trade_before_weekends',
+    )
+    STATE_ATTRS = (
+        'first_day',
+        'prev_closes',
+        'next_prev_closes',
+        'max_highs',
+        'price_changes',
+        'volumes',
+        'volumes_total',
+        'volumes_count',
+        'signals',
+    )
+    # Days whose price change, volume and high can't give a signal are checked at their first bar from the state
+    # and the feed's day bars, their bars are skipped and the state is updated on the last one
+    PREFILTER_DAYS = True
 
-    def __init__(self):
+    def __init__(self, signals: dict[str, list[float]] | None = None, **kwargs):
         self.i = 0
-        self.last_seen_dt: list[float | None] = [None for _ in range(len(self.datas))]
-        self.indexes_days: list[int] = [1 for _ in range(len(self.datas))]
-        self.max_highs: list[int | None] = [None for _ in range(len(self.datas))]
-        self.price_changes: list[list[float]] = [[] for _ in range(len(self.datas))]
-        self.volume_changes: list[dict[int, int]] = [defaultdict(int) for _ in range(len(self.datas))]
-        self.indexes_last: list[list[int]] = [[] for _ in range(len(self.datas))]
-
-        for i, data in enumerate(self.datas):
-            for i_c in range(1, data.buflen()):
-                dt1 = num2date(data.datetime[i_c-1])
-                dt2 = num2date(data.datetime[i_c])
-                if dt2.date() > dt1.date():
-                    self.indexes_last[i].append(i_c-1)
-                    # if dt2.minute == 0 and self.LOGGING:
-                    #     logging.warning(f'{data._name} | No opening auction candle | dt1={dt1} | dt2={dt2}')
-
-        super().__init__()
+        self.first_day: list[bool] = [True for _ in range(len(self.feeds))]
+        self.prev_closes: list[float | None] = [None for _ in range(len(self.feeds))]
+        self.next_prev_closes: list[float | None] = [None for _ in range(len(self.feeds))]
+        self.max_highs: list[float | None] = [None for _ in range(len(self.feeds))]
+        self.price_changes: list[deque[float]] = [deque(maxlen=self.p.days_look_back + 1)
+                                                  for _ in range(len(self.feeds))]
+        self.volumes: list[float] = [0 for _ in range(len(self.feeds))]
+        self.volumes_total: list[float] = [0 for _ in range(len(self.feeds))]
+        self.volumes_count: list[int] = [0 for _ in range(len(self.feeds))]
+
+        # entries of this run by tickers. If `signals` of a run with the same SIGNAL_PARAMS are given,
+        # signal logic is skipped and orders are sent on these bars
+        self.signals: dict[str, list[float]] = {data._name: [] for data in self.feeds}
+        self._cached_signals: dict[str, set[float]] | None = None
+        if signals is not None:
+            self._cached_signals = {ticker: set(dts) for ticker, dts in signals.items()}
+
+        self._is_day_start: list[bool] = [True for _ in range(len(self.feeds))]
+        # index of the feed's day bars of a skipped day
+        self._skipped_day_idxs: list[int | None] = [None for _ in range(len(self.feeds))]
+        super().__init__(**kwargs)
+
+    @classmethod
+    def get_lookback_days(cls, params: ParamsClosingOnHighs) -> int:
+        # the first day has no previous close, then `days_look_back` day changes are needed.
+        # The average volume is taken over all days before, see `get_shard_state`
+        return params.days_look_back + 2
+
+    @classmethod
+    def get_shard_state(cls, params: ParamsClosingOnHighs, candles: list[Candles]) -> dict[str, Any]:
+        # Volumes of days before the warm-up. The first day of the warm-up becomes the first day of the feed,
+        # so its volume is added to the next day as on the serial run and the mean stays over all days before
+        return {
+            'volumes_total': [float(sum(c.volume for c in candles_data)) for candles_data in candles],
+            'volumes_count': [len({c.time.date() for c in candles_data}) for candles_data in candles],
+        }
 
     def next(self):
-        for i, data in enumerate(self.datas):
+        for i, data in self.get_new_bars():
             self.i = i
             try:
-                self._process_data(data)
+                if self._cached_signals is not None:
+                    self._replay_signals(data)
+                elif self.PREFILTER_DAYS:
+                    self._process_prefiltered(data)
+                else:
+                    self._process_data(data)
             except SkipIteration:
                 continue
 
-    def _process_data(self, data) -> None:
+    def _replay_signals(self, data: DataFeedCandles) -> None:
+        if data.datetime[0] in self._cached_signals[data._name]:
+            self.signals[data._name].append(data.datetime[0])
+            self._buy_bracket(data)
+
+    def _process_prefiltered(self, data: DataFeedCandles) -> None:
         i = self.i  # shortcut
-        indexes_last = self.indexes_last[i]
-        i_day = self.indexes_days[i]
-        self.volume_changes[i][i_day] += data.volume[0]
+        if self._is_day_start[i]:
+            self._skipped_day_idxs[i] = self._get_skipped_day_idx(data)
+        self._is_day_start[i] = data.bars_to_day_end[0] == 0
+
+        if self._skipped_day_idxs[i] is None:
+            self._process_data(data)
+        elif data.bars_to_day_end[0] == 0:
+            self._skip_day(data, self._skipped_day_idxs[i])
+
+    def _get_skipped_day_idx(self, data: DataFeedCandles) -> int | None:
+        # The bar before the day's end is the only one which can give a signal. Its price change, volume and
+        # high are known from the state at the day's start and bars of the day, the time isn't checked
+        i = self.i
+        if self.first_day[i] or data.days_to_end[0] < 2:
+            return None
+        day_bars = data.get_day_bars()
+        k = day_bars.index_of(int(data.datetime[0] - UNIX_EPOCH_NUM))
+        if k is None:
+            return None
+        close = float(day_bars.close_before_last[k])
+        if math.isnan(close):
+            return k
+
+        try:
+            avg_price_change, avg_volume_change = self._get_average_price_and_volume_change()
+        except SkipIteration:
+            return k
+        prev_last_close = self.prev_closes[i]
+        high = float(day_bars.high_before_last[k])
+        max_high = high if self.max_highs[i] is None else max(self.max_highs[i], high)
+        percent_day_change = (close - prev_last_close) / prev_last_close
+        percent_change_to_high = (max_high - prev_last_close) / prev_last_close
+        volume_change = self.volumes[i] + float(day_bars.volume_before_last[k])
+        if self._is_change_signal(percent_day_change=percent_day_change, percent_change_to_high=percent_change_to_high,
+                                  volume_change=volume_change, avg_price_change=avg_price_change,
+                                  avg_volume_change=avg_volume_change):
+            return None
+        return k
+
+    def _skip_day(self, data: DataFeedCandles, k: int) -> None:
+        # what `_process_data` does on the bars of a day without a signal
+        i = self.i
+        day_bars = data.get_day_bars()
+        prev_last_close = self.prev_closes[i]
+        self.volumes[i] += float(day_bars.volume_before_last[k])
+        self.volumes[i] += data.volume[0]
+        if not math.isnan(close := float(day_bars.close_before_last[k])):
+            self.next_prev_closes[i] = close
+
+        self.price_changes[i].append((data.close[0] - prev_last_close) / prev_last_close)
+        self.volumes_total[i] += self.volumes[i]
+        self.volumes_count[i] += 1
+        self.volumes[i] = 0
+        self.prev_closes[i] = self.next_prev_closes[i]
+        self.max_highs[i] = data.high[0]
+
+    def _process_data(self, data: DataFeedCandles) -> None:
+        i = self.i  # shortcut
+        bars_to_day_end = int(data.bars_to_day_end[0])
+        # only new candles of the ticker are counted (see `get_new_bars`), so volumes don't depend on
+        # the other tickers of the run
+        self.volumes[i] += data.volume[0]
 
-        # escaping index error while iterating on last day
-        if len(indexes_last) - 1 == i_day:
+        # two last days of history can't be compared with the next day
+        if data.days_to_end[0] < 2:
             raise SkipIteration
 
-        i_last_candle = indexes_last[i_day]
-        i_prev_last_candle = indexes_last[i_day - 1]
-
-        # escaping index error while iterating on first day
-        if len(data) < i_prev_last_candle:
+        # the day's change is measured from the previous day's close before the closing auction
+        if self.first_day[i] and bars_to_day_end >= 1:
+            if bars_to_day_end == 1:
+                self.prev_closes[i] = data.close[0]
             raise SkipIteration
 
         dt = data.datetime.datetime(0)
-        reverse_idx_prev_last = i_prev_last_candle - len(data) - 1
-        prev_last_close = data.close[reverse_idx_prev_last]
+        prev_last_close = self.prev_closes[i]
         percent_day_change = (data.close[0] - prev_last_close) / prev_last_close
-        volume_change = self.volume_changes[i].get(i_day)
+        volume_change = self.volumes[i]
 
-        if len(data) == i_last_candle:
+        if bars_to_day_end == 0 and self.first_day[i]:
+            self.first_day[i] = False
+        elif bars_to_day_end == 0:
             self.price_changes[i].append(percent_day_change)
-            self.indexes_days[i] += 1
+            self.volumes_total[i] += self.volumes[i]
+            self.volumes_count[i] += 1
+            self.volumes[i] = 0
+            self.prev_closes[i] = self.next_prev_closes[i]
             self.max_highs[i] = None
 
-        if self.last_seen_dt[i] and data.datetime[0] <= self.last_seen_dt[i]:
-            raise SkipIteration
-        self.last_seen_dt[i] = data.datetime[0]
-
         if self.max_highs[i] is None or self.max_highs[i] < data.high[0]:
             self.max_highs[i] = data.high[0]
 
-        if len(data) == i_last_candle - 1:
+        if bars_to_day_end == 1:
+            self.next_prev_closes[i] = data.close[0]
             avg_price_change, avg_volume_change = self._get_average_price_and_volume_change()
             percent_change_to_high = (self.max_highs[i] - prev_last_close) / prev_last_close
 
-            if percent_day_change > avg_price_change * self.p.c_price_change and (
-                    (volume_change > avg_volume_change * self.p.c_volume_change) and
-                    (percent_change_to_high >= percent_day_change > percent_change_to_high * self.p.c_from_low)
-                    and (percent_day_change <= percent_change_to_high * (1 - self.p.c_from_high)) and
+            if self._is_change_signal(
+                    percent_day_change=percent_day_change,
+                    percent_change_to_high=percent_change_to_high,
+                    volume_change=volume_change,
+                    avg_price_change=avg_price_change,
+                    avg_volume_change=avg_volume_change,
+            ) and (
                     ((self.p.trade_end_of_main_session and self.p.trade_end_of_evening_session) or
                      (self.p.trade_end_of_main_session and dt.hour == 15 and dt.minute in list(range(39, 50)) or
                      self.p.trade_end_of_evening_session and dt.hour == 20 and dt.minute == 48))
                     and (self.p.trade_before_weekends or (
-                    not self.p.trade_before_weekends and data.datetime.datetime(2) - dt < timedelta(days=1)))
+                    not self.p.trade_before_weekends and data.next_day_dt[0] - data.datetime[0] < 1))
             ):
-                price_take = data.close[0] * (1 + self.p.take_stop[0])
-                price_stop = data.close[0] * (1 - self.p.take_stop[1])
-                self.buy_bracket(data=data, exectype=Order.Market, limitprice=price_take, stopprice=price_stop)
+                self.signals[data._name].append(data.datetime[0])
+                self._buy_bracket(data)
                 self.log(
-                    f'close_price={data.close[0]} | '
-                    f'price_take={round(price_take, 2)} | '
-                    f'price_stop={round(price_stop, 2)} | '
                     f'percent_day_change={round(percent_day_change * 100, 2)} | '
                     f'average_day_changes={round(avg_price_change * 100, 2)} | '
                     f'percent_change_to_high={round(percent_change_to_high * 100, 2)} | '
@@ -131,19 +251,48 @@ class StrategyClosingOnHighs(BaseStrategy):
                     data=data
                 )
 
+    def _is_change_signal(
+            self,
+            percent_day_change: float,
+            percent_change_to_high: float,
+            volume_change: float,
+            avg_price_change: float,
+            avg_volume_change: float,
+    ) -> bool:
+        return (percent_day_change > avg_price_change * self.p.c_price_change and
+                volume_change > avg_volume_change * self.p.c_volume_change and
+                percent_change_to_high >= percent_day_change > percent_change_to_high * self.p.c_from_low and
+                percent_day_change <= percent_change_to_high * (1 - self.p.c_from_high))
+
+    def _buy_bracket(self, data: DataFeedCandles) -> None:
+        if not self.is_in_shard(data):
+            return
+        # `buy_bracket` fails on a main order of zero size, when cash is less than a share price
+        if not self.getsizing(data=data):
+            return
+
+        price_take = data.close[0] * (1 + self.p.take_stop[0])
+        price_stop = data.close[0] * (1 - self.p.take_stop[1])
+        self.buy_bracket(data=data, exectype=Order.Market, limitprice=price_take, stopprice=price_stop)
+        self.log(
+            f'close_price={data.close[0]} | '
+            f'price_take={round(price_take, 2)} | '
+            f'price_stop={round(price_stop, 2)}',
+            data=data
+        )
+
     def _get_average_price_and_volume_change(self) -> tuple[float, float]:
         days_changes = self.price_changes[self.i]
-        volume_changes = self.volume_changes[self.i]
-        # assert len(days_changes) == len(volume_changes), f'{len(days_changes)} != {len(volume_changes)}'
 
         if len(days_changes) < self.params.days_look_back:
             raise SkipIteration
 
         idx = len(days_changes)-1 - self.p.days_look_back
-        arr_prices = days_changes[idx:]
-        arr_volumes = [volume_changes[i] for i in range(max(volume_changes.keys()))]
+        arr_prices = list(days_changes)[idx:]
         avg_price = sum([abs(x) for x in arr_prices]) / len(arr_prices)
-        avg_volume = sum(arr_volumes) / len(arr_volumes)
+        # the mean of day volumes before the current one: the first day counts as a day of zero volume
+        # and its volume is added to the second day
+        avg_volume = self.volumes_total[self.i] / (self.volumes_count[self.i] + 1)
         return avg_price, avg_volume
 
 
@@ -158,11 +307,19 @@ async def backtest(from_: datetime, to: datetime, params_strategy: ParamsClosing
         instruments_data=[InstrumentData(data_feed=data_feed, ticker=ticker)],
         strategies_data=[StrategyData(strategy=StrategyClosingOnHighs, params=params_strategy)],
     )
-    backtester.run()
+    result = (await backtester.run_async())[0]
+    if len(result.trades) > 1:
+        logging.info(get_robustness_report(result=result, processes=Backtester.CPU_CORES_COUNT))
+
+
+class BacktesterSweep(Backtester):
+    # a sweep over the index: bounded line buffers and resumable from checkpoints, flags of Backtester stay as is
+    BOUNDED_MEMORY = True
+    CHECKPOINT_DIR = DIR_CHECKPOINTS
 
 
 async def optimize(from_: datetime, to: datetime, params_strategy: ParamsClosingOnHighs) -> None:
-    assert Backtester.PLOTTING is False
+    assert BacktesterSweep.PLOTTING is False
 
     async with MOEX() as moex:
         tickers = await moex.get_index_composition('IMOEX')
@@ -171,16 +328,48 @@ async def optimize(from_: datetime, to: datetime, params_strategy: ParamsClosing
     instruments = [i for i in await async_get_instruments_by_tickers(tickers=tickers)
                    if i.first_1min_candle_date <= from_]
     logging.info(f'Start collecting data for {len(instruments)} instruments')
-    data_feeds = multiprocessing_get_instruments_data_feeds(instruments=instruments, from_=from_, to=to,
-                                                            interval=CandleInterval.CANDLE_INTERVAL_1_MIN)
+    data_feeds = pipelined_get_instruments_data_feeds(instruments=instruments, from_=from_, to=to,
+                                                      interval=CandleInterval.CANDLE_INTERVAL_1_MIN)
     instruments_datas = pack_instruments_datas(instruments=instruments, data_feeds=data_feeds)
     logging.info(f'from_={from_} | to={to}\n{params_strategy} | Packed {len(instruments_datas)} data feeds')
 
-    backtester = Backtester(
+    backtester = BacktesterSweep(
         instruments_data=instruments_datas,
         strategies_data=[StrategyData(strategy=StrategyClosingOnHighs, params=params_strategy)],
     )
-    backtester.optimize()
+    await backtester.optimize_async()
+
+
+async def optimize_take_stop(from_: datetime, to: datetime, params_strategy: ParamsClosingOnHighs) -> None:
+    # entries don't depend on `take_stop`: one broker run gives them and validates the index,
+    # the whole `take_stop` grid is then scored from the index without running cerebro
+    ticker = 'GAZP'
+    take_stops = params_strategy.take_stop
+    instrument = await get_instrument_by(id=ticker, id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_TICKER,
+                                         class_code=ClassCode.TQBR)
+    data_feed = await get_data_feed(instrument=instrument, from_=from_,
+                                    to=to, interval=CandleInterval.CANDLE_INTERVAL_1_MIN)
+    backtester = Backtester(
+        instruments_data=[InstrumentData(data_feed=data_feed, ticker=ticker)],
+        strategies_data=[StrategyData(strategy=StrategyClosingOnHighs,
+                                      params=replace(params_strategy, take_stop=take_stops[0]))],
+    )
+    result = backtester.run()[0]
+
+    # entries are the signals the strategy recorded, also the ones the broker skipped or which are still open.
+    # The feed never loads the last candle
+    arrays = CandleArrays.from_candles(data_feed.candles[:-1])
+    signal_idxs = [arrays.index_of(num2date(num)) for num in backtester.strategies[0].signals[ticker]]
+    index = BracketIndex.build(arrays=arrays, signal_idxs=signal_idxs,
+                               takes=[ts[0] for ts in take_stops], stops=[ts[1] for ts in take_stops])
+    mismatches = index.validate(trades=result.trades, take=take_stops[0][0], stop=take_stops[0][1])
+    if mismatches:
+        raise Exception(f'Bracket index differs from broker in {len(mismatches)} trades:\n' + '\n'.join(mismatches))
+
+    scores = index.score_grid(take_stops=take_stops, commission=Backtester.COMMISSION)
+    for score in sorted(scores, key=lambda x: x.pnl_percent, reverse=True):
+        logging.info(f'take={score.take} | stop={score.stop} | PnL={round(score.pnl_percent * 100, 2)}% | '
+                     f'Won {score.count_won}/{score.count_trades}')
 
 
 async def main():
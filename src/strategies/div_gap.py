@@ -1,6 +1,7 @@
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from dataclasses import dataclass
+from functools import partial
 
 from tinkoff.invest import (
     CandleInterval,
@@ -13,7 +14,7 @@ from my_tinkoff.date_utils import DateTimeFactory, TZ_UTC
 from my_tinkoff.api_calls.instruments import get_dividends
 from my_tinkoff.helpers import quotation2decimal
 
-from src.multitasking import async_get_instruments_by_tickers
+from src.multitasking import async_get_instruments_by_tickers, pipelined_backtests
 from src.helpers import get_data_feed
 from src.schemas import StrategyData, InstrumentData
 from src.backtester import Backtester
@@ -45,15 +46,21 @@ class StrategyDivGap(BaseStrategy):
     )
 
     def __init__(self, dividends: list[Dividend]):
-        first_candle_dt = self.data.datetime.date(1)
-        self.dividends = [d for d in dividends if d.last_buy_date.date() >= first_candle_dt]
+        self.dividends = dividends
         self._dividends = self.dividends.copy()
         self.results: list[DividendDeviation] = []
+        self.prev_date: date | None = None
         super().__init__()
 
+    def nextstart(self):
+        first_candle_dt = self.data.datetime.date(0)
+        self.dividends = [d for d in self.dividends if d.last_buy_date.date() >= first_candle_dt]
+        self._dividends = self.dividends.copy()
+        self.next()
+
     def next(self):
         date = self.data.datetime.date(0)
-        prev_date = self.data.datetime.date(-1)
+        prev_date, self.prev_date = self.prev_date, date
 
         if self.dividends:
             closest_div = self.dividends[0]
@@ -74,19 +81,79 @@ class StrategyDivGap(BaseStrategy):
             dd.price_next = self.data.open[0]
             self.dividends.pop(0)
 
-        if len(self.data) == self.data.buflen():
-            dd_dates = [d.last_buy_date.date() for d in self._dividends]
-            res_dates = [r.last_buy_date for r in self.results]
-            for dd_date in dd_dates:
-                assert dd_date in res_dates, dd_date
-
-            for r in self.results:
-                assert r.last_buy_date in dd_dates
-                assert r.price_next, r
-                assert r.deviation, r
+    def stop(self):
+        dd_dates = [d.last_buy_date.date() for d in self._dividends]
+        res_dates = [r.last_buy_date for r in self.results]
+        for dd_date in dd_dates:
+            assert dd_date in res_dates, dd_date
+
+        for r in self.results:
+            assert r.last_buy_date in dd_dates
+            assert r.price_next, r
+            assert r.deviation, r
+
+        assert len(self.results) == len(self._dividends), \
+            f'{len(self.results)=} | {len(self._dividends)=}'
+
+
+async def prepare_backtester(
+        instrument: Instrument,
+        from_: datetime,
+        to: datetime,
+        params_strategy: ParamsDivGap,
+) -> Backtester | None:
+    # if instrument.first_1day_candle_date <= from_:
+    #     print(f'{instrument.ticker} | first_candle={instrument.first_1day_candle_date} < from_={from_}')
+
+    # print(instrument)
+    dividends = await get_dividends(instrument_id=instrument.uid, from_=from_, to=to)
+    if not dividends:
+        return None
+    dividends.sort(key=lambda x: x.last_buy_date)
+
+    for d in dividends:
+        if instrument.ticker == 'MGNT':
+            if d.last_buy_date.date() == datetime(2021, 1, 6).date():
+                d.last_buy_date = datetime(2021, 1, 5, 0, 0)
+            elif d.last_buy_date.date() == datetime(2019, 6, 12).date():
+                d.last_buy_date = datetime(2019, 6, 11, 0, 0)
+        elif instrument.ticker == 'CHMF':
+            if d.last_buy_date.date() == datetime(2020, 6, 12).date():
+                d.last_buy_date = datetime(2020, 6, 11, 0, 0)
+                d.yield_value = Quotation(units=5, nano=71)
+            elif d.last_buy_date.date() == datetime(2021, 5, 28).date():
+                d.yield_value = Quotation(units=4, nano=73)
+        elif instrument.ticker == 'GMKN':
+            if d.last_buy_date.date() == datetime(2022, 6, 13).date():
+                d.last_buy_date = d.last_buy_date.replace(day=9)
+        elif instrument.ticker == 'NLMK':
+            if d.last_buy_date.date() == datetime(2020, 1, 7).date():
+                d.last_buy_date = d.last_buy_date.replace(day=6)
+        elif instrument.ticker == 'NVTK':
+            if d.last_buy_date.date() == datetime(2022, 5, 3).date():
+                d.last_buy_date = d.last_buy_date.replace(day=29, month=4)
+        elif instrument.ticker == 'SELG':
+            if d.last_buy_date.date() == datetime(2020, 6, 24).date():
+                d.last_buy_date = d.last_buy_date.replace(day=23)
+        elif instrument.ticker == 'FLOT':
+            if d.last_buy_date.date() == datetime(2024, 4 ,1).date():
+                d.last_buy_date = d.last_buy_date.replace(day=2)
+        elif instrument.ticker == 'SBER':
+            if d.last_buy_date.date() == datetime(2019, 6, 11).date():
+                d.last_buy_date = d.last_buy_date.replace(day=10)
+        elif instrument.ticker == 'SBERP':
+            if d.last_buy_date.date() == datetime(2019, 6, 11).date():
+                d.last_buy_date = d.last_buy_date.replace(day=10)
+
+        print(d)
+    data_feed = await get_data_feed(instrument=instrument, from_=from_, to=to,
+                                    interval=CandleInterval.CANDLE_INTERVAL_DAY)
+    return Backtester(
+        instruments_data=[InstrumentData(ticker=instrument.ticker, data_feed=data_feed)],
+        strategies_data=
+        [StrategyData(strategy=StrategyDivGap, params=params_strategy, kwargs={'dividends': dividends})],
+    )
 
-            assert len(self.results) == len(self._dividends), \
-                f'{len(self.results)=} | {len(self._dividends)=}'
 
 async def backtest(from_: datetime, to: datetime, params_strategy: ParamsDivGap):
     # async with MOEX() as moex:
@@ -95,66 +162,19 @@ async def backtest(from_: datetime, to: datetime, params_strategy: ParamsDivGap)
 
     deviations = {}
     instruments = await async_get_instruments_by_tickers(tickers=tickers)
+    # dividends and candles of the next instruments are downloaded while the current one is backtested
+    # only results of the strategy are kept, candles of a finished backtest are freed
+    outputs = await pipelined_backtests(
+        instruments=instruments,
+        prepare=partial(prepare_backtester, from_=from_, to=to, params_strategy=params_strategy),
+        collect=lambda backtester, _: backtester.strategies[0].results,
+    )
 
-    for instrument in instruments:
-        # if instrument.first_1day_candle_date <= from_:
-        #     print(f'{instrument.ticker} | first_candle={instrument.first_1day_candle_date} < from_={from_}')
-
-        # print(instrument)
-        dividends = await get_dividends(instrument_id=instrument.uid, from_=from_, to=to)
-        if not dividends:
-            continue
-        dividends.sort(key=lambda x: x.last_buy_date)
-
-        for d in dividends:
-            if instrument.ticker == 'MGNT':
-                if d.last_buy_date.date() == datetime(2021, 1, 6).date():
-                    d.last_buy_date = datetime(2021, 1, 5, 0, 0)
-                elif d.last_buy_date.date() == datetime(2019, 6, 12).date():
-                    d.last_buy_date = datetime(2019, 6, 11, 0, 0)
-            elif instrument.ticker == 'CHMF':
-                if d.last_buy_date.date() == datetime(2020, 6, 12).date():
-                    d.last_buy_date = datetime(2020, 6, 11, 0, 0)
-                    d.yield_value = Quotation(units=5, nano=71)
-                elif d.last_buy_date.date() == datetime(2021, 5, 28).date():
-                    d.yield_value = Quotation(units=4, nano=73)
-            elif instrument.ticker == 'GMKN':
-                if d.last_buy_date.date() == datetime(2022, 6, 13).date():
-                    d.last_buy_date = d.last_buy_date.replace(day=9)
-            elif instrument.ticker == 'NLMK':
-                if d.last_buy_date.date() == datetime(2020, 1, 7).date():
-                    d.last_buy_date = d.last_buy_date.replace(day=6)
-            elif instrument.ticker == 'NVTK':
-                if d.last_buy_date.date() == datetime(2022, 5, 3).date():
-                    d.last_buy_date = d.last_buy_date.replace(day=29, month=4)
-            elif instrument.ticker == 'SELG':
-                if d.last_buy_date.date() == datetime(2020, 6, 24).date():
-                    d.last_buy_date = d.last_buy_date.replace(day=23)
-            elif instrument.ticker == 'FLOT':
-                if d.last_buy_date.date() == datetime(2024, 4 ,1).date():
-                    d.last_buy_date = d.last_buy_date.replace(day=2)
-            elif instrument.ticker == 'SBER':
-                if d.last_buy_date.date() == datetime(2019, 6, 11).date():
-                    d.last_buy_date = d.last_buy_date.replace(day=10)
-            elif instrument.ticker == 'SBERP':
-                if d.last_buy_date.date() == datetime(2019, 6, 11).date():
-                    d.last_buy_date = d.last_buy_date.replace(day=10)
-
-            print(d)
-        data_feed = await get_data_feed(instrument=instrument, from_=from_, to=to,
-                                        interval=CandleInterval.CANDLE_INTERVAL_DAY)
-        backtester = Backtester(
-            instruments_data=[InstrumentData(ticker=instrument.ticker, data_feed=data_feed)],
-            strategies_data=
-            [StrategyData(strategy=StrategyDivGap, params=params_strategy, kwargs={'dividends': dividends})],
-        )
-        backtester.run()
-
-        strategy = backtester.strategies[0]
-        if strategy.results:
-            average_deviation = sum([dd.deviation for dd in strategy.results]) / len(strategy.results)
+    for instrument, results in zip(instruments, outputs):
+        if results:
+            average_deviation = sum([dd.deviation for dd in results]) / len(results)
             deviations[instrument.ticker] = average_deviation
-            for r in strategy.results:
+            for r in results:
                 print(r, r.deviation)
 
     for k, v in sorted(deviations.items(), key=lambda x: abs(x[1]), reverse=True):
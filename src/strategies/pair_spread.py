@@ -1,21 +1,59 @@
+import logging
 from datetime import datetime
 
-from tinkoff.invest import InstrumentIdType
+from tinkoff.invest import InstrumentIdType, CandleInterval
 from my_tinkoff.api_calls.instruments import get_instrument_by
 from my_tinkoff.csv_candles import CSVCandles
 from my_tinkoff.date_utils import TZ_UTC
+from moex_api import MOEX
 
 from src.strategies.base import BaseStrategy
 from src.backtester import Backtester
+from src.params import ParamsPairSpread
+from src.helpers import get_and_prepare_candles
+from src.multitasking import async_get_instruments_by_tickers
+from src.candle_arrays import CandleArrays
+from src.pair_screening import AlignedCloses, PairCandidate, screen_pairs
 
 
 class StrategyPairSpread(BaseStrategy):
-    params = {}
+    params = ParamsPairSpread(
+        ticker_y='',
+        ticker_x='',
+        hedge_ratio=1,
+        intercept=0,
+        z_entry=2,
+        z_exit=.5,
+    )
 
     def __init__(self):
         ...
 
 
+async def screen(from_: datetime, to: datetime, futures: list[str], interval: CandleInterval) -> list[PairCandidate]:
+    async with MOEX() as moex:
+        tickers = await moex.get_index_composition('IMOEX')
+
+    instruments = await async_get_instruments_by_tickers(tickers=tickers)
+    for ticker in futures:
+        instruments.append(await get_instrument_by(id=ticker, id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_TICKER))
+
+    arrays_by_ticker = {}
+    for instrument in instruments:
+        candles = await get_and_prepare_candles(instrument=instrument, from_=from_, to=to, interval=interval)
+        if candles:
+            arrays_by_ticker[instrument.ticker] = CandleArrays.from_candles(candles)
+
+    aligned = AlignedCloses.from_arrays(arrays_by_ticker)
+    logging.info(f'Screening {len(aligned.tickers)} tickers on {len(aligned.times)} bars')
+    candidates = screen_pairs(aligned=aligned, processes=Backtester.CPU_CORES_COUNT)
+    for c in candidates[:20]:
+        logging.info(f'{c.ticker_y}/{c.ticker_x} | coint_stat={round(c.coint_stat, 2)} | '
+                     f'half_life={round(c.half_life, 1)} | zscore={round(c.zscore, 2)} | '
+                     f'hedge_ratio={round(c.hedge_ratio, 3)}')
+    return candidates
+
+
 async def main():
     to = datetime(year=2024, month=2, day=23, tzinfo=TZ_UTC)
     from_ = datetime(year=2018, month=3, day=8, tzinfo=TZ_UTC)
@@ -27,5 +65,7 @@ async def main():
     print(instrument)
     # await CSVCandles.download_or_read()
 
+    # candidates = await screen(from_=from_, to=to, futures=['SRM4'], interval=CandleInterval.CANDLE_INTERVAL_DAY)
+    # params_strategy = candidates[0].get_params(z_entry=[1.5, 2, 2.5], z_exit=[0, .5])
     # await backtest(from_=from_, to=to, params_strategy=params_strategy)
     # await optimize(from_=from_, to=to, params_strategy=params_strategy)
@@ -0,0 +1,106 @@
+import random
+from datetime import datetime, timedelta
+
+from tinkoff.invest import Dividend, Quotation
+from my_tinkoff.date_utils import TZ_UTC
+from my_tinkoff.schemas import Candles, Candle
+
+from src.candle_arrays import get_decimals
+
+
+# Deterministic candles for benchmarks and regression checks, `random.Random` gives the same
+# sequence for the same seed on every platform and Python version
+
+
+def make_minute_candles(
+        seed: int,
+        count_days: int,
+        bars_per_day: int = 60,
+        percent_missing: float = 0,
+        from_: datetime = datetime(2023, 1, 2, tzinfo=TZ_UTC),
+        tick_size: float | None = None,
+) -> Candles:
+    # minutes before 20:50 UTC of weekdays, some days end with a rally on high volume.
+    # With `tick_size` prices are rounded to its decimals, as parsed from files
+    decimals = None if tick_size is None else get_decimals(tick_size)
+    rnd = random.Random(seed)
+    candles = Candles()
+    price = 100.
+    day = from_
+    count_made = 0
+    while count_made < count_days:
+        if day.weekday() >= 5:
+            day += timedelta(days=1)
+            continue
+
+        first_dt = day.replace(hour=20, minute=49) - timedelta(minutes=bars_per_day - 1)
+        is_rally = rnd.random() < .3
+        for k in range(bars_per_day):
+            if 0 < k < bars_per_day - 3 and rnd.random() < percent_missing:
+                continue
+
+            drift = .004 if is_rally and k > bars_per_day // 2 else 0
+            open_ = price
+            close = max(1., open_ * (1 + rnd.gauss(drift, .003)))
+            high = max(open_, close) * (1 + abs(rnd.gauss(0, .002)))
+            low = min(open_, close) * (1 - abs(rnd.gauss(0, .002)))
+            if decimals is not None:
+                open_, high, low, close = (round(x, decimals) for x in (open_, high, low, close))
+            candles.append(Candle(
+                open=open_,
+                high=high,
+                low=low,
+                close=close,
+                volume=rnd.randint(100, 1000) * (5 if is_rally else 1),
+                time=first_dt + timedelta(minutes=k),
+                is_complete=True,
+            ))
+            price = close
+        day += timedelta(days=1)
+        count_made += 1
+    return candles
+
+
+def make_long_minute_candles(seed: int, count_days: int, segment_days: int = 120, **kwargs) -> Candles:
+    # Prices of one long walk drift out of any range, so a long history is made of segments
+    # which start over from the same price on the next weekday
+    candles = Candles()
+    from_ = kwargs.pop('from_', datetime(2018, 1, 1, tzinfo=TZ_UTC))
+    for k in range(0, count_days, segment_days):
+        segment = make_minute_candles(seed=seed * 1000 + k, count_days=min(segment_days, count_days - k),
+                                      from_=from_, **kwargs)
+        candles.extend(segment)
+        from_ = (segment[-1].time + timedelta(days=1)).replace(hour=0, minute=0)
+    return candles
+
+
+def make_day_candles(seed: int, count_days: int, from_: datetime = datetime(2020, 1, 1, 7, tzinfo=TZ_UTC)) -> Candles:
+    rnd = random.Random(seed)
+    candles = Candles()
+    price = 100.
+    day = from_
+    while len(candles) < count_days:
+        if day.weekday() < 5:
+            open_ = price * (1 + rnd.gauss(0, .005))
+            close = max(1., open_ * (1 + rnd.gauss(0, .015)))
+            candles.append(Candle(
+                open=open_,
+                high=max(open_, close) * (1 + abs(rnd.gauss(0, .005))),
+                low=min(open_, close) * (1 - abs(rnd.gauss(0, .005))),
+                close=close,
+                volume=rnd.randint(10_000, 100_000),
+                time=day,
+                is_complete=True,
+            ))
+            price = close
+        day += timedelta(days=1)
+    return candles
+
+
+def make_dividends(candles: Candles, idxs: list[int], percent_yield: float = 5) -> list[Dividend]:
+    return [
+        Dividend(
+            last_buy_date=candles[i].time,
+            yield_value=Quotation(units=int(percent_yield), nano=int(percent_yield % 1 * 10 ** 9)),
+        ) for i in idxs
+    ]
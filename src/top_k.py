@@ -0,0 +1,88 @@
+import heapq
+import math
+from dataclasses import dataclass
+from typing import Callable, Literal
+
+from backtrader.metabase import ItemCollection
+
+from src.schemas import StrategyResult
+
+
+Metric = Literal['sharpe', 'pnl', 'return_drawdown']
+
+
+def get_metric(analyzers: ItemCollection, metric: Metric, start_cash: float) -> float:
+    # computed from analyzers of a run, so a StrategyResult is built only for combos of the top
+    if metric == 'sharpe':
+        ratio = analyzers.sharpe.ratio
+        return -math.inf if ratio is None else ratio
+
+    pnl = sum(t['pnlcomm'] for t in analyzers.trade_list.get_analysis())
+    if metric == 'pnl':
+        return pnl
+    elif metric == 'return_drawdown':
+        return get_return_drawdown(pnl=pnl, start_cash=start_cash,
+                                   drawdown=analyzers.drawdown.get_analysis()['maxdrawdown'])
+    raise Exception(f'Unknown metric: {metric}')
+
+
+def get_return_drawdown(pnl: float, start_cash: float, drawdown: float) -> float:
+    # both in percents, no drawdown counts as a tiny one
+    return pnl / start_cash * 100 / max(drawdown, 1e-6)
+
+
+@dataclass
+class MetricSummary:
+    # running stats of all combos, not only of the top
+    metric: Metric
+    count: int = 0
+    count_undefined: int = 0
+    mean: float = 0
+    m2: float = 0
+    min: float = math.inf
+    max: float = -math.inf
+
+    def add(self, value: float) -> None:
+        if not math.isfinite(value):
+            self.count_undefined += 1
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / self.count) if self.count else 0
+
+    def __repr__(self) -> str:
+        return (f'{self.metric} of {self.count} combos | Mean: {round(self.mean, 4)} | Std: {round(self.std, 4)} | '
+                f'Min: {round(self.min, 4)} | Max: {round(self.max, 4)} | Undefined: {self.count_undefined}')
+
+
+class TopK:
+    def __init__(self, k: int, metric: Metric):
+        if k < 1:
+            raise Exception(f'k must be positive: {k}')
+        self.k = k
+        self.metric = metric
+        self.summary = MetricSummary(metric=metric)
+        # min-heap of (value, -order, result), on equal values the earlier combo stays
+        self._heap: list[tuple[float, int, StrategyResult]] = []
+        self._count_pushed = 0
+
+    def push(self, value: float, get_result: Callable[[], StrategyResult]) -> None:
+        self.summary.add(value)
+        key = (value if math.isfinite(value) else -math.inf, -self._count_pushed)
+        self._count_pushed += 1
+
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, (*key, get_result()))
+        elif key > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, (*key, get_result()))
+
+    def get_results(self) -> list[StrategyResult]:
+        # the best first
+        return [res for *_, res in sorted(self._heap, key=lambda x: x[:2], reverse=True)]
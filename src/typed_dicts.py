@@ -1,5 +1,7 @@
+from datetime import datetime
 from typing import TypedDict, Iterable, NamedTuple
 
+import numpy as np
 from backtrader import TimeFrame
 
 from src.sizers import SizerPercentOfCash
@@ -24,3 +26,43 @@ class AnalysisPeriodStats(TypedDict):
     nochange: int
     best: float
     worst: float
+
+
+class AnalysisTrade(TypedDict):
+    ticker: str
+    dt_open: datetime
+    dt_close: datetime
+    price_open: float
+    price_close: float
+    size: float
+    pnl: float
+    pnlcomm: float
+    bars: int
+
+
+class AnalysisScreening(TypedDict):
+    value: float
+    pnl: float  # of closed trades
+    count_trades: int
+    max_drawdown: float  # percent
+
+
+class AnalysisEquity(TypedDict):
+    times: np.ndarray  # unix timestamps in seconds
+    values: np.ndarray
+
+
+class AnalysisMemory(TypedDict):
+    # sizes in MB, measured in the process which ran the strategy
+    pid: int
+    peak_rss_mb: float
+    line_buffers: dict[str, float]  # by data name, strategy's own lines, indicators and observers
+    strategy_state: float
+    analyzers: dict[str, float]
+
+
+class MemoryReport(TypedDict, total=False):
+    run: AnalysisMemory | None
+    candles: dict[str, float]  # by ticker
+    results: float  # pickled results of the whole run/optimize
+    phases_peak_rss_mb: dict[str, float]  # of the main process
@@ -0,0 +1,186 @@
+import os
+import time
+import pickle
+import logging
+from pathlib import Path
+from datetime import datetime
+from dataclasses import dataclass
+from typing import Type, Any
+
+from tinkoff.invest import CandleInterval
+
+from src.strategies.base import BaseStrategy
+from src.schemas import StrategyResult
+from src.params import AnyParamsStrategy
+from src.checkpoints import get_combo_key
+from src.helpers import get_spec_hash, write_atomic
+
+
+@dataclass
+class WorkTask:
+    strategy: Type[BaseStrategy]
+    params: AnyParamsStrategy
+    tickers: list[str]
+    from_: datetime
+    to: datetime
+    interval: CandleInterval
+    attempts: int = 0
+
+    @property
+    def name(self) -> str:
+        spec = (self.strategy.__name__, get_combo_key(self.params.__dict__), self.tickers, self.from_, self.to,
+                self.interval)
+        return get_spec_hash(spec)
+
+
+@dataclass
+class TaskFailure:
+    worker_id: str
+    error: str
+    attempts: int
+
+
+class WorkQueue:
+    # Directory based queue, which can be shared between hosts (NFS, SMB, ...).
+    # A task is claimed by renaming its file from `tasks` to `leases`, rename is atomic, so only one worker wins.
+    # Workers touch the lease file while running a task, leases which weren't touched for `lease_timeout`
+    # seconds are returned to `tasks` by the publisher.
+    # A task which raised or whose lease expired `max_attempts` times is moved to `failed` with its error.
+    DIRNAME_TASKS = 'tasks'
+    DIRNAME_LEASES = 'leases'
+    DIRNAME_RESULTS = 'results'
+    DIRNAME_FAILED = 'failed'
+    SUFFIX = '.pickle'
+    POLL_INTERVAL: float = 5
+
+    def __init__(self, dirpath: Path, lease_timeout: float = 600, max_attempts: int = 3):
+        self.dirpath = dirpath
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.dir_tasks = dirpath / self.DIRNAME_TASKS
+        self.dir_leases = dirpath / self.DIRNAME_LEASES
+        self.dir_results = dirpath / self.DIRNAME_RESULTS
+        self.dir_failed = dirpath / self.DIRNAME_FAILED
+        for d in (self.dir_tasks, self.dir_leases, self.dir_results, self.dir_failed):
+            d.mkdir(parents=True, exist_ok=True)
+
+    def publish(self, tasks: list[WorkTask]) -> list[str]:
+        # a name for every task, equal tasks are published once
+        names = []
+        for task in tasks:
+            name = task.name + self.SUFFIX
+            if name in names:
+                names.append(name)
+                continue
+            names.append(name)
+            # a new sweep retries tasks which failed before
+            (self.dir_failed / name).unlink(missing_ok=True)
+            if (self.dir_results / name).exists() or (self.dir_leases / name).exists():
+                continue
+            write_atomic(self.dir_tasks / name, pickle.dumps(task))
+        return names
+
+    def claim(self, worker_id: str) -> tuple[str, WorkTask] | None:
+        for filepath in sorted(self.dir_tasks.glob(f'*{self.SUFFIX}')):
+            filepath_lease = self.dir_leases / filepath.name
+            try:
+                os.rename(filepath, filepath_lease)
+            except FileNotFoundError:
+                # claimed by another worker
+                continue
+
+            self.heartbeat(filepath.name)
+            with open(filepath_lease, 'rb') as f:
+                task = pickle.load(f)
+            logging.info(f'Worker {worker_id} claimed {filepath.name}')
+            return filepath.name, task
+        return None
+
+    def heartbeat(self, name: str) -> None:
+        try:
+            os.utime(self.dir_leases / name)
+        except FileNotFoundError:
+            # lease expired and was returned to the queue, result will be accepted anyway
+            pass
+
+    def complete(self, name: str, task: WorkTask, result: Any) -> None:
+        # a result of a worker whose lease expired is accepted anyway, the lease of the worker which claimed
+        # the task again is left to it
+        write_atomic(self.dir_results / name, pickle.dumps(result))
+        self._release(name=name, task=task)
+        (self.dir_tasks / name).unlink(missing_ok=True)
+
+    def fail(self, name: str, task: WorkTask, worker_id: str, error: str) -> None:
+        # the lease is dropped first, so the task can't be claimed again while its lease is still there.
+        # An expired lease was counted as an attempt when it was requeued
+        if not self._release(name=name, task=task):
+            logging.warning(f'Worker {worker_id} lost the lease of {name}, its error is dropped: {error}')
+            return
+        self._retry(name=name, task=task, worker_id=worker_id, error=error)
+
+    def _release(self, name: str, task: WorkTask) -> bool:
+        # Taken over by renaming as in `requeue_expired`. Attempts of a task grow with every requeue,
+        # so a lease with other attempts belongs to the worker which claimed the task after it expired
+        filepath = self.dir_leases / name
+        filepath_released = filepath.with_name(f'.{name}.{os.getpid()}.released')
+        try:
+            os.rename(filepath, filepath_released)
+        except FileNotFoundError:
+            return False
+
+        with open(filepath_released, 'rb') as f:
+            owned = pickle.load(f).attempts == task.attempts
+        if owned:
+            filepath_released.unlink()
+        else:
+            os.rename(filepath_released, filepath)
+        return owned
+
+    def requeue_expired(self) -> int:
+        count = 0
+        now = time.time()
+        for filepath in self.dir_leases.glob(f'*{self.SUFFIX}'):
+            try:
+                expired = now - filepath.stat().st_mtime > self.lease_timeout
+                if not expired or (self.dir_results / filepath.name).exists():
+                    continue
+                # taken over by renaming, so a heartbeat of a late worker doesn't keep the lease alive
+                filepath_expired = filepath.with_name(f'.{filepath.name}.expired')
+                os.rename(filepath, filepath_expired)
+            except FileNotFoundError:
+                continue
+
+            with open(filepath_expired, 'rb') as f:
+                task = pickle.load(f)
+            filepath_expired.unlink()
+            self._retry(name=filepath.name, task=task, worker_id='', error='Lease expired')
+            count += 1
+        return count
+
+    def _retry(self, name: str, task: WorkTask, worker_id: str, error: str) -> None:
+        task.attempts += 1
+        if task.attempts >= self.max_attempts:
+            failure = TaskFailure(worker_id=worker_id, error=error, attempts=task.attempts)
+            write_atomic(self.dir_failed / name, pickle.dumps(failure))
+            logging.error(f'Task {name} failed {task.attempts} times. Last error: {error}')
+        else:
+            write_atomic(self.dir_tasks / name, pickle.dumps(task))
+            logging.warning(f'Task {name} returned to queue after attempt {task.attempts}: {error}')
+
+    def get_results(self, names: list[str]) -> dict[str, StrategyResult]:
+        results = {}
+        for name in names:
+            filepath = self.dir_results / name
+            if filepath.exists():
+                with open(filepath, 'rb') as f:
+                    results[name] = pickle.load(f)
+        return results
+
+    def get_failures(self, names: list[str]) -> dict[str, TaskFailure]:
+        failures = {}
+        for name in names:
+            filepath = self.dir_failed / name
+            if filepath.exists():
+                with open(filepath, 'rb') as f:
+                    failures[name] = pickle.load(f)
+        return failures
@@ -0,0 +1,97 @@
+import os
+import socket
+import asyncio
+import logging
+import argparse
+import threading
+import traceback
+from pathlib import Path
+
+from config import FILEPATH_LOGGER
+from src.my_logging import get_logger
+from src import helpers
+from src.backtester import Backtester
+from src.helpers import get_data_feed, pack_instruments_datas
+from src.multitasking import async_get_instruments_by_tickers
+from src.schemas import StrategyData, InstrumentData
+from src.work_queue import WorkQueue, WorkTask
+
+
+class Worker:
+    def __init__(self, queue: WorkQueue, worker_id: str | None = None):
+        self.queue = queue
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self._instruments_data: dict[tuple, list[InstrumentData]] = {}
+
+    async def run(self, exit_when_empty: bool = False) -> None:
+        logging.info(f'Worker {self.worker_id} started on {self.queue.dirpath}')
+        while True:
+            claimed = self.queue.claim(worker_id=self.worker_id)
+            if claimed is None:
+                if exit_when_empty:
+                    return
+                await asyncio.sleep(self.queue.POLL_INTERVAL)
+                continue
+
+            name, task = claimed
+            try:
+                instruments_data = await self._get_instruments_data(task)
+                result = self._run_task(name=name, task=task, instruments_data=instruments_data)
+            except Exception:
+                logging.exception(f'Worker {self.worker_id} failed {name}')
+                self.queue.fail(name=name, task=task, worker_id=self.worker_id, error=traceback.format_exc())
+                continue
+            self.queue.complete(name=name, task=task, result=result)
+
+    def _run_task(self, name: str, task: WorkTask, instruments_data: list[InstrumentData]):
+        stop_heartbeat = threading.Event()
+
+        def heartbeat() -> None:
+            while not stop_heartbeat.wait(self.queue.lease_timeout / 3):
+                self.queue.heartbeat(name)
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            backtester = Backtester(
+                strategies_data=[StrategyData(strategy=task.strategy, params=task.params)],
+                instruments_data=instruments_data,
+            )
+            return backtester.run()[0]
+        finally:
+            stop_heartbeat.set()
+            thread.join()
+
+    async def _get_instruments_data(self, task: WorkTask) -> list[InstrumentData]:
+        # tasks of one sweep share data, so feeds are built once from locally cached candles
+        key = (tuple(task.tickers), task.from_, task.to, task.interval)
+        if key not in self._instruments_data:
+            self._instruments_data.clear()
+            instruments = await async_get_instruments_by_tickers(tickers=task.tickers)
+            data_feeds = [await get_data_feed(instrument=i, from_=task.from_, to=task.to, interval=task.interval)
+                          for i in instruments]
+            self._instruments_data[key] = pack_instruments_datas(instruments=instruments, data_feeds=data_feeds)
+        return self._instruments_data[key]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Pull optimization tasks from a shared queue directory')
+    parser.add_argument('dirpath', type=Path)
+    parser.add_argument('--lease-timeout', type=float, default=600)
+    parser.add_argument('--max-attempts', type=int, default=3)
+    parser.add_argument('--exit-when-empty', action='store_true')
+    parser.add_argument('--memory-report', action='store_true', help='Attach memory usage to results')
+    parser.add_argument('--compact-candles', action='store_true', help='Cache candles as int32 arrays')
+    args = parser.parse_args()
+
+    Backtester.LOGGING = False
+    Backtester.MEMORY_REPORT = args.memory_report
+    helpers.compact_candles = args.compact_candles
+    queue = WorkQueue(dirpath=args.dirpath, lease_timeout=args.lease_timeout, max_attempts=args.max_attempts)
+    worker = Worker(queue=queue)
+    await worker.run(exit_when_empty=args.exit_when_empty)
+
+
+if __name__ == '__main__':
+    get_logger(FILEPATH_LOGGER, queued=True)
+    asyncio.run(main())
@@ -0,0 +1,41 @@
+import pytest
+
+from src.checkpoints import OptimizationCheckpoint
+
+
+SPEC = {'strategy': 'StrategyClosingOnHighs', 'tickers': ['SYN0', 'SYN1']}
+
+
+def save_and_cut(tmp_path, count_bytes_cut: int) -> OptimizationCheckpoint:
+    # the last record is written partly, as by a crash in the middle of `save_result`
+    checkpoint = OptimizationCheckpoint(dirpath=tmp_path, spec=SPEC)
+    for k in range(3):
+        checkpoint.save_result(f'combo={k}', {'pnl': k, 'trades': list(range(100))})
+    size_valid = checkpoint.filepath_results.stat().st_size
+    checkpoint.save_result('combo=3', {'pnl': 3, 'trades': list(range(100))})
+    with open(checkpoint.filepath_results, 'r+b') as f:
+        f.truncate(size_valid + count_bytes_cut)
+    return checkpoint
+
+
+@pytest.mark.parametrize('count_bytes_cut', [3, 8, 50])
+def test_cut_record_is_truncated(tmp_path, count_bytes_cut):
+    checkpoint = save_and_cut(tmp_path, count_bytes_cut=count_bytes_cut)
+    assert list(checkpoint.load_results()) == ['combo=0', 'combo=1', 'combo=2']
+
+    # records saved after the cut one are loaded by the next resume
+    checkpoint.save_result('combo=3', {'pnl': 3, 'trades': []})
+    checkpoint.save_result('combo=4', {'pnl': 4, 'trades': []})
+    results = OptimizationCheckpoint(dirpath=tmp_path, spec=SPEC).load_results()
+    assert list(results) == [f'combo={k}' for k in range(5)]
+    assert results['combo=4'] == {'pnl': 4, 'trades': []}
+
+
+def test_broken_record_is_skipped(tmp_path):
+    checkpoint = OptimizationCheckpoint(dirpath=tmp_path, spec=SPEC)
+    checkpoint.save_result('combo=0', {'pnl': 0})
+    with open(checkpoint.filepath_results, 'ab') as f:
+        f.write(checkpoint.RECORD_HEADER.pack(4) + b'junk')
+    checkpoint.save_result('combo=1', {'pnl': 1})
+    assert OptimizationCheckpoint(dirpath=tmp_path, spec=SPEC).load_results() == {
+        'combo=0': {'pnl': 0}, 'combo=1': {'pnl': 1}}
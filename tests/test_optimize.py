@@ -0,0 +1,32 @@
+import pytest
+
+from src.backtester import Backtester
+from src.regression import params_closing_on_highs, _get_minute_instruments_data
+from src.schemas import StrategyData
+from src.strategies.closing_on_highs import StrategyClosingOnHighs
+
+
+@pytest.fixture(autouse=True)
+def no_logging(monkeypatch):
+    monkeypatch.setattr(Backtester, 'LOGGING', False)
+
+
+def optimize(cpu_cores_count: int, monkeypatch):
+    monkeypatch.setattr(Backtester, 'CPU_CORES_COUNT', cpu_cores_count)
+    return Backtester(
+        strategies_data=[StrategyData(strategy=StrategyClosingOnHighs, params=params_closing_on_highs)],
+        instruments_data=_get_minute_instruments_data(),
+    ).optimize()
+
+
+def test_pooled_optimize_of_several_feeds(monkeypatch):
+    # analyzers of several feeds come back from pool workers without their strategy and its observers
+    results = optimize(cpu_cores_count=2, monkeypatch=monkeypatch)
+    expected = optimize(cpu_cores_count=1, monkeypatch=monkeypatch)
+
+    assert len(_get_minute_instruments_data()) > 1
+    assert len(results) == len(expected) == 4
+    for res, res_expected in zip(results, expected):
+        assert res.params == res_expected.params
+        assert res.trades == res_expected.trades
+        assert res.sharpe == res_expected.sharpe
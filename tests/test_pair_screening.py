@@ -0,0 +1,38 @@
+import numpy as np
+
+from src.pair_screening import AlignedCloses, screen_pairs
+
+
+COUNT_BARS = 500
+
+
+def get_aligned(spread: np.ndarray) -> AlignedCloses:
+    rng = np.random.default_rng(0)
+    log_x = np.cumsum(rng.normal(0, 0.01, COUNT_BARS)) + 5
+    log_trend = np.cumsum(rng.normal(0, 0.01, COUNT_BARS)) + 5
+    return AlignedCloses(
+        tickers=['Y', 'X', 'TREND'],
+        times=np.arange(COUNT_BARS),
+        log_closes=np.column_stack([log_x + spread, log_x, log_trend]),
+    )
+
+
+def test_strongly_reverting_pair_is_kept():
+    # the spread flips its sign every bar, the Dickey-Fuller slope is about -2
+    spread = np.where(np.arange(COUNT_BARS) % 2, 0.01, -0.01) + np.random.default_rng(1).normal(0, 0.001, COUNT_BARS)
+    candidates = screen_pairs(get_aligned(spread), max_half_life=20)
+    best = candidates[0]
+    assert {best.ticker_y, best.ticker_x} == {'Y', 'X'}
+    assert best.half_life == 0
+    assert best.coint_stat < -3.34
+
+
+def test_half_life_of_slow_reversion():
+    # AR(1) spread with coefficient 0.9, half-life is log(0.5) / log(0.9), about 6.6 bars
+    rng = np.random.default_rng(2)
+    spread = np.zeros(COUNT_BARS)
+    for k in range(1, COUNT_BARS):
+        spread[k] = 0.9 * spread[k - 1] + rng.normal(0, 0.01)
+    candidates = screen_pairs(get_aligned(spread))
+    pair = next(c for c in candidates if {c.ticker_y, c.ticker_x} == {'Y', 'X'})
+    assert 4 < pair.half_life < 10
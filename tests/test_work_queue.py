@@ -0,0 +1,129 @@
+import asyncio
+import multiprocessing
+from datetime import datetime
+from dataclasses import replace
+from pathlib import Path
+
+import pytest
+from tinkoff.invest import CandleInterval
+from my_tinkoff.date_utils import TZ_UTC
+
+from src.backtester import Backtester
+from src.regression import params_closing_on_highs, _get_minute_instruments_data
+from src.schemas import StrategyData, InstrumentData
+from src.params import ParamsClosingOnHighs
+from src.strategies.closing_on_highs import StrategyClosingOnHighs
+from src.work_queue import WorkQueue, WorkTask
+from src.worker import Worker
+
+
+COUNT_WORKERS = 3
+FROM = datetime(2023, 1, 1, tzinfo=TZ_UTC)
+TO = datetime(2023, 7, 1, tzinfo=TZ_UTC)
+
+
+class SyntheticWorker(Worker):
+    async def _get_instruments_data(self, task: WorkTask) -> list[InstrumentData]:
+        return _get_minute_instruments_data()
+
+
+class BrokenWorker(SyntheticWorker):
+    def _run_task(self, name: str, task: WorkTask, instruments_data: list[InstrumentData]):
+        raise Exception('Broken worker')
+
+
+def run_worker(worker_class: type[Worker], dirpath: Path, max_attempts: int) -> None:
+    Backtester.LOGGING = False
+    queue = WorkQueue(dirpath=dirpath, max_attempts=max_attempts)
+    asyncio.run(worker_class(queue=queue).run())
+
+
+def optimize_with_workers(
+        worker_class: type[Worker],
+        dirpath: Path,
+        max_attempts: int = 3,
+        params: ParamsClosingOnHighs = params_closing_on_highs,
+):
+    # workers are processes of this machine which share the queue directory with the publisher
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=run_worker, args=(worker_class, dirpath, max_attempts))
+                 for _ in range(COUNT_WORKERS)]
+    for p in processes:
+        p.start()
+    try:
+        backtester = Backtester(
+            strategies_data=[StrategyData(strategy=StrategyClosingOnHighs, params=params)],
+            instruments_data=_get_minute_instruments_data(),
+        )
+        return backtester.optimize_distributed(queue=WorkQueue(dirpath=dirpath, max_attempts=max_attempts),
+                                               from_=FROM, to=TO, interval=CandleInterval.CANDLE_INTERVAL_1_MIN)
+    finally:
+        for p in processes:
+            p.terminate()
+            p.join()
+
+
+@pytest.fixture(autouse=True)
+def fast_queue(monkeypatch):
+    monkeypatch.setattr(Backtester, 'LOGGING', False)
+    monkeypatch.setattr(WorkQueue, 'POLL_INTERVAL', .1)
+
+
+def test_workers_match_optimize(tmp_path):
+    results = optimize_with_workers(SyntheticWorker, dirpath=tmp_path)
+    expected = Backtester(
+        strategies_data=[StrategyData(strategy=StrategyClosingOnHighs, params=params_closing_on_highs)],
+        instruments_data=_get_minute_instruments_data(),
+    ).optimize()
+
+    assert len(results) == len(expected) == 4
+    for res, res_expected in zip(results, expected):
+        assert res.params == res_expected.params
+        assert res.trades == res_expected.trades
+    assert not list((tmp_path / WorkQueue.DIRNAME_TASKS).iterdir())
+    assert not list((tmp_path / WorkQueue.DIRNAME_LEASES).iterdir())
+
+
+def test_failed_tasks_raise(tmp_path):
+    # the publisher raises on the first task which ran out of attempts
+    with pytest.raises(Exception, match=r'\d/4 tasks failed') as exc_info:
+        optimize_with_workers(BrokenWorker, dirpath=tmp_path, max_attempts=2)
+    assert 'Broken worker' in str(exc_info.value)
+
+    failures = WorkQueue(dirpath=tmp_path).get_failures(
+        [p.name for p in (tmp_path / WorkQueue.DIRNAME_FAILED).iterdir()])
+    assert failures
+    assert all(f.attempts == 2 and 'Broken worker' in f.error for f in failures.values())
+    assert not list((tmp_path / WorkQueue.DIRNAME_RESULTS).iterdir())
+
+
+def test_equal_combos(tmp_path):
+    # equal combos are one task, every combo gets its result
+    params = replace(params_closing_on_highs, c_price_change=[1, 1], take_stop=[(.01, .005)])
+    results = optimize_with_workers(SyntheticWorker, dirpath=tmp_path, params=params)
+    assert len(results) == 2
+    assert results[0].trades == results[1].trades
+    assert len(list((tmp_path / WorkQueue.DIRNAME_RESULTS).iterdir())) == 1
+
+
+def test_expired_lease_is_not_released(tmp_path):
+    queue = WorkQueue(dirpath=tmp_path, lease_timeout=-1, max_attempts=5)
+    [name] = queue.publish([WorkTask(strategy=StrategyClosingOnHighs, params=params_closing_on_highs,
+                                     tickers=['SYN0'], from_=FROM, to=TO,
+                                     interval=CandleInterval.CANDLE_INTERVAL_1_MIN)])
+    _, task_late = queue.claim(worker_id='late')
+    assert queue.requeue_expired() == 1
+    _, task = queue.claim(worker_id='next')
+    assert task.attempts == 1
+
+    # the late worker neither counts an attempt nor drops the lease of the next one
+    queue.fail(name=name, task=task_late, worker_id='late', error='Late error')
+    assert (tmp_path / WorkQueue.DIRNAME_LEASES / name).exists()
+    assert not list((tmp_path / WorkQueue.DIRNAME_TASKS).iterdir())
+
+    queue.fail(name=name, task=task, worker_id='next', error='Error')
+    _, task = queue.claim(worker_id='next')
+    assert task.attempts == 2
+    queue.complete(name=name, task=task_late, result='late result')
+    assert (tmp_path / WorkQueue.DIRNAME_LEASES / name).exists()
+    assert queue.get_results([name]) == {name: 'late result'}